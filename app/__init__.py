@@ -7,6 +7,7 @@ from flask_bootstrap import Bootstrap
 
 # local imports
 from config import app_config
+from app import profiler, sessions
 
 # db variable initialization
 db = SQLAlchemy()
@@ -15,8 +16,18 @@ login_manager = LoginManager()
 def create_app(config_name):
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_object(app_config[config_name])
-    app.config.from_pyfile('config.py')
+    if not app.testing:
+        # the tests never touch the database of the instance
+        app.config.from_pyfile('config.py')
+    if app.config.get('DB_POOL_METRICS') and \
+            'pool_size' in app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}):
+        from .dbpool import MeteredQueuePool
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'],
+            poolclass=MeteredQueuePool)
+    sessions.init_app(app)
     db.init_app(app)
+    profiler.init_app(app, db)
 
 
     login_manager.init_app(app)
@@ -24,7 +35,9 @@ def create_app(config_name):
     login_manager.login_view = "auth.login"
     migrate = Migrate(app, db)
 
-    from app import models
+    from app import changes, kpis, models, versions
+    models.principal_cache.configure(app.config['PRINCIPAL_CACHE_SIZE'],
+                                     app.config['PRINCIPAL_CACHE_TTL'])
 
     from .admin import admin as admin_blueprint
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
@@ -35,8 +48,17 @@ def create_app(config_name):
     from .home import home as home_blueprint
     app.register_blueprint(home_blueprint)
 
+    from .api import api as api_blueprint
+    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
+
     Bootstrap(app)
 
+    from .commands import catalogue_cli, outbox_cli, session_cli, stock_cli
+    app.cli.add_command(stock_cli)
+    app.cli.add_command(session_cli)
+    app.cli.add_command(catalogue_cli)
+    app.cli.add_command(outbox_cli)
+
     from app import models
 
     @app.errorhandler(403)
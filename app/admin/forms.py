@@ -1,8 +1,9 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, IntegerField, DateTimeField, SelectField
+from flask_wtf.file import FileAllowed, FileField, FileRequired
+from wtforms import StringField, SubmitField, IntegerField, DateTimeField, SelectField, BooleanField, HiddenField
 from wtforms.validators import DataRequired
-from wtforms_sqlalchemy.fields import QuerySelectField
 
+from .. import importer, reference
 from ..models import Department, Role, Unit, Supplier, Employee, Parcel, Condition, Direction
 
 class DepartmentForm(FlaskForm):
@@ -27,10 +28,8 @@ class EmployeeAssignForm(FlaskForm):
     """
     Form for admin to assign departments and roles to employees
     """
-    department = QuerySelectField(query_factory=lambda: Department.query.all(),
-                                  get_label="name")
-    role = QuerySelectField(query_factory=lambda: Role.query.all(),
-                            get_label="name")
+    department_id = SelectField('Department', coerce=int, choices=lambda: reference.choices('departments'))
+    role_id = SelectField('Role', coerce=int, choices=lambda: reference.choices('roles'))
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
 
@@ -58,8 +57,10 @@ class ConsumableForm(FlaskForm):
     quantity = IntegerField('Quantity', validators=[DataRequired()])
     min_stock = IntegerField('Minimum stock')
     description = StringField('Description', validators=[DataRequired()])
-    unit_id = QuerySelectField(query_factory=lambda: Unit.query.all(), get_label="unit_type")
-    supplier_id = QuerySelectField(query_factory=lambda: Supplier.query.all(), get_label="name")
+    unit_id = SelectField(coerce=int, choices=lambda: reference.choices('units'))
+    supplier_id = SelectField(coerce=int, choices=lambda: reference.choices('suppliers'))
+    # quantity the edit form was rendered with
+    loaded_quantity = HiddenField()
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
 
@@ -77,7 +78,7 @@ class ConsumableDeliveryForm(FlaskForm):
     Form for admin to add consumables delivery
     """
     quantity = IntegerField('Quantity')
-    supplier_id = QuerySelectField(query_factory=lambda: Supplier.query.all(), get_label="name")
+    supplier_id = SelectField(coerce=int, choices=lambda: reference.choices('suppliers'))
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
 
@@ -100,6 +101,7 @@ class ConditionForm(FlaskForm):
     """
 
     name = StringField('Name', validators=[DataRequired()])
+    returns_to_stock = BooleanField('Received packages return to stock')
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
 
@@ -117,7 +119,7 @@ class PackageForm(FlaskForm):
     Form for admin to add
     """
 
-    parcel_id = QuerySelectField(query_factory=lambda: Parcel.query.all(), get_label="name")
+    parcel_id = SelectField(coerce=int, choices=lambda: reference.choices('parcels'))
     quantity = IntegerField('Quantity')
     # inside = IntegerField('Inside')
     # outside = IntegerField('Outside')
@@ -133,6 +135,9 @@ class PackageFormEdit(FlaskForm):
     quantity = IntegerField('Quantity')
     inside = IntegerField('Inside')
     description = StringField('Description')
+    # counters the form was rendered with
+    loaded_quantity = HiddenField()
+    loaded_inside = HiddenField()
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
 
@@ -142,8 +147,8 @@ class PackageReceiveForm(FlaskForm):
     """
 
     quantity = IntegerField('Quantity')
-    condition = QuerySelectField(query_factory=lambda: Condition.query.all(), get_label="name")
-    supplier = QuerySelectField(query_factory=lambda: Supplier.query.all(), get_label="name")
+    condition = SelectField(coerce=int, choices=lambda: reference.choices('conditions'))
+    supplier = SelectField(coerce=int, choices=lambda: reference.choices('suppliers'))
     description = StringField('Description')
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
@@ -153,8 +158,18 @@ class PackageDeliveryForm(FlaskForm):
     Form for admin to add packages delivery
     """
     # parcel_id = QuerySelectField(query_factory=lambda: Parcel.query.all(), get_label="name")
-    supplier_id = QuerySelectField(query_factory=lambda: Supplier.query.all(), get_label="name")
+    supplier_id = SelectField(coerce=int, choices=lambda: reference.choices('suppliers'))
     quantity = IntegerField('Quantity')
     description = StringField('Description')
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
+
+class ImportForm(FlaskForm):
+    """
+    Form for admin to import the catalogue from a file
+    """
+    kind = SelectField('Import', choices=[(kind, kind.capitalize()) for kind in sorted(importer.KINDS)])
+    file = FileField('CSV or XLSX file, first row names the columns',
+                     validators=[FileRequired(), FileAllowed(['csv', 'xlsx'])])
+    submit = SubmitField('Import')
+    cancel = SubmitField('Cancel')
@@ -1,12 +1,15 @@
-from flask import abort, flash, redirect, render_template, url_for, request, session
+from flask import abort, current_app, flash, jsonify, redirect, render_template, url_for, request, session, Response, stream_with_context
 from flask_login import current_user, login_required
-from sqlalchemy.orm import join
+from sqlalchemy import func
+from sqlalchemy.orm import join, joinedload
 from datetime import datetime
 
 from . import admin
-from .forms import DepartmentForm, RoleForm, EmployeeAssignForm, SupplierForm, UnitsForm, ConsumableForm, ParcelForm, ConsumableConsumptionForm, ConsumableDeliveryForm, ConditionForm, DirectionForm, PackageForm, PackageDeliveryForm, PackageFormEdit, PackageReceiveForm
-from .. import db
-from ..models import Department, Role, Employee, Supplier, Unit, Consumable, Parcel, ConsumableConsumption, ConsumableDelivery, Condition, Direction, Package, PackageDelivery, PackageSend, PackageReceive
+from .forms import DepartmentForm, RoleForm, EmployeeAssignForm, SupplierForm, UnitsForm, ConsumableForm, ParcelForm, ConsumableConsumptionForm, ConsumableDeliveryForm, ConditionForm, DirectionForm, ImportForm, PackageForm, PackageDeliveryForm, PackageFormEdit, PackageReceiveForm
+from .. import alerts, bulk, db, dbpool, export, importer, outbox, profiler, reference, stock
+from ..history import CONSUMABLE_HISTORY, PACKAGE_HISTORY, render_history
+from ..pagination import paginate
+from ..models import forget_user, Department, Role, Employee, Supplier, Unit, Consumable, Parcel, ConsumableConsumption, ConsumableDelivery, Condition, Direction, Package, PackageDelivery, PackageSend, PackageReceive
 
 
 def check_admin():
@@ -16,6 +19,27 @@ def check_admin():
     if not current_user.is_admin:
         abort(403)
 
+def loaded_counters(form, *names):
+    """
+    Counters an edit form was rendered with, from its loaded_<name> hidden
+    fields, or None when the post does not carry them
+    """
+    try:
+        return dict((name, int(form['loaded_' + name].data)) for name in names)
+    except (TypeError, ValueError):
+        return None
+
+def count_employees(column, rows):
+    """
+    Number of employees per id of the listed rows, in one grouped query
+    instead of a count per row
+    """
+    ids = [row.id for row in rows]
+    if not ids:
+        return {}
+    return dict(db.session.query(column, func.count(Employee.id))
+                .filter(column.in_(ids)).group_by(column))
+
 # Department Views
 
 @admin.route('/departments', methods=['GET', 'POST'])
@@ -26,10 +50,14 @@ def list_departments():
     """
     check_admin()
 
-    departments = Department.query.all()
+    page = paginate(Department.query, Department,
+                    {'id': Department.id, 'name': Department.name,
+                     'description': Department.description})
 
     return render_template('admin/departments/departments.html',
-                           departments=departments, title="Departments")
+                           departments=page.items, page=page,
+                           employee_counts=count_employees(Employee.department_id, page.items),
+                           title="Departments")
 
 @admin.route('/departments/add', methods=['GET', 'POST'])
 @login_required
@@ -51,6 +79,7 @@ def add_department():
             # add department to the database
             db.session.add(department)
             db.session.commit()
+            reference.touch('departments')
             flash('You have successfully added a new department.')
         except:
             # in case department name already exists
@@ -82,6 +111,7 @@ def edit_department(id):
         department.name = form.name.data
         department.description = form.description.data
         db.session.commit()
+        reference.touch('departments')
         flash('You have successfully edited the department.')
 
         # redirect to the departments page
@@ -104,6 +134,7 @@ def delete_department(id):
     department = Department.query.get_or_404(id)
     db.session.delete(department)
     db.session.commit()
+    reference.touch('departments')
     flash('You have successfully deleted the department.')
 
     # redirect to the departments page
@@ -121,9 +152,13 @@ def list_roles():
     """
     List all roles
     """
-    roles = Role.query.all()
+    page = paginate(Role.query, Role,
+                    {'id': Role.id, 'name': Role.name,
+                     'description': Role.description})
     return render_template('admin/roles/roles.html',
-                           roles=roles, title='Roles')
+                           roles=page.items, page=page,
+                           employee_counts=count_employees(Employee.role_id, page.items),
+                           title='Roles')
 
 @admin.route('/roles/add', methods=['GET', 'POST'])
 @login_required
@@ -146,6 +181,7 @@ def add_role():
             # add role to the database
             db.session.add(role)
             db.session.commit()
+            reference.touch('roles')
             flash('You have successfully added a new role.')
         except:
             # in case role name already exists
@@ -177,6 +213,7 @@ def edit_role(id):
         role.description = form.description.data
         db.session.add(role)
         db.session.commit()
+        reference.touch('roles')
         flash('You have successfully edited the role.')
 
         # redirect to the roles page
@@ -198,6 +235,7 @@ def delete_role(id):
     role = Role.query.get_or_404(id)
     db.session.delete(role)
     db.session.commit()
+    reference.touch('roles')
     flash('You have successfully deleted the role.')
 
     # redirect to the roles page
@@ -215,9 +253,11 @@ def list_employees():
     """
     check_admin()
 
-    employees = Employee.query.all()
+    page = paginate(Employee.list_query(), Employee,
+                    {'id': Employee.id, 'name': Employee.last_name,
+                     'email': Employee.email})
     return render_template('admin/employees/employees.html',
-                           employees=employees, title='Employees')
+                           employees=page.items, page=page, title='Employees')
 
 @admin.route('/employees/assign/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -238,10 +278,11 @@ def assign_employee(id):
         return redirect(url_for('admin.list_employees'))
 
     if form.validate_on_submit():
-        employee.department = form.department.data
-        employee.role = form.role.data
+        employee.department_id = form.department_id.data
+        employee.role_id = form.role_id.data
         db.session.add(employee)
         db.session.commit()
+        forget_user(employee.id)
         flash('You have successfully assigned a department and role.')
 
         # redirect to the employee page
@@ -264,6 +305,7 @@ def confirmed_employee(id):
     employee.is_confirmed = True
 
     db.session.commit()
+    forget_user(employee.id)
     flash('You have successfully confirmed new employee.')
 
     return redirect(url_for('admin.list_employees'))
@@ -282,6 +324,7 @@ def grant_admin_priviliges(id):
     employee.is_granted = True
 
     db.session.commit()
+    forget_user(employee.id)
     flash('You have successfully granted admin priviliges for employee.')
     return redirect(url_for('admin.list_employees'))
 
@@ -300,6 +343,7 @@ def deny_admin_priviliges(id):
     employee.is_granted = False
 
     db.session.commit()
+    forget_user(employee.id)
     flash('You have successfully deny admin priviliges for employee.')
     return redirect(url_for('admin.list_employees'))
 
@@ -315,6 +359,7 @@ def delete_employee(id):
     employee = Employee.query.get_or_404(id)
     db.session.delete(employee)
     db.session.commit()
+    forget_user(id)
     flash('You have successfully deleted employee.')
 
     # redirect to the employee page
@@ -332,9 +377,10 @@ def list_suppliers():
     """
     check_admin()
 
-    suppliers = Supplier.query.all()
+    page = paginate(Supplier.query, Supplier,
+                    {'id': Supplier.id, 'name': Supplier.name})
     return render_template('admin/suppliers/suppliers.html',
-                           suppliers=suppliers, title='Suppliers')
+                           suppliers=page.items, page=page, title='Suppliers')
 
 @admin.route('/suppliers/add', methods=['GET', 'POST'])
 @login_required
@@ -355,6 +401,7 @@ def add_supplier():
             # add supplier to the database
             db.session.add(supplier)
             db.session.commit()
+            reference.touch('suppliers')
             flash('You have successfully added a new supplier.')
         except:
             # in case supplier name already exists
@@ -386,6 +433,7 @@ def edit_supplier(id):
     if form.validate_on_submit():
         supplier.name = form.name.data
         db.session.commit()
+        reference.touch('suppliers')
         flash('You have successfully edited the supplier.')
 
         # redirect to the supplier page
@@ -407,6 +455,7 @@ def delete_supplier(id):
     supplier = Supplier.query.get_or_404(id)
     db.session.delete(supplier)
     db.session.commit()
+    reference.touch('suppliers')
     flash('You have successfully deleted the supplier.')
 
     # redirect to the supplier page
@@ -424,9 +473,10 @@ def list_units():
     """
     check_admin()
 
-    units = Unit.query.all()
+    page = paginate(Unit.query, Unit,
+                    {'id': Unit.id, 'name': Unit.unit_type})
     return render_template('admin/units/units.html',
-                           units=units, title='Units')
+                           units=page.items, page=page, title='Units')
 
 @admin.route('/units/add', methods=['GET', 'POST'])
 @login_required
@@ -448,6 +498,7 @@ def add_unit():
             # add unit to the database
             db.session.add(unit)
             db.session.commit()
+            reference.touch('units')
             flash('You have successfully added a new unit.')
         except:
             # in case unit name already exists
@@ -479,6 +530,7 @@ def edit_unit(id):
     if form.validate_on_submit():
         unit.unit_type = form.unit_type.data
         db.session.commit()
+        reference.touch('units')
         flash('You have successfully edited the unit.')
 
         # redirect to the units page
@@ -500,6 +552,7 @@ def delete_unit(id):
     unit = Unit.query.get_or_404(id)
     db.session.delete(unit)
     db.session.commit()
+    reference.touch('units')
     flash('You have successfully deleted the unit.')
 
     # redirect to the units page
@@ -517,9 +570,14 @@ def list_consumables():
     """
     check_admin()
 
-    consumables = Consumable.query.all()
+    page = paginate(Consumable.list_query(), Consumable,
+                    {'id': Consumable.id, 'name': Consumable.name,
+                     'quantity': Consumable.quantity,
+                     'min_stock': Consumable.min_stock,
+                     'description': Consumable.description})
     return render_template('admin/consumables/consumables.html',
-                           consumables=consumables, title='Consumables')
+                           consumables=page.items, page=page,
+                           title='Consumables')
 
 
 @admin.route('/consumables/add', methods=['GET', 'POST'])
@@ -544,18 +602,21 @@ def add_consumable():
         curr_user = current_user.id
 
         consumable = Consumable()
-        consumable.name=form.name.data,
-        consumable.quantity=form.quantity.data,
-        consumable.min_stock=form.min_stock.data,
-        consumable.description=form.description.data,
-        consumable.unit_id=unity.id,
-        consumable.supplier_id=suppliery.id,
+        consumable.name=form.name.data
+        consumable.quantity=0
+        consumable.min_stock=form.min_stock.data
+        consumable.description=form.description.data
+        consumable.unit_id=unity
+        consumable.supplier_id=suppliery
         consumable.user_id=curr_user
 
         try:
-            # add consumable to the database
+            # add consumable to the database, the opening quantity is
+            # recorded as its first stock movement
             db.session.add(consumable)
-            db.session.commit()
+            db.session.flush()
+            stock.adjust(Consumable, consumable.id,
+                         quantity=form.quantity.data)
 
             flash('You have successfully added a new consumable.')
         except:
@@ -590,20 +651,25 @@ def edit_consumables(id):
 
     if form.validate_on_submit():
 
-        consumable.name=form.name.data,
-        consumable.quantity=form.quantity.data,
-        consumable.min_stock=form.min_stock.data,
-        consumable.description=form.description.data,
-        consumable.unit_id=unity.id,
-        consumable.supplier_id=suppliery.id
+        consumable.name=form.name.data
+        consumable.min_stock=form.min_stock.data
+        consumable.description=form.description.data
+        consumable.unit_id=unity
+        consumable.supplier_id=suppliery
 
-        db.session.commit()
+        # a changed quantity is a stock correction, recorded as a movement
+        stock.adjust(Consumable, consumable.id,
+                     loaded=loaded_counters(form, 'quantity'),
+                     quantity=form.quantity.data)
 
         flash('You have successfully edited the consumable.')
 
         # redirect to the consumables page
         return redirect(url_for('admin.list_consumables'))
 
+    if not form.is_submitted():
+        form.loaded_quantity.data = consumable.quantity or 0
+
     return render_template('admin/consumables/consumable.html', action="Edit",
                            add_consumable=add_consumable, form=form,
                            consumable=consumable, title="Edit Consumable")
@@ -620,7 +686,6 @@ def consumption_consumables(id):
     add_consumable = False
 
     consumable = Consumable.query.get_or_404(id)
-    consumption = consumable.quantity
     form = ConsumableConsumptionForm(obj=consumable)
     form.quantity.data = ""
 
@@ -629,23 +694,8 @@ def consumption_consumables(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
-
-        consum_consumptions = ConsumableConsumption()
-
-        consum_consumptions.consumab_id=consumable.id
-        consum_consumptions.user_consumption_id=curr_user
-        consum_consumptions.date=now
-        consum_consumptions.quantity=request.form['quantity']
-
-        db.session.add(consum_consumptions)
-
-        curr_consum = consum_consumptions.quantity
-        subtraction = int(consumption) - int(curr_consum)
-        consumable.quantity = subtraction
-
-        db.session.commit()
+        stock.consume(consumable.id, int(request.form['quantity']),
+                      current_user.id)
         flash('You have successfully edited the consumable.')
 
         # redirect to the consumables page
@@ -667,7 +717,6 @@ def delivery_consumables(id):
     add_consumable = False
 
     consumable = Consumable.query.get_or_404(id)
-    delivery = consumable.quantity
     form = ConsumableDeliveryForm(obj=consumable)
     form.quantity.data = ""
     if form.cancel.data:
@@ -675,25 +724,10 @@ def delivery_consumables(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
         suppliery = form['supplier_id'].data
 
-        consum_delivery = ConsumableDelivery()
-
-        consum_delivery.consumable_id=consumable.id
-        consum_delivery.user_delivery_id=curr_user
-        consum_delivery.supplier_consumable_delivery_id=suppliery.id
-        consum_delivery.quantity=request.form['quantity'],
-        consum_delivery.date=now
-
-        db.session.add(consum_delivery)
-
-        curr_consum = request.form['quantity']
-        addd = int(curr_consum) + int(delivery)
-        consumable.quantity = addd
-
-        db.session.commit()
+        stock.deliver_consumable(consumable.id, int(request.form['quantity']),
+                                 current_user.id, suppliery)
         flash('You have successfully edited the consumable.')
         # redirect to the consumables page
         return redirect(url_for('admin.list_consumables'))
@@ -703,6 +737,60 @@ def delivery_consumables(id):
                            consumable=consumable, title="Delivery Consumable")
 
 
+@admin.route('/consumables/bulk', methods=['GET', 'POST'])
+@login_required
+def bulk_consumables():
+    """
+    Record many consumptions or deliveries of consumables at once
+    """
+    check_admin()
+
+    form = bulk.BulkConsumableForm()
+    if form.cancel.data:
+        return redirect(url_for('admin.list_consumables'))
+
+    errors = []
+    if form.validate_on_submit():
+        lines, errors = bulk.read_lines(form)
+        if not lines and not errors:
+            errors = ['Nothing to record, fill in at least one line.']
+        if not errors:
+            if form.kind.data == 'delivery':
+                stock.deliver_consumables(lines, current_user.id)
+            else:
+                stock.consume_many(lines, current_user.id)
+            flash('You have successfully recorded {} lines.'.format(len(lines)))
+
+            # redirect to the consumables page
+            return redirect(url_for('admin.list_consumables'))
+
+    return render_template('bulk/consumables.html', form=form, errors=errors,
+                           title='Bulk entry')
+
+
+@admin.route('/consumables/low_stock')
+@login_required
+def low_stock():
+    """
+    List the consumables at or below their minimum stock
+    """
+    check_admin()
+
+    return render_template('low_stock.html', shortages=alerts.shortages(),
+                           title='Low stock')
+
+
+@admin.route('/consumables/low_stock.json')
+@login_required
+def low_stock_json():
+    """
+    The consumables at or below their minimum stock, as JSON
+    """
+    check_admin()
+
+    return jsonify([alerts.as_dict(shortage) for shortage in alerts.shortages()])
+
+
 @admin.route('/consumables/delete/<int:id>', methods=['GET', 'POST'])
 @login_required
 def delete_consumables(id):
@@ -731,12 +819,25 @@ def details_consumable(id):
 
     add_consumable = False
 
-    consumable = Consumable.query.get_or_404(id)
-    consumption = db.session.query(ConsumableConsumption).filter(ConsumableConsumption.consumab_id==consumable.id).order_by(ConsumableConsumption.date.desc()).all()
-    delivers = db.session.query(ConsumableDelivery).filter(ConsumableDelivery.consumable_id==consumable.id).order_by(ConsumableDelivery.date.desc()).all()
+    consumable = Consumable.query.options(
+        joinedload(Consumable.consumable),
+        joinedload(Consumable.supplier),
+        joinedload(Consumable.forecast)).filter_by(id=id).first_or_404()
 
     return render_template('admin/consumable_details/consumable_details.html',
-                        consumable=consumable, consumption=consumption, delivers=delivers, title='Details consumable')
+                        consumable=consumable, title='Details consumable')
+
+
+@admin.route('/consumable/details/<int:id>/<kind>')
+@login_required
+def consumable_history(id, kind):
+    """
+    One page of the consumption or delivery history of a consumable,
+    fetched by the details page when its accordion is opened
+    """
+    check_admin()
+
+    return render_history(CONSUMABLE_HISTORY, kind, id)
 
 # Parcel view
 
@@ -748,9 +849,12 @@ def list_parcels():
     """
     check_admin()
 
-    parcels = Parcel.query.all()
+    page = paginate(Parcel.query, Parcel,
+                    {'id': Parcel.id, 'name': Parcel.name,
+                     'weight': Parcel.weight, 'dimension': Parcel.dimension,
+                     'type': Parcel.type})
     return render_template('admin/parcels/parcels.html',
-                           parcels=parcels, title='Parcels')
+                           parcels=page.items, page=page, title='Parcels')
 
 
 @admin.route('/parcels/add', methods=['GET', 'POST'])
@@ -777,6 +881,7 @@ def add_parcel():
             # add parcel to the database
             db.session.add(parcel)
             db.session.commit()
+            reference.touch('parcels')
             flash('You have successfully added a new parcel.')
         except:
             # in case parcel name already exists
@@ -810,6 +915,7 @@ def edit_parcels(id):
         parcel.dimension=form.dimension.data,
         parcel.type = form.type.data
         db.session.commit()
+        reference.touch('parcels')
         flash('You have successfully edited the parcel.')
 
         # redirect to the parcels page
@@ -832,6 +938,7 @@ def delete_parcel(id):
     parcel = Parcel.query.get_or_404(id)
     db.session.delete(parcel)
     db.session.commit()
+    reference.touch('parcels')
     flash('You have successfully deleted the parcel.')
 
     # redirect to the parcel page
@@ -846,10 +953,11 @@ def list_conditions():
     List all conditions
     """
 
-    conditions = Condition.query.all()
+    page = paginate(Condition.query, Condition,
+                    {'id': Condition.id, 'name': Condition.name})
 
     return render_template('admin/conditions/conditions.html',
-    conditions=conditions, title="Conditions")
+    conditions=page.items, page=page, title="Conditions")
 
 @admin.route('/conditions/add', methods=['GET', 'POST'])
 @login_required
@@ -866,12 +974,14 @@ def add_condition():
         return redirect(url_for('admin.list_conditions'))
     if form.validate_on_submit():
         condition = Condition(
-        name=form.name.data
+        name=form.name.data,
+        returns_to_stock=form.returns_to_stock.data
         )
         try:
             # add condition to the database
             db.session.add(condition)
             db.session.commit()
+            reference.touch('conditions')
             flash('You have successfully added a new condition.')
         except:
             # in case condition name already exists
@@ -899,8 +1009,10 @@ def edit_conditions(id):
     if form.cancel.data:
         return redirect(url_for('admin.list_conditions'))
     if form.validate_on_submit():
-        condition.name = form.name.data,
+        condition.name = form.name.data
+        condition.returns_to_stock = form.returns_to_stock.data
         db.session.commit()
+        reference.touch('conditions')
         flash('You have successfully edited the condition.')
 
         # redirect to the conditions page
@@ -921,6 +1033,7 @@ def delete_condition(id):
     condition = Condition.query.get_or_404(id)
     db.session.delete(condition)
     db.session.commit()
+    reference.touch('conditions')
     flash('You have successfully deleted the condition.')
 
     # redirect to the condition page
@@ -937,9 +1050,11 @@ def list_directions():
     """
     check_admin()
 
-    directions = Direction.query.all()
+    page = paginate(Direction.query, Direction,
+                    {'id': Direction.id, 'name': Direction.name})
     return render_template('admin/directions/directions.html',
-                           directions=directions, title='Directions')
+                           directions=page.items, page=page,
+                           title='Directions')
 
 @admin.route('/directions/add', methods=['GET', 'POST'])
 @login_required
@@ -1028,9 +1143,27 @@ def list_packages():
     """
     check_admin()
 
-    packages = Package.query.order_by(Package.description.asc()).all()
+    page = paginate(Package.list_query(), Package,
+                    {'id': Package.id, 'quantity': Package.quantity,
+                     'inside': Package.inside, 'outside': Package.outside,
+                     'description': Package.description})
     return render_template('admin/packages/packages.html',
-                           packages=packages, title='Packages')
+                           packages=page.items, page=page, title='Packages')
+
+
+@admin.route('/packages/balances')
+@login_required
+def package_balances():
+    """
+    List the packages each supplier still has to return
+    """
+    check_admin()
+
+    supplier_id = request.args.get('supplier', type=int)
+    return render_template('package_balances.html',
+                           balances=stock.package_balances(supplier_id),
+                           suppliers=reference.choices('suppliers'),
+                           supplier_id=supplier_id, title='Package balances')
 
 
 
@@ -1054,17 +1187,19 @@ def add_package():
         parcely = form['parcel_id'].data
 
         package = Package()
-        package.parcel_id=parcely.id
-        package.quantity=form.quantity.data
-        package.outside=0,
-        package.inside=0,
-        package.description=form.description.data,
+        package.parcel_id=parcely
+        package.quantity=0
+        package.outside=0
+        package.inside=0
+        package.description=form.description.data
 
 
         try:
-            # add package to the database
+            # add package to the database, the opening quantity is
+            # recorded as its first stock movement
             db.session.add(package)
-            db.session.commit()
+            db.session.flush()
+            stock.adjust(Package, package.id, quantity=form.quantity.data)
 
             flash('You have successfully added a new package.')
         except:
@@ -1102,19 +1237,24 @@ def edit_package(id):
         sumOut = quantity - ins
 
 
-        package.outside=sumOut,
-        package.inside=ins,
-        package.quantity=quantity
+        package.description=form.description.data
 
-        package.description=form.description.data,
-
-        db.session.commit()
+        # changed counters are a stock correction, recorded as a movement
+        loaded = loaded_counters(form, 'quantity', 'inside')
+        if loaded is not None:
+            loaded['outside'] = loaded['quantity'] - loaded['inside']
+        stock.adjust(Package, package.id, loaded=loaded, quantity=quantity,
+                     inside=ins, outside=sumOut)
 
         flash('You have successfully edited a package.')
 
         # redirect to package page
         return redirect(url_for('admin.list_packages'))
 
+    if not form.is_submitted():
+        form.loaded_quantity.data = package.quantity or 0
+        form.loaded_inside.data = package.inside or 0
+
     # load consumable template
     return render_template('admin/packages/package.html', action="Edit",
                            add_package=add_package, form=form,
@@ -1132,8 +1272,6 @@ def delivery_packages(id):
     add_package = False
 
     package = Package.query.get_or_404(id)
-    delivery = package.quantity
-
     form = PackageDeliveryForm(obj=package)
     form.quantity.data = ""
     if form.cancel.data:
@@ -1141,31 +1279,11 @@ def delivery_packages(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
         suppliery = form['supplier_id'].data
-        # parcel = form['parcel_id'].data
-
-        package_delivery = PackageDelivery()
-
-        package_delivery.package_id=package.id,
-        package_delivery.quantity=request.form['quantity'],
-        package_delivery.description=form.description.data,
-        package_delivery.supplier_id=suppliery.id,
-        package_delivery.user_id=curr_user
-        package_delivery.date=now
-
-        db.session.add(package_delivery)
-
-        curr_inside = package.inside
-        curr_package = request.form['quantity']
-        addd = int(curr_package) + int(delivery)
 
-        package.inside = int(curr_package) + int(curr_inside)
-        package.quantity = addd
-
-
-        db.session.commit()
+        stock.deliver_package(package.id, int(request.form['quantity']),
+                              current_user.id, suppliery,
+                              form.description.data)
         flash('You have successfully registered the delivery.')
         # redirect to the packages page
         return redirect(url_for('admin.list_packages'))
@@ -1194,29 +1312,11 @@ def send_packages(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
         suppliery = form['supplier_id'].data
 
-        package_send = PackageSend()
-
-        package_send.package_id=package.id,
-        package_send.quantity=request.form['quantity'],
-        package_send.description=form.description.data,
-        package_send.supplier_id=suppliery.id,
-        package_send.user_id=curr_user
-        package_send.date=now
-
-        db.session.add(package_send)
-
-        curr_inside = package.inside
-        curr_package = request.form['quantity']
-
-        package.inside = curr_inside - int(curr_package)
-        package.outside += int(curr_package)
-
-
-        db.session.commit()
+        stock.send_package(package.id, int(request.form['quantity']),
+                           current_user.id, suppliery,
+                           form.description.data)
         flash('You have successfully send package.')
         # redirect to the packages page
         return redirect(url_for('admin.list_packages'))
@@ -1237,7 +1337,6 @@ def receive_packages(id):
     add_package = False
 
     package = Package.query.get_or_404(id)
-    condition = Condition.query.all()
 
     form = PackageReceiveForm(obj=package)
     form.quantity.data = ""
@@ -1246,38 +1345,12 @@ def receive_packages(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
         suppliery = form['supplier'].data
+        conditiony = form['condition'].data
 
-        package_receive = PackageReceive()
-
-        package_receive.package_id=package.id,
-        package_receive.condition=request.form['condition'],
-        package_receive.quantity=request.form['quantity'],
-        package_receive.description=form.description.data,
-        package_receive.supplier=suppliery.id,
-        package_receive.user_id=curr_user,
-        package_receive.date=now
-
-        db.session.add(package_receive)
-
-        curr_inside = package.inside
-        curr_outside = package.outside
-        curr_package = request.form['quantity']
-
-        req = request.form.get("condition")
-        condit = db.session.query(Condition).filter(Condition.name=="OK").first()
-        curr_condition = condit.id
-
-        if req != str(curr_condition):
-            package.quantity -= int(curr_package)
-            package.outside = curr_outside - int(curr_package)
-        else:
-            package.inside += int(curr_package)
-            package.outside = curr_outside - int(curr_package)
-
-        db.session.commit()
+        stock.receive_package(package.id, int(request.form['quantity']),
+                              current_user.id, suppliery, conditiony,
+                              form.description.data)
 
         flash('You have successfully received package.')
         # redirect to the pac/kages page
@@ -1305,12 +1378,23 @@ def details_packages(id):
 
     add_package = False
 
-    package = Package.query.get_or_404(id)
-    # consumption = db.session.query(ConsumableConsumption).filter(ConsumableConsumption.consumab_id==consumable.id).order_by(ConsumableConsumption.date.desc()).all()
-    delivers = db.session.query(PackageDelivery).filter(PackageDelivery.package_id==package.id).order_by(PackageDelivery.date.desc()).all()
+    package = Package.query.options(
+        joinedload(Package.parcel)).filter_by(id=id).first_or_404()
 
     return render_template('admin/packages/packages_details/packages_details.html',
-                        package=package, delivers=delivers, title='Details package')
+                        package=package, title='Details package')
+
+
+@admin.route('/packages/packages_details/packages_details/<int:id>/<kind>')
+@login_required
+def package_history(id, kind):
+    """
+    One page of the delivery history of a package, fetched by the details
+    page when its accordion is opened
+    """
+    check_admin()
+
+    return render_history(PACKAGE_HISTORY, kind, id)
 
 
 @admin.route('/packages/delete/<int:id>', methods=['GET', 'POST'])
@@ -1328,3 +1412,121 @@ def delete_package(id):
 
     # redirect to the direction page
     return redirect(url_for('admin.list_packages'))
+
+
+# Import Views
+
+@admin.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_catalogue():
+    """
+    Import suppliers, units, parcels, consumables or packages from a file
+    """
+    check_admin()
+
+    form = ImportForm()
+    if form.cancel.data:
+        return redirect(url_for('home.admin_dashboard'))
+
+    report = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        try:
+            report = importer.import_rows(form.kind.data,
+                                          importer.read_rows(upload.stream, upload.filename),
+                                          user_id=current_user.id)
+        except importer.ImportFailed as error:
+            flash('Error: {}'.format(error))
+        else:
+            flash('You have successfully imported {} new and {} updated {}, '
+                  '{} rows were rejected.'.format(report.inserted, report.updated,
+                                                  form.kind.data, report.rejected))
+
+    return render_template('admin/import/import.html', form=form,
+                           report=report, title='Import')
+
+
+# Export Views
+
+@admin.route('/export')
+@login_required
+def export_ledgers():
+    """
+    Stream a ledger or the current stock as CSV or JSON Lines, or show the
+    export form when no kind is asked for
+    """
+    check_admin()
+
+    kind = request.args.get('kind')
+    if not kind:
+        employees = db.session.query(Employee.id, Employee.username) \
+            .order_by(Employee.username)
+        return render_template('admin/export/export.html',
+                               kinds=sorted(export.EXPORTS),
+                               suppliers=reference.choices('suppliers'),
+                               employees=employees, title='Export')
+
+    format = request.args.get('format', 'csv')
+    if format not in export.FORMATS:
+        abort(400)
+    dates = []
+    for name in ('date_from', 'date_to'):
+        value = request.args.get(name)
+        try:
+            dates.append(datetime.strptime(value, '%Y-%m-%d') if value else None)
+        except ValueError:
+            abort(400)
+    try:
+        query = export.build(kind, dates[0], dates[1],
+                             request.args.get('supplier', type=int),
+                             request.args.get('employee', type=int))
+    except export.ExportError:
+        abort(400)
+
+    mimetype, extension = export.FORMATS[format]
+    return Response(stream_with_context(export.stream(query, format)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename={}.{}'.format(kind, extension)})
+
+
+# Database Views
+
+@admin.route('/pool')
+@login_required
+def pool_status():
+    """
+    Connection pool metrics of the worker process serving this request
+    """
+    check_admin()
+
+    return jsonify(dbpool.pool_status(db.engine))
+
+
+@admin.route('/outbox')
+@login_required
+def outbox_status():
+    """
+    Messages waiting in the outbox for the publisher
+    """
+    check_admin()
+
+    return jsonify(outbox.backlog())
+
+
+@admin.route('/profiler', methods=['GET', 'POST'])
+@login_required
+def list_profiles():
+    """
+    Request profiles of the worker process serving this request
+    """
+    check_admin()
+
+    if request.method == 'POST':
+        profiler.reset()
+        flash('You have successfully cleared the request profiles.')
+        return redirect(url_for('admin.list_profiles'))
+
+    return render_template('admin/profiler/profiler.html',
+                           profiles=profiler.summary(),
+                           enabled=current_app.config['PROFILER'],
+                           title="Request profiles")
@@ -0,0 +1,206 @@
+import json
+import logging
+import smtplib
+from datetime import datetime
+from email.message import EmailMessage
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, literal, select
+from sqlalchemy.orm import Session, joinedload
+
+from . import db
+from .models import Consumable, LowStock
+
+
+# Low-stock detection runs inside the stock mutations: app.stock marks the
+# consumables it changes, and just before the transaction commits only those
+# rows are compared with their min_stock. The ones crossing the threshold are
+# added to or removed from the low_stock table in the same transaction, and
+# once it has committed a notification per crossing goes to the configured
+# sink. Nothing ever scans the consumables table.
+
+log = logging.getLogger(__name__)
+
+
+def touch(session, *ids):
+    """
+    Have the low-stock state of these consumables checked at commit
+    """
+    session.info.setdefault('low_stock_check', set()).update(ids)
+
+
+class LogSink(object):
+    """
+    Writes the notifications to the application log
+    """
+
+    def send(self, events):
+        for event in events:
+            log.warning('%s: %s (#%d) has %d, minimum %d', event['state'],
+                        event['name'], event['consumable_id'],
+                        event['quantity'], event['min_stock'])
+
+
+class FileSink(object):
+    """
+    Appends the notifications as JSON lines to LOW_STOCK_FILE
+    """
+
+    def send(self, events):
+        with open(current_app.config['LOW_STOCK_FILE'], 'a') as output:
+            for event in events:
+                output.write(json.dumps(event, default=str) + '\n')
+
+
+class SMTPSink(object):
+    """
+    Mails the notifications through LOW_STOCK_SMTP_HOST, a local relay or
+    a debugging SMTP server standing in for one
+    """
+
+    def send(self, events):
+        config = current_app.config
+        message = EmailMessage()
+        message['Subject'] = 'Stock alert: {} change(s)'.format(len(events))
+        message['From'] = config['LOW_STOCK_MAIL_FROM']
+        message['To'] = config['LOW_STOCK_MAIL_TO']
+        message.set_content('\n'.join(
+            '{state}: {name} (#{consumable_id}) has {quantity}, minimum {min_stock}'
+            .format(**event) for event in events))
+        with smtplib.SMTP(config['LOW_STOCK_SMTP_HOST'],
+                          config['LOW_STOCK_SMTP_PORT'], timeout=10) as smtp:
+            smtp.send_message(message)
+
+
+# LOW_STOCK_SINK -> factory of the sink; register_sink() adds more
+SINKS = {
+    'log': LogSink,
+    'file': FileSink,
+    'smtp': SMTPSink,
+}
+
+
+def register_sink(name, factory):
+    SINKS[name] = factory
+
+
+def shortages():
+    """
+    The consumables below their minimum, largest shortfall first, with
+    their unit and supplier
+    """
+    return LowStock.query.options(
+        joinedload(LowStock.consumable).joinedload(Consumable.consumable),
+        joinedload(LowStock.consumable).joinedload(Consumable.supplier)) \
+        .order_by((LowStock.min_stock - LowStock.quantity).desc(),
+                  LowStock.consumable_id).all()
+
+
+def rebuild():
+    """
+    Recompute the low_stock table from the consumables, for a database
+    filled without going through app.stock; no notification is sent and
+    the consumables still short keep their since
+    """
+    table = LowStock.__table__
+    consumables = Consumable.__table__
+    quantity = func.coalesce(consumables.c.quantity, 0)
+    short = select(consumables.c.id).where(
+        consumables.c.min_stock.isnot(None), quantity <= consumables.c.min_stock)
+    db.session.execute(table.delete().where(table.c.consumable_id.notin_(short)))
+    db.session.execute(table.update().values(
+        quantity=select(quantity).where(consumables.c.id == table.c.consumable_id)
+        .scalar_subquery(),
+        min_stock=select(consumables.c.min_stock)
+        .where(consumables.c.id == table.c.consumable_id).scalar_subquery()))
+    db.session.execute(table.insert().from_select(
+        ['consumable_id', 'quantity', 'min_stock', 'since'],
+        select(consumables.c.id, quantity, consumables.c.min_stock,
+               literal(datetime.now()))
+        .where(consumables.c.min_stock.isnot(None),
+               quantity <= consumables.c.min_stock,
+               consumables.c.id.notin_(select(table.c.consumable_id)))))
+    db.session.commit()
+
+
+def as_dict(shortage):
+    consumable = shortage.consumable
+    return {
+        'consumable_id': shortage.consumable_id,
+        'name': consumable.name,
+        'quantity': shortage.quantity,
+        'min_stock': shortage.min_stock,
+        'unit': consumable.consumable.unit_type if consumable.consumable else None,
+        'supplier_id': consumable.supplier_id,
+        'supplier': consumable.supplier.name if consumable.supplier else None,
+        'since': shortage.since.isoformat(),
+    }
+
+
+@event.listens_for(Session, 'before_commit')
+def _check(session):
+    if session.in_nested_transaction():
+        # releasing a savepoint, the check waits for the real commit
+        return
+    ids = session.info.pop('low_stock_check', None)
+    if not ids:
+        return
+    session.flush()
+
+    rows = session.query(Consumable.id, Consumable.name, Consumable.quantity,
+                         Consumable.min_stock).filter(Consumable.id.in_(ids)) \
+        .with_for_update().all()
+    # locking reads see what a concurrent transaction on the same
+    # consumables committed before our stock UPDATE could go on
+    low = dict((row.consumable_id, row) for row in
+               session.query(LowStock).filter(LowStock.consumable_id.in_(ids))
+               .with_for_update())
+
+    now = datetime.now()
+    events = []
+    for id, name, quantity, min_stock in rows:
+        quantity = quantity or 0
+        below = min_stock is not None and quantity <= min_stock
+        current = low.get(id)
+        if below and current is None:
+            session.add(LowStock(consumable_id=id, quantity=quantity,
+                                 min_stock=min_stock, since=now))
+            state = 'low'
+        elif below:
+            current.quantity = quantity
+            current.min_stock = min_stock
+            continue
+        elif current is not None:
+            session.delete(current)
+            state = 'recovered'
+        else:
+            continue
+        events.append({'state': state, 'consumable_id': id, 'name': name,
+                       'quantity': quantity, 'min_stock': min_stock,
+                       'date': now})
+    session.flush()
+    if events:
+        session.info.setdefault('low_stock_events', []).extend(events)
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify(session):
+    events = session.info.pop('low_stock_events', None)
+    if not events or not has_app_context():
+        return
+    try:
+        SINKS[current_app.config['LOW_STOCK_SINK']]().send(events)
+    except Exception:
+        # the stock change is committed, a failing sink must not undo it
+        current_app.logger.exception('Could not send %d low-stock notification(s)',
+                                     len(events))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget(session, previous_transaction):
+    if previous_transaction.parent is not None:
+        # a savepoint, or the flush inside one, rolled back: the outer
+        # transaction goes on and is still to be checked
+        return
+    session.info.pop('low_stock_check', None)
+    session.info.pop('low_stock_events', None)
@@ -0,0 +1,301 @@
+import json
+from datetime import datetime
+
+from flask import Response, current_app, request, stream_with_context
+from flask_login import current_user
+from sqlalchemy import select
+
+from . import api
+from .. import changes, db, export, versions
+from ..models import Consumable, Package, Supplier
+
+
+# Read-only JSON over the same queries as the exports. Every resource names
+# the tables it is built from; their change counters make its ETag, so a
+# poller sending If-None-Match gets a 304 from one small SELECT while
+# nothing changed. Lists are paged with a cursor on the id: ?after=<id of
+# the last row seen>&limit=<n>, and ?fields=a,b picks the columns.
+
+
+def _suppliers():
+    return select(Supplier.id.label('id'), Supplier.name.label('name')) \
+        .select_from(Supplier)
+
+
+# resource -> (export kind or query builder, tables it reads)
+RESOURCES = {
+    'consumables': ('consumable_stock', ('consumables', 'units', 'suppliers')),
+    'packages': ('package_stock', ('packages', 'parcels')),
+    'suppliers': (_suppliers, ('suppliers',)),
+    'consumptions': ('consumptions', ('consum_consumptions', 'consumables',
+                                      'units', 'employees')),
+    'consumable_deliveries': ('consumable_deliveries',
+                              ('consum_delivery', 'consumables', 'units',
+                               'suppliers', 'employees')),
+    'package_deliveries': ('package_deliveries',
+                           ('packagesDelivery', 'packages', 'parcels',
+                            'suppliers', 'employees')),
+    'package_sends': ('package_sends', ('packagesSend', 'packages', 'parcels',
+                                        'suppliers', 'employees')),
+    'package_receives': ('package_receives',
+                         ('packagesReceive', 'packages', 'parcels',
+                          'conditions', 'suppliers', 'employees')),
+}
+
+for source, tables in RESOURCES.values():
+    versions.count(*tables)
+
+
+class BadRequest(Exception):
+    """
+    The arguments of the request do not make a valid query
+    """
+
+
+def _json(status, body, **headers):
+    return Response(json.dumps(body, default=export.json_default), status,
+                    mimetype='application/json', headers=headers)
+
+
+@api.before_request
+def authenticate():
+    """
+    Only confirmed employees, answered in JSON instead of the login page
+    """
+    if not current_user.is_authenticated:
+        return _json(401, {'error': 'Log in first.'})
+    if not current_user.is_confirmed:
+        return _json(403, {'error': 'Your account is not confirmed.'})
+
+
+def _query(resource, id=None):
+    source, tables = RESOURCES[resource]
+    if callable(source):
+        query = source()
+        id_column = query.selected_columns.id
+        query = query.order_by(id_column)
+    else:
+        try:
+            query = export.build(source,
+                                 request.args.get('from', type=_day),
+                                 request.args.get('to', type=_day),
+                                 request.args.get('supplier', type=int),
+                                 request.args.get('employee', type=int))
+        except export.ExportError as error:
+            raise BadRequest(str(error))
+        id_column = export.EXPORTS[source][1]
+    if id is not None:
+        query = query.where(id_column == id)
+
+    fields = request.args.get('fields')
+    if fields:
+        columns = query.selected_columns
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            raise BadRequest('Unknown field(s) {}, expected some of {}.'.format(
+                ', '.join(unknown), ', '.join(columns.keys())))
+        if 'id' not in names:
+            # the cursor needs it
+            names.insert(0, 'id')
+        query = query.with_only_columns(*[columns[name] for name in names])
+    return query, id_column
+
+
+def _day(text):
+    return datetime.strptime(text, '%Y-%m-%d')
+
+
+def _conditional(tables, build):
+    """
+    304 when the client's ETag is still current, otherwise the response of
+    build() tagged with the current one
+    """
+    tag = versions.etag(tables, request.endpoint,
+                        sorted(request.args.items(multi=True)),
+                        request.view_args)
+    if request.if_none_match.contains(tag):
+        response = Response(status=304)
+    else:
+        try:
+            response = build()
+        except BadRequest as error:
+            return _json(400, {'error': str(error)})
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@api.route('/<resource>')
+def list_resource(resource):
+    """
+    One page of a resource in id order
+    """
+    if resource not in RESOURCES:
+        return _json(404, {'error': "Unknown resource '{}', expected one of {}.".format(
+            resource, ', '.join(sorted(RESOURCES)))})
+
+    def build():
+        limit = min(request.args.get('limit', current_app.config['API_PAGE_SIZE'],
+                                     type=int),
+                    current_app.config['API_PAGE_MAX'])
+        if limit < 1:
+            raise BadRequest('limit must be at least 1.')
+        query, id_column = _query(resource)
+        after = request.args.get('after', type=int)
+        if after is not None:
+            query = query.where(id_column > after)
+        result = db.session.connection().execute(query.limit(limit + 1))
+        names = list(result.keys())
+        rows = [dict(zip(names, row)) for row in result]
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return _json(200, {'data': rows,
+                           'next': rows[-1]['id'] if more else None})
+
+    return _conditional(RESOURCES[resource][1], build)
+
+
+@api.route('/<resource>/<int:id>')
+def get_resource(resource, id):
+    """
+    One row of a resource
+    """
+    if resource not in RESOURCES:
+        return _json(404, {'error': "Unknown resource '{}'.".format(resource)})
+
+    def build():
+        query, id_column = _query(resource, id)
+        result = db.session.connection().execute(query)
+        names = list(result.keys())
+        row = result.first()
+        if row is None:
+            return _json(404, {'error': 'No {} with id {}.'.format(resource, id)})
+        return _json(200, {'data': dict(zip(names, row))})
+
+    return _conditional(RESOURCES[resource][1], build)
+
+
+# kind -> (model, column it is named by, columns returned)
+STOCK = {
+    'consumables': (Consumable, 'name', ('id', 'name', 'quantity', 'min_stock')),
+    'packages': (Package, 'description', ('id', 'description', 'quantity',
+                                          'inside', 'outside')),
+}
+
+versions.count(*STOCK)
+
+
+def _references():
+    """
+    {kind: [id or name]} of a stock lookup, from a JSON body or from
+    comma-separated query arguments
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            raise BadRequest('Send a JSON object like {"consumables": [1, "name"], "packages": [2]}.')
+        given = dict((kind, body.get(kind) or []) for kind in STOCK)
+    else:
+        given = dict((kind, [value.strip() for value in
+                             request.args.get(kind, '').split(',') if value.strip()])
+                     for kind in STOCK)
+
+    references = {}
+    for kind, values in given.items():
+        if not isinstance(values, list):
+            raise BadRequest('{} must be a list.'.format(kind))
+        invalid = [value for value in values if isinstance(value, bool)
+                   or not isinstance(value, (int, str))]
+        if invalid:
+            raise BadRequest('{} must hold ids or names only, got {}.'.format(
+                kind, json.dumps(invalid)))
+        references[kind] = [int(value) if isinstance(value, str) and value.isdigit()
+                            else value for value in values]
+    count = sum(len(values) for values in references.values())
+    if count > current_app.config['API_LOOKUP_MAX']:
+        raise BadRequest('At most {} items can be looked up at once, got {}.'.format(
+            current_app.config['API_LOOKUP_MAX'], count))
+    return references
+
+
+def _lookup(kind, references):
+    """
+    Rows of kind given by id or name, all in one IN-list query, and the
+    references nothing matched
+    """
+    model, label, columns = STOCK[kind]
+    ids = set(value for value in references
+              if isinstance(value, int) and not isinstance(value, bool))
+    names = set(value for value in references if isinstance(value, str))
+    if not ids and not names:
+        return [], list(references)
+
+    name_column = getattr(model, label)
+    rows = db.session.query(*[getattr(model, column) for column in columns]) \
+        .filter(db.or_(model.id.in_(ids), name_column.in_(names))) \
+        .order_by(model.id).all()
+    found_ids = set(row.id for row in rows)
+    found_names = set(getattr(row, label) for row in rows)
+    missing = [value for value in references
+               if value not in found_ids and value not in found_names]
+    return [dict(zip(columns, row)) for row in rows], missing
+
+
+@api.route('/stock', methods=['GET', 'POST'])
+def lookup_stock():
+    """
+    Current stock of many consumables and packages in one call, by id or
+    name (description for packages)
+
+    GET /stock?consumables=1,2,gloves&packages=3 or POST a JSON object with
+    the same lists; GET answers carry an ETag like the other resources.
+    """
+    def build():
+        references = _references()
+        body = {'missing': {}}
+        for kind in STOCK:
+            body[kind], body['missing'][kind] = _lookup(kind, references[kind])
+        return _json(200, body)
+
+    if request.method == 'POST':
+        try:
+            return build()
+        except BadRequest as error:
+            return _json(400, {'error': str(error)})
+    return _conditional(tuple(STOCK), build)
+
+
+@api.route('/changes')
+def list_changes():
+    """
+    Changes after ?since=<seq>, in order: one page of JSON, or all of them
+    streamed as JSON Lines with ?format=jsonl
+
+    A client keeps the seq of the last change it applied and starts from
+    there next time; a row that changed several times may appear more than
+    once.
+    """
+    since = request.args.get('since', 0, type=int)
+    if request.args.get('format') == 'jsonl':
+        return Response(stream_with_context(export.stream(changes.since(since),
+                                                          'jsonl')),
+                        mimetype='application/x-ndjson')
+
+    def build():
+        limit = min(request.args.get('limit', current_app.config['API_PAGE_SIZE'],
+                                     type=int),
+                    current_app.config['API_PAGE_MAX'])
+        if limit < 1:
+            raise BadRequest('limit must be at least 1.')
+        result = db.session.connection().execute(
+            changes.since(since).limit(limit + 1))
+        names = list(result.keys())
+        rows = [dict(zip(names, row)) for row in result]
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return _json(200, {'data': rows,
+                           'next': rows[-1]['seq'] if rows else since,
+                           'more': more})
+
+    return _conditional((changes.SEQUENCE,), build)
@@ -1,9 +1,9 @@
-from flask import flash, redirect, render_template, url_for
+from flask import flash, redirect, render_template, session, url_for
 from flask_login import login_required, login_user, logout_user
 
 from . import auth
 from .forms import LoginForm, RegistrationForm
-from .. import db
+from .. import db, sessions
 from ..models import Employee
 
 @auth.route('/register', methods=['GET', 'POST'])
@@ -45,7 +45,8 @@ def login():
         employee = Employee.query.filter_by(email=form.email.data).first()
         if employee is not None and employee.verify_password(
                 form.password.data):
-            # log employee in
+            # log employee in, under a new session id
+            sessions.regenerate(session)
             login_user(employee)
 
             # redirect to the appropriate dashboard page
@@ -72,6 +73,7 @@ def logout():
     Log an employee out through the logout link
     """
     logout_user()
+    sessions.regenerate(session)
     flash('You have successfully been logged out.')
 
     # redirect to the login page
@@ -0,0 +1,148 @@
+import csv
+
+from flask import current_app
+from flask_wtf import FlaskForm
+from wtforms import FieldList, Form, FormField, SelectField, StringField, SubmitField, TextAreaField
+
+from . import db, reference
+from .models import Consumable
+
+
+# Bulk entry of consumptions or deliveries: a grid of lines plus a CSV paste
+# area. Every line is checked before anything is written, so a submission
+# is recorded whole or, with the errors of its lines, not at all.
+
+GRID_LINES = 10
+
+
+def _supplier_choices():
+    return [(0, '')] + reference.choices('suppliers')
+
+
+class BulkLineForm(Form):
+    """
+    One line of the bulk entry grid
+    """
+    consumable = StringField('Consumable')
+    quantity = StringField('Quantity')
+    # checked by read_lines, so that rows left out of the submission are fine
+    supplier = SelectField('Supplier', coerce=int, choices=_supplier_choices,
+                           validate_choice=False)
+
+
+class BulkConsumableForm(FlaskForm):
+    """
+    Form to record many consumptions or deliveries of consumables at once
+    """
+    kind = SelectField('Record', choices=[('consumption', 'Consumption'),
+                                          ('delivery', 'Delivery')])
+    lines = FieldList(FormField(BulkLineForm), min_entries=GRID_LINES)
+    pasted = TextAreaField('Paste CSV: consumable,quantity[,supplier]')
+    submit = SubmitField('Submit')
+    cancel = SubmitField('Cancel')
+
+
+def _entries(form):
+    """
+    (label, consumable, quantity, supplier, extra values) of the filled grid
+    lines and pasted CSV lines, as text
+    """
+    entries = []
+    for number, line in enumerate(form.lines, 1):
+        consumable = (line.consumable.data or '').strip()
+        quantity = (line.quantity.data or '').strip()
+        if consumable or quantity:
+            supplier = str(line.supplier.data) if line.supplier.data else ''
+            entries.append(('Row {}'.format(number), consumable, quantity,
+                            supplier, []))
+
+    rows = csv.reader((form.pasted.data or '').splitlines())
+    for number, row in enumerate(rows, 1):
+        row = [value.strip() for value in row]
+        if not any(row):
+            continue
+        row += [''] * (3 - len(row))
+        entries.append(('CSV line {}'.format(number), row[0], row[1], row[2],
+                        [value for value in row[3:] if value]))
+    return entries
+
+
+def read_lines(form):
+    """
+    Lines to record from a submitted BulkConsumableForm and the errors of
+    the lines that cannot be recorded
+
+    Consumables and suppliers are given by id or exact name. A delivery
+    line without a supplier is delivered by the consumable's supplier.
+    """
+    entries = _entries(form)
+    limit = current_app.config['BULK_MAX_LINES']
+    if len(entries) > limit:
+        return [], ['At most {} lines can be recorded at once, got {}.'.format(
+            limit, len(entries))]
+
+    references = set(entry[1] for entry in entries if entry[1])
+    ids = [int(value) for value in references if value.isdigit()]
+    names = [value for value in references if not value.isdigit()]
+    found = db.session.query(Consumable.id, Consumable.name,
+                             Consumable.supplier_id) \
+        .filter(db.or_(Consumable.id.in_(ids), Consumable.name.in_(names))).all()
+    by_id = dict((row.id, row) for row in found)
+    by_name = {}
+    for row in found:
+        by_name.setdefault(row.name, []).append(row)
+
+    suppliers = reference.choices('suppliers')
+    supplier_ids = set(id for id, name in suppliers)
+    supplier_names = {}
+    for id, name in suppliers:
+        supplier_names.setdefault(name, []).append(id)
+
+    delivery = form.kind.data == 'delivery'
+    lines = []
+    errors = []
+    for label, consumable, quantity, supplier, extra in entries:
+        problems = []
+
+        row = None
+        if not consumable:
+            problems.append('consumable is missing')
+        elif consumable.isdigit():
+            row = by_id.get(int(consumable))
+        elif len(by_name.get(consumable, [])) > 1:
+            problems.append("several consumables are named '{}', use the id".format(consumable))
+        else:
+            row = (by_name.get(consumable) or [None])[0]
+        if consumable and row is None and not problems:
+            problems.append("unknown consumable '{}'".format(consumable))
+
+        if not quantity.isdigit() or int(quantity) < 1:
+            problems.append("quantity '{}' is not a positive whole number".format(quantity))
+
+        if extra:
+            problems.append('too many values, expected consumable,quantity[,supplier]')
+
+        supplier_id = None
+        if not delivery:
+            if supplier:
+                problems.append('a consumption has no supplier')
+        elif supplier.isdigit() and int(supplier) in supplier_ids:
+            supplier_id = int(supplier)
+        elif supplier:
+            matches = supplier_names.get(supplier, [])
+            if len(matches) == 1:
+                supplier_id = matches[0]
+            else:
+                problems.append("unknown supplier '{}'".format(supplier))
+        elif row is not None:
+            supplier_id = row.supplier_id
+            if supplier_id is None:
+                problems.append('the consumable has no supplier, give one')
+
+        if problems:
+            errors.append('{}: {}.'.format(label, ', '.join(problems)))
+        elif delivery:
+            lines.append((row.id, int(quantity), supplier_id))
+        else:
+            lines.append((row.id, int(quantity)))
+    return lines, errors
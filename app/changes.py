@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import Change, TableVersion
+
+
+# Change feed. Every insert, update and delete of a row of a tracked table
+# is written to the changes table in the transaction that makes it, so a
+# client can ask for what changed after the last seq it saw instead of
+# downloading everything again. Rows the ORM flushes are picked up on their
+# own; bulk statements, which the ORM does not see row by row, are
+# announced with record(). The seq is handed out from the 'changes' row of
+# table_versions just before commit: its row lock makes transactions that
+# write changes commit one after the other, so seqs become visible in
+# order and a reader never skips one that commits later.
+
+TRACKED = frozenset([
+    'consumables', 'packages',
+    'consum_consumptions', 'consum_delivery', 'packagesDelivery',
+    'packagesSend', 'packagesReceive',
+    'conditions', 'departments', 'directions', 'parcels', 'roles',
+    'suppliers', 'units',
+])
+
+SEQUENCE = 'changes'
+
+_table = Change.__table__
+_versions = TableVersion.__table__
+
+
+def record(session, table, op, *ids):
+    """
+    Announce that rows of table were inserted, updated or deleted by a
+    statement the ORM does not track
+    """
+    if table in TRACKED:
+        pending = session.info.setdefault('changes', {})
+        for id in ids:
+            pending.setdefault((table, id), op)
+
+
+@event.listens_for(Session, 'after_flush')
+def _flushed(session, flush_context):
+    for op, objects in (('insert', session.new), ('update', session.dirty),
+                        ('delete', session.deleted)):
+        for obj in objects:
+            table = getattr(obj, '__tablename__', None)
+            if table not in TRACKED:
+                continue
+            if op == 'update' and not session.is_modified(obj):
+                continue
+            # new rows have no identity yet, but their key is known
+            key = inspect(obj).mapper.primary_key_from_instance(obj)
+            if key and key[0] is not None:
+                _merge(session, table, key[0], op)
+
+
+def _merge(session, table, id, op):
+    pending = session.info.setdefault('changes', {})
+    if pending.get((table, id)) == 'insert' and op == 'update':
+        return
+    pending[(table, id)] = op
+
+
+@event.listens_for(Session, 'before_commit')
+def _write(session):
+    if session.in_nested_transaction():
+        # releasing a savepoint, the changes wait for the real commit
+        return
+    session.flush()
+    pending = session.info.pop('changes', None)
+    if not pending:
+        return
+
+    session.execute(_versions.update().where(_versions.c.name == SEQUENCE)
+                    .values(version=_versions.c.version + len(pending)))
+    last = session.execute(_versions.select().where(
+        _versions.c.name == SEQUENCE)).first()
+    if last is None:
+        # a database made with create_all, the sequence starts here
+        session.execute(_versions.insert().values(name=SEQUENCE,
+                                                  version=len(pending)))
+        last = len(pending)
+    else:
+        last = last.version
+    first = last - len(pending) + 1
+    now = datetime.now()
+    session.execute(_table.insert(), [
+        dict(seq=seq, table_name=table, row_id=id, op=op, date=now)
+        for seq, ((table, id), op) in enumerate(pending.items(), first)])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget(session, previous_transaction):
+    # a savepoint, or the flush inside one, rolling back leaves the outer
+    # transaction and its changes going on
+    if previous_transaction.parent is None:
+        session.info.pop('changes', None)
+
+
+def since(seq=0):
+    """
+    Select statement of the changes after seq, in order
+    """
+    return _table.select().where(_table.c.seq > seq).order_by(_table.c.seq)
+
+
+def prune(days):
+    """
+    Delete the changes older than days; clients behind them have to
+    download everything again
+    """
+    result = db.session.execute(_table.delete().where(
+        _table.c.date < datetime.now() - timedelta(days=days)))
+    db.session.commit()
+    return result.rowcount
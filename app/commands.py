@@ -0,0 +1,169 @@
+import json
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from . import alerts, changes, export, forecast, importer, kpis, outbox, sessions, stock
+from .models import Employee
+
+
+stock_cli = AppGroup('stock', help='Stock ledger maintenance.')
+session_cli = AppGroup('sessions', help='Server-side session maintenance.')
+catalogue_cli = AppGroup('catalogue', help='Catalogue import.')
+outbox_cli = AppGroup('outbox', help='Publishing of the outbox to other systems.')
+
+
+@stock_cli.command('snapshot')
+def snapshot():
+    """
+    Snapshot the balance of every item that moved since the last run
+    """
+    drift = stock.take_snapshot()
+    for item_type, item_id, counters, ledger in drift:
+        click.echo('{} {}: counters {} but ledger {}'.format(
+            item_type, item_id, counters, ledger))
+    click.echo('Snapshot written, {} item(s) drifted.'.format(len(drift)))
+
+
+@stock_cli.command('forecast')
+@click.option('--all', 'everything', is_flag=True,
+              help='Recompute every consumable, not only the out of date ones.')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Consumables computed and written at a time.')
+def forecast_demand(everything, batch_size):
+    """
+    Recompute demand forecasts and reorder points of the consumables that
+    moved since the last run
+    """
+    count = forecast.recompute(everything, batch_size)
+    click.echo('{} forecast(s) recomputed.'.format(count))
+
+
+@stock_cli.command('balances')
+def rebuild_balances():
+    """
+    Recompute the package balances of every supplier from the whole ledger
+    """
+    stock.rebuild_package_balances()
+    click.echo('Package balances rebuilt.')
+
+
+@stock_cli.command('low-stock')
+def rebuild_low_stock():
+    """
+    Recompute the consumables below their minimum stock
+    """
+    alerts.rebuild()
+    click.echo('Low stock rebuilt.')
+
+
+@stock_cli.command('prune-changes')
+@click.option('--days', type=int, help='Keep this many days, CHANGES_RETENTION_DAYS by default.')
+def prune_changes(days):
+    """
+    Delete old entries of the change feed
+    """
+    if days is None:
+        days = current_app.config['CHANGES_RETENTION_DAYS']
+    pruned = changes.prune(days)
+    click.echo('{} change(s) older than {} days deleted.'.format(pruned, days))
+
+
+@stock_cli.command('kpis')
+def rebuild_kpis():
+    """
+    Recompute the daily consumption and counters of the admin dashboard
+    """
+    kpis.rebuild()
+    click.echo('Dashboard figures rebuilt.')
+
+
+@stock_cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(export.EXPORTS)))
+@click.option('--format', 'format', type=click.Choice(sorted(export.FORMATS)),
+              default='csv', show_default=True)
+@click.option('--from', 'date_from', type=click.DateTime(['%Y-%m-%d']),
+              help='First day to export.')
+@click.option('--to', 'date_to', type=click.DateTime(['%Y-%m-%d']),
+              help='Last day to export.')
+@click.option('--supplier', type=int, help='Only rows of this supplier id.')
+@click.option('--employee', type=int, help='Only rows of this employee id.')
+@click.option('--output', type=click.File('w'), default='-',
+              help='File to write, standard output by default.')
+def export_ledger(kind, format, date_from, date_to, supplier, employee, output):
+    """
+    Stream a ledger or the current stock as CSV or JSON Lines
+    """
+    try:
+        query = export.build(kind, date_from, date_to, supplier, employee)
+    except export.ExportError as error:
+        raise click.ClickException(str(error))
+    for chunk in export.stream(query, format):
+        output.write(chunk)
+
+
+@session_cli.command('purge')
+def purge():
+    """
+    Delete server-side sessions older than the session lifetime
+    """
+    purged = sessions.purge_sessions(current_app)
+    click.echo('{} expired session(s) deleted.'.format(purged))
+
+
+@catalogue_cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(importer.KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Rows written per transaction.')
+@click.option('--user', 'email', help='Employee recorded as the creator of new consumables.')
+def import_catalogue(kind, path, batch_size, email):
+    """
+    Insert or update suppliers, units, parcels, consumables or packages from
+    a CSV or XLSX file whose first row names the columns
+    """
+    user_id = None
+    if email:
+        employee = Employee.query.filter_by(email=email).first()
+        if employee is None:
+            raise click.ClickException('No employee with email {}.'.format(email))
+        user_id = employee.id
+
+    with open(path, 'rb') as stream:
+        try:
+            report = importer.import_rows(kind,
+                                          importer.read_rows(stream, path),
+                                          batch_size, user_id)
+        except importer.ImportFailed as error:
+            raise click.ClickException(str(error))
+
+    for line, reason in report.rejections:
+        click.echo('line {}: {}'.format(line, reason), err=True)
+    click.echo('{} inserted, {} updated, {} rejected.'.format(
+        report.inserted, report.updated, report.rejected))
+
+
+@outbox_cli.command('publish')
+@click.option('--once', is_flag=True, help='Publish what is due and stop.')
+@click.option('--batch-size', type=int, help='Messages per batch, OUTBOX_BATCH_SIZE by default.')
+def publish(once, batch_size):
+    """
+    Publish the outbox to OUTBOX_SINK, polling for new messages until
+    stopped, with throughput reported every minute
+    """
+    sink = outbox.SINKS[current_app.config['OUTBOX_SINK']]()
+    interval = current_app.config['OUTBOX_POLL_INTERVAL']
+    reported = time.monotonic()
+    while True:
+        published = outbox.drain(batch_size, sink)
+        if once and not published:
+            break
+        if not published:
+            time.sleep(interval)
+        if time.monotonic() - reported >= 60:
+            reported = time.monotonic()
+            click.echo(json.dumps(dict(outbox.metrics.as_dict(),
+                                       **outbox.backlog())))
+    click.echo(json.dumps(dict(outbox.metrics.as_dict(), **outbox.backlog())))
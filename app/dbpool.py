@@ -0,0 +1,118 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics(object):
+    """
+    Counters of how this process uses its database connection pool
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.holds = 0
+
+    def waited(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out,
+                                        self.checked_out)
+
+    def held(self, seconds):
+        with self._lock:
+            self.checked_out -= 1
+            self.holds += 1
+            self.hold_total += seconds
+            self.hold_max = max(self.hold_max, seconds)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'checked_out': self.checked_out,
+                'peak_checked_out': self.peak_checked_out,
+                'wait_avg_ms': 1000 * self.wait_total / self.checkouts if self.checkouts else 0.0,
+                'wait_max_ms': 1000 * self.wait_max,
+                'hold_avg_ms': 1000 * self.hold_total / self.holds if self.holds else 0.0,
+                'hold_max_ms': 1000 * self.hold_max,
+            }
+
+
+metrics = PoolMetrics()
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a connection
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super(MeteredQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with metrics._lock:
+                metrics.timeouts += 1
+            raise
+        metrics.waited(time.perf_counter() - start)
+        return connection
+
+
+@event.listens_for(MeteredQueuePool, 'checkout')
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info['checked_out_at'] = time.perf_counter()
+
+
+@event.listens_for(MeteredQueuePool, 'checkin')
+def _checkin(dbapi_connection, connection_record):
+    checked_out_at = connection_record.info.pop('checked_out_at', None)
+    if checked_out_at is not None:
+        metrics.held(time.perf_counter() - checked_out_at)
+
+
+@event.listens_for(MeteredQueuePool, 'connect')
+def _connect(dbapi_connection, connection_record):
+    with metrics._lock:
+        metrics.connects += 1
+
+
+@event.listens_for(MeteredQueuePool, 'invalidate')
+def _invalidate(dbapi_connection, connection_record, exception):
+    with metrics._lock:
+        metrics.invalidations += 1
+
+
+def pool_status(engine):
+    """
+    Metrics of this process plus the current state of the engine's pool
+    """
+    status = metrics.as_dict()
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        status.update({
+            'pool_size': pool.size(),
+            'pool_checked_in': pool.checkedin(),
+            'pool_overflow': pool.overflow(),
+        })
+    return status
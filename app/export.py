@@ -0,0 +1,213 @@
+import csv
+import io
+import json
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from . import db
+from .models import Condition, Consumable, ConsumableConsumption, ConsumableDelivery, Employee, Package, PackageDelivery, PackageReceive, PackageSend, Parcel, Supplier, Unit
+
+
+# Exports of the ledgers and the current stock, streamed from a server-side
+# cursor (stream_results) and written out in chunks, so memory stays flat
+# whatever the number of rows.
+
+CHUNK = 1000
+
+
+def _consumptions():
+    return select(ConsumableConsumption.id.label('id'),
+                  ConsumableConsumption.date.label('date'),
+                  Consumable.id.label('consumable_id'),
+                  Consumable.name.label('consumable'),
+                  ConsumableConsumption.quantity.label('quantity'),
+                  Unit.unit_type.label('unit'),
+                  Employee.id.label('employee_id'),
+                  Employee.username.label('employee')) \
+        .select_from(ConsumableConsumption) \
+        .outerjoin(Consumable, ConsumableConsumption.consumab_id == Consumable.id) \
+        .outerjoin(Unit, Consumable.unit_id == Unit.id) \
+        .outerjoin(Employee, ConsumableConsumption.user_consumption_id == Employee.id)
+
+
+def _consumable_deliveries():
+    return select(ConsumableDelivery.id.label('id'),
+                  ConsumableDelivery.date.label('date'),
+                  Consumable.id.label('consumable_id'),
+                  Consumable.name.label('consumable'),
+                  ConsumableDelivery.quantity.label('quantity'),
+                  Unit.unit_type.label('unit'),
+                  Supplier.id.label('supplier_id'),
+                  Supplier.name.label('supplier'),
+                  Employee.id.label('employee_id'),
+                  Employee.username.label('employee')) \
+        .select_from(ConsumableDelivery) \
+        .outerjoin(Consumable, ConsumableDelivery.consumable_id == Consumable.id) \
+        .outerjoin(Unit, Consumable.unit_id == Unit.id) \
+        .outerjoin(Supplier, ConsumableDelivery.supplier_consumable_delivery_id == Supplier.id) \
+        .outerjoin(Employee, ConsumableDelivery.user_delivery_id == Employee.id)
+
+
+def _package_ledger(model, extra=()):
+    query = select(model.id.label('id'),
+                   model.date.label('date'),
+                   Package.id.label('package_id'),
+                   Package.description.label('package'),
+                   Parcel.name.label('parcel'),
+                   model.quantity.label('quantity'),
+                   *[column for column, join in extra],
+                   model.description.label('description'),
+                   Supplier.id.label('supplier_id'),
+                   Supplier.name.label('supplier'),
+                   Employee.id.label('employee_id'),
+                   Employee.username.label('employee')) \
+        .select_from(model) \
+        .outerjoin(Package, model.package_id == Package.id) \
+        .outerjoin(Parcel, Package.parcel_id == Parcel.id) \
+        .outerjoin(Supplier, model.supplier_id == Supplier.id) \
+        .outerjoin(Employee, model.user_id == Employee.id)
+    for column, join in extra:
+        query = query.outerjoin(*join)
+    return query
+
+
+def _consumable_stock():
+    return select(Consumable.id.label('id'),
+                  Consumable.name.label('consumable'),
+                  Consumable.quantity.label('quantity'),
+                  Consumable.min_stock.label('min_stock'),
+                  Unit.unit_type.label('unit'),
+                  Supplier.id.label('supplier_id'),
+                  Supplier.name.label('supplier')) \
+        .select_from(Consumable) \
+        .outerjoin(Unit, Consumable.unit_id == Unit.id) \
+        .outerjoin(Supplier, Consumable.supplier_id == Supplier.id)
+
+
+def _package_stock():
+    return select(Package.id.label('id'),
+                  Package.description.label('package'),
+                  Parcel.name.label('parcel'),
+                  Package.quantity.label('quantity'),
+                  Package.inside.label('inside'),
+                  Package.outside.label('outside')) \
+        .select_from(Package) \
+        .outerjoin(Parcel, Package.parcel_id == Parcel.id)
+
+
+# kind -> (query builder, id column, date column, supplier column,
+#          employee column); a filter on a missing column is rejected
+EXPORTS = {
+    'consumptions': (_consumptions, ConsumableConsumption.id,
+                     ConsumableConsumption.date, Consumable.supplier_id,
+                     ConsumableConsumption.user_consumption_id),
+    'consumable_deliveries': (_consumable_deliveries, ConsumableDelivery.id,
+                              ConsumableDelivery.date,
+                              ConsumableDelivery.supplier_consumable_delivery_id,
+                              ConsumableDelivery.user_delivery_id),
+    'package_deliveries': (lambda: _package_ledger(PackageDelivery),
+                           PackageDelivery.id, PackageDelivery.date,
+                           PackageDelivery.supplier_id, PackageDelivery.user_id),
+    'package_sends': (lambda: _package_ledger(PackageSend),
+                      PackageSend.id, PackageSend.date,
+                      PackageSend.supplier_id, PackageSend.user_id),
+    'package_receives': (lambda: _package_ledger(PackageReceive, [
+                             (Condition.name.label('condition'),
+                              (Condition, PackageReceive.condition == Condition.id))]),
+                         PackageReceive.id, PackageReceive.date,
+                         PackageReceive.supplier_id, PackageReceive.user_id),
+    'consumable_stock': (_consumable_stock, Consumable.id, None,
+                         Consumable.supplier_id, None),
+    'package_stock': (_package_stock, Package.id, None, None, None),
+}
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+
+class ExportError(Exception):
+    """
+    The export asked for does not exist or cannot be filtered that way
+    """
+
+
+def build(kind, date_from=None, date_to=None, supplier_id=None,
+          employee_id=None):
+    """
+    Select statement of an export, in id order, with the date range
+    (inclusive days), supplier and employee filters applied
+    """
+    if kind not in EXPORTS:
+        raise ExportError("Unknown export '{}', expected one of {}.".format(
+            kind, ', '.join(sorted(EXPORTS))))
+    builder, id, date, supplier, employee = EXPORTS[kind]
+    query = builder()
+    for value, column, name in ((date_from, date, 'date'),
+                                (date_to, date, 'date'),
+                                (supplier_id, supplier, 'supplier'),
+                                (employee_id, employee, 'employee')):
+        if value is not None and column is None:
+            raise ExportError("The {} export has no {} to filter on.".format(
+                kind, name))
+    if date_from is not None:
+        query = query.where(date >= date_from)
+    if date_to is not None:
+        query = query.where(date < date_to + timedelta(days=1))
+    if supplier_id is not None:
+        query = query.where(supplier == supplier_id)
+    if employee_id is not None:
+        query = query.where(employee == employee_id)
+    return query.order_by(id)
+
+
+def _rows(query):
+    """
+    Column names, then row tuples of query, read through a server-side
+    cursor on a connection of its own
+    """
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True,
+                                              max_row_buffer=CHUNK) \
+            .execute(query)
+        yield list(result.keys())
+        for partition in result.partitions(CHUNK):
+            for row in partition:
+                yield row
+
+
+def json_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def stream(query, format):
+    """
+    Chunks of text of the rows of query as CSV or JSON Lines
+    """
+    rows = _rows(query)
+    names = next(rows)
+    buffer = io.StringIO()
+
+    if format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(dict(zip(names, row)),
+                                    default=json_default))
+            buffer.write('\n')
+
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+        if count % CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
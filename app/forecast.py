@@ -0,0 +1,248 @@
+import math
+from datetime import date, datetime, timedelta
+from statistics import NormalDist
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func
+
+from . import db
+from .models import Consumable, ConsumableConsumption, ConsumableDelivery, ConsumableForecast, StockMovement
+
+
+# Demand forecasting and reorder points. The consumption ledger of the last
+# FORECAST_WINDOW_DAYS is summed per consumable and day in SQL and laid out
+# as a consumables x days matrix, from which the daily and weekly demand and
+# their deviation come as whole-array operations. The lead time of a
+# delivery is how long the stock had been at or below min_stock when it
+# arrived, replayed from the stock movements; a consumable without such
+# deliveries takes the median of the other consumables of its supplier, or
+# FORECAST_LEAD_TIME_DAYS. recompute() only touches the consumables with
+# ledger rows since the previous run, or whose forecast is older than
+# FORECAST_MAX_AGE_HOURS, and is meant to be run periodically with
+# `flask stock forecast`.
+
+
+def _ids_to_compute(everything, consumption_top, delivery_top):
+    """
+    Consumables whose forecast is missing, out of date or older than the
+    maximum age
+    """
+    if everything:
+        return [id for id, in db.session.query(Consumable.id)]
+
+    consumption_seen, delivery_seen = db.session.query(
+        func.max(ConsumableForecast.consumption_seen),
+        func.max(ConsumableForecast.delivery_seen)).one()
+    ids = set(id for id, in db.session.query(ConsumableConsumption.consumab_id)
+              .filter(ConsumableConsumption.id > (consumption_seen or 0),
+                      ConsumableConsumption.id <= consumption_top).distinct())
+    ids.update(id for id, in db.session.query(ConsumableDelivery.consumable_id)
+               .filter(ConsumableDelivery.id > (delivery_seen or 0),
+                       ConsumableDelivery.id <= delivery_top).distinct())
+
+    oldest = datetime.now() - timedelta(
+        hours=current_app.config['FORECAST_MAX_AGE_HOURS'])
+    ids.update(id for id, in db.session.query(Consumable.id)
+               .outerjoin(ConsumableForecast)
+               .filter(db.or_(ConsumableForecast.consumable_id.is_(None),
+                              ConsumableForecast.computed_at < oldest)))
+    ids.discard(None)
+    return sorted(ids)
+
+
+def _demand(ids, start, days):
+    """
+    Days of history, daily demand and deviation, weekly demand and
+    deviation of every consumable of ids, as arrays in the order of ids
+    """
+    position = dict((id, index) for index, id in enumerate(ids))
+    day = func.date(ConsumableConsumption.date, type_=db.Date)
+    rows = db.session.query(ConsumableConsumption.consumab_id, day,
+                            func.sum(ConsumableConsumption.quantity)) \
+        .filter(ConsumableConsumption.consumab_id.in_(ids),
+                ConsumableConsumption.date >= start) \
+        .group_by(ConsumableConsumption.consumab_id, day).all()
+
+    series = np.zeros((len(ids), days))
+    if rows:
+        np.add.at(series,
+                  (np.array([position[row[0]] for row in rows]),
+                   np.array([(row[1] - start).days for row in rows])),
+                  np.array([row[2] or 0 for row in rows], dtype=float))
+
+    # a consumable is only judged on the days since its first movement
+    first = dict(db.session.query(ConsumableConsumption.consumab_id,
+                                  func.min(ConsumableConsumption.date))
+                 .filter(ConsumableConsumption.consumab_id.in_(ids))
+                 .group_by(ConsumableConsumption.consumab_id))
+    for id, delivered in db.session.query(ConsumableDelivery.consumable_id,
+                                          func.min(ConsumableDelivery.date)) \
+            .filter(ConsumableDelivery.consumable_id.in_(ids)) \
+            .group_by(ConsumableDelivery.consumable_id):
+        if id not in first or delivered < first[id]:
+            first[id] = delivered
+    offsets = np.array([min(max((first[id].date() - start).days, 0), days)
+                        if id in first else days for id in ids])
+
+    live = np.arange(days) >= offsets[:, None]
+    observed = live.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily = np.where(observed > 0, series.sum(axis=1) / observed, 0.0)
+        daily_deviation = np.where(
+            observed > 1,
+            np.sqrt((((series - daily[:, None]) ** 2) * live).sum(axis=1)
+                    / (observed - 1)),
+            0.0)
+
+        # whole weeks ending today
+        trim = days % 7
+        weekly_series = series[:, trim:].reshape(len(ids), -1, 7).sum(axis=2)
+        full = live[:, trim:].reshape(len(ids), -1, 7).all(axis=2)
+        weeks = full.sum(axis=1)
+        weekly = np.where(weeks > 0,
+                          (weekly_series * full).sum(axis=1) / weeks,
+                          daily * 7)
+        weekly_deviation = np.where(
+            weeks > 1,
+            np.sqrt((((weekly_series - weekly[:, None]) ** 2) * full).sum(axis=1)
+                    / (weeks - 1)),
+            daily_deviation * math.sqrt(7))
+    return observed, daily, daily_deviation, weekly, weekly_deviation
+
+
+def _lead_times(ids, start):
+    """
+    {consumable id: (median lead time in days, number of deliveries)} of
+    the consumables of ids that had deliveries while short
+    """
+    epoch = datetime.combine(start, datetime.min.time())
+
+    def days(value):
+        return (value - epoch).total_seconds() / 86400
+
+    movements = {}
+    for item_id, moved, delta in db.session.query(
+            StockMovement.item_id, StockMovement.date, StockMovement.quantity) \
+            .filter(StockMovement.item_type == Consumable.__tablename__,
+                    StockMovement.item_id.in_(ids),
+                    StockMovement.date >= epoch) \
+            .order_by(StockMovement.item_id, StockMovement.id):
+        movements.setdefault(item_id, ([], []))
+        movements[item_id][0].append(days(moved))
+        movements[item_id][1].append(delta)
+
+    deliveries = {}
+    for consumable_id, delivered in db.session.query(
+            ConsumableDelivery.consumable_id, ConsumableDelivery.date) \
+            .filter(ConsumableDelivery.consumable_id.in_(ids),
+                    ConsumableDelivery.date >= epoch):
+        deliveries.setdefault(consumable_id, []).append(days(delivered))
+
+    stock = dict((row[0], row[1:]) for row in db.session.query(
+        Consumable.id, Consumable.quantity, Consumable.min_stock)
+        .filter(Consumable.id.in_(list(deliveries))))
+
+    lead_times = {}
+    for id, arrivals in deliveries.items():
+        quantity, minimum = stock.get(id, (None, None))
+        if minimum is None or id not in movements:
+            continue
+        times = np.array(movements[id][0])
+        deltas = np.array(movements[id][1])
+        # balance after each movement, replayed back from the current one
+        after = (quantity or 0) - (np.cumsum(deltas[::-1])[::-1] - deltas)
+        before = after - deltas
+        crossings = np.flatnonzero((after <= minimum) & (before > minimum))
+        if not len(crossings):
+            continue
+
+        arrivals = np.array(arrivals)
+        last = np.searchsorted(times, arrivals, side='left') - 1
+        short = last >= 0
+        short[short] = after[last[short]] <= minimum
+        crossing = np.searchsorted(crossings, last, side='right') - 1
+        short &= crossing >= 0
+        if short.any():
+            waited = arrivals[short] - times[crossings[crossing[short]]]
+            lead_times[id] = (float(np.median(waited)), int(short.sum()))
+    return lead_times
+
+
+def recompute(everything=False, batch_size=500):
+    """
+    Recompute the forecasts that are missing or out of date, or all of them
+    with everything; returns the number of consumables recomputed
+    """
+    config = current_app.config
+    consumption_top = db.session.query(func.max(ConsumableConsumption.id)).scalar() or 0
+    delivery_top = db.session.query(func.max(ConsumableDelivery.id)).scalar() or 0
+    ids = _ids_to_compute(everything, consumption_top, delivery_top)
+    if not ids:
+        return 0
+
+    today = date.today()
+    window = config['FORECAST_WINDOW_DAYS']
+    start = today - timedelta(days=window - 1)
+
+    computed = []
+    for offset in range(0, len(ids), batch_size):
+        batch = ids[offset:offset + batch_size]
+        demand = _demand(batch, start, window)
+        lead_times = _lead_times(batch, start)
+        for index, id in enumerate(batch):
+            computed.append((id, [float(values[index]) for values in demand],
+                             lead_times.get(id, (None, 0))))
+
+    # lead time of a supplier: median of those observed on its consumables,
+    # the ones just computed replacing what was stored for them
+    fresh = set(ids)
+    supplier_of = dict(db.session.query(Consumable.id, Consumable.supplier_id)
+                       .filter(Consumable.id.in_(ids)))
+    observed = {}
+    for id, supplier_id, lead_time in db.session.query(
+            ConsumableForecast.consumable_id, Consumable.supplier_id,
+            ConsumableForecast.observed_lead_time) \
+            .join(Consumable) \
+            .filter(ConsumableForecast.observed_lead_time.isnot(None)):
+        if id not in fresh:
+            observed.setdefault(supplier_id, []).append(lead_time)
+    for id, demand, (lead_time, samples) in computed:
+        if lead_time is not None:
+            observed.setdefault(supplier_of.get(id), []).append(lead_time)
+    supplier_lead_times = dict((supplier_id, float(np.median(values)))
+                               for supplier_id, values in observed.items()
+                               if supplier_id is not None)
+
+    z = NormalDist().inv_cdf(config['FORECAST_SERVICE_LEVEL'])
+    cover = config['FORECAST_COVER_DAYS']
+    now = datetime.now()
+    rows = []
+    for id, (days, daily, deviation, weekly, weekly_deviation), \
+            (observed_lead_time, samples) in computed:
+        if observed_lead_time is not None:
+            lead_time, source = observed_lead_time, 'consumable'
+        elif supplier_of.get(id) in supplier_lead_times:
+            lead_time, source = supplier_lead_times[supplier_of[id]], 'supplier'
+        else:
+            lead_time, source = float(config['FORECAST_LEAD_TIME_DAYS']), 'default'
+        # demand over the lead time plus safety stock for its variability
+        safety = z * deviation * math.sqrt(lead_time)
+        rows.append(dict(
+            consumable_id=id, computed_at=now, days=int(days),
+            daily_demand=daily, daily_deviation=deviation,
+            weekly_demand=weekly, weekly_deviation=weekly_deviation,
+            observed_lead_time=observed_lead_time, lead_time_samples=samples,
+            lead_time=lead_time, lead_time_source=source,
+            reorder_point=int(math.ceil(daily * lead_time + max(safety, 0))),
+            reorder_quantity=int(math.ceil(daily * cover)),
+            consumption_seen=consumption_top, delivery_seen=delivery_top))
+
+    table = ConsumableForecast.__table__
+    for offset in range(0, len(rows), batch_size):
+        batch = rows[offset:offset + batch_size]
+        db.session.execute(table.delete().where(table.c.consumable_id.in_(
+            [row['consumable_id'] for row in batch])))
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+    return len(rows)
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from flask import abort, render_template, request
+from sqlalchemy.orm import joinedload
+
+from .models import ConsumableConsumption, ConsumableDelivery, PackageDelivery
+from .pagination import paginate
+
+
+# kind -> (ledger model, owner foreign key, names of the relationships the
+#          rows show, fragment template)
+CONSUMABLE_HISTORY = {
+    'consumption': (ConsumableConsumption, ConsumableConsumption.consumab_id,
+                    ('user_consumption',),
+                    'history/consumption.html'),
+    'delivery': (ConsumableDelivery, ConsumableDelivery.consumable_id,
+                 ('consdelivery', 'supplier'),
+                 'history/consumable_delivery.html'),
+}
+
+PACKAGE_HISTORY = {
+    'delivery': (PackageDelivery, PackageDelivery.package_id,
+                 ('package_delivery', 'package_supplier'),
+                 'history/package_delivery.html'),
+}
+
+
+def _parse_date(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        abort(400)
+
+
+def render_history(histories, kind, owner_id):
+    """
+    Render one page of a ledger history as an HTML fragment
+
+    Only the rows of owner_id are read, newest first, optionally limited to
+    the date_from/date_to (YYYY-MM-DD, inclusive) request arguments.
+    """
+    if kind not in histories:
+        abort(404)
+    model, owner, related, template = histories[kind]
+
+    query = model.query.filter(owner == owner_id).options(
+        *[joinedload(getattr(model, name)) for name in related])
+
+    date_from = _parse_date('date_from')
+    date_to = _parse_date('date_to')
+    if date_from is not None:
+        query = query.filter(model.date >= date_from)
+    if date_to is not None:
+        query = query.filter(model.date < date_to + timedelta(days=1))
+
+    page = paginate(query, model, {'date': model.date},
+                    default_sort='date', default_direction='desc')
+
+    return render_template(template, rows=page.items, page=page,
+                           date_from=request.args.get('date_from', ''),
+                           date_to=request.args.get('date_to', ''))
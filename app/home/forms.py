@@ -1,8 +1,8 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, IntegerField, DateTimeField
+from wtforms import StringField, SubmitField, IntegerField, DateTimeField, SelectField
 from wtforms.validators import DataRequired
-from wtforms_sqlalchemy.fields import QuerySelectField
 
+from .. import reference
 from ..models import Department, Role, Unit, Supplier, Employee, Condition
 
 class ConsumableForm(FlaskForm):
@@ -12,8 +12,8 @@ class ConsumableForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired()])
     quantity = IntegerField('Quantity', validators=[DataRequired()])
     description = StringField('Description', validators=[DataRequired()])
-    unit_id = QuerySelectField(query_factory=lambda: Unit.query.all(), get_label="unit_type")
-    supplier_id = QuerySelectField(query_factory=lambda: Supplier.query.all(), get_label="name")
+    unit_id = SelectField(coerce=int, choices=lambda: reference.choices('units'))
+    supplier_id = SelectField(coerce=int, choices=lambda: reference.choices('suppliers'))
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
 
@@ -30,7 +30,7 @@ class ConsumableDeliveryForm(FlaskForm):
     Form for users to add consumables delivery
     """
     quantity = IntegerField('Quantity')
-    supplier_id = QuerySelectField(query_factory=lambda: Supplier.query.all(), get_label="name")
+    supplier_id = SelectField(coerce=int, choices=lambda: reference.choices('suppliers'))
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
 
@@ -40,8 +40,8 @@ class PackageReceiveForm(FlaskForm):
     """
 
     quantity = IntegerField('Quantity')
-    condition = QuerySelectField(query_factory=lambda: Condition.query.all(), get_label="name")
-    supplier = QuerySelectField(query_factory=lambda: Supplier.query.all(), get_label="name")
+    condition = SelectField(coerce=int, choices=lambda: reference.choices('conditions'))
+    supplier = SelectField(coerce=int, choices=lambda: reference.choices('suppliers'))
     description = StringField('Description')
     submit = SubmitField('Submit')
     cancel = SubmitField('Cancel')
@@ -50,7 +50,7 @@ class PackageDeliveryForm(FlaskForm):
     """
     Form for users to add packages delivery
     """
-    supplier_id = QuerySelectField(query_factory=lambda: Supplier.query.all(), get_label="name")
+    supplier_id = SelectField(coerce=int, choices=lambda: reference.choices('suppliers'))
     quantity = IntegerField('Quantity')
     description = StringField('Description')
     submit = SubmitField('Submit')
@@ -1,11 +1,14 @@
-from flask import abort, render_template, flash, redirect, url_for, request
+from flask import abort, jsonify, render_template, flash, redirect, url_for, request
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 
 from . import home
 
 from .forms import ConsumableForm, ConsumableConsumptionForm, ConsumableDeliveryForm, PackageReceiveForm, PackageDeliveryForm
-from .. import db
+from .. import alerts, bulk, db, kpis, reference, stock
+from ..history import CONSUMABLE_HISTORY, PACKAGE_HISTORY, render_history
+from ..pagination import paginate
 from ..models import Consumable, ConsumableConsumption, ConsumableDelivery, Package, PackageSend, PackageReceive, PackageDelivery, Condition
 
 @home.route('/')
@@ -30,7 +33,9 @@ def admin_dashboard():
     if not current_user.is_admin:
         abort(403)
 
-    return render_template('home/admin_dashboard.html', title="Dashboard")
+    return render_template('home/admin_dashboard.html', tiles=kpis.tiles(),
+                           top_consumers=kpis.top_consumers(),
+                           title="Dashboard")
 
 def check_if_confirmed():
     """
@@ -49,9 +54,14 @@ def list_consumables():
 
     check_if_confirmed()
 
-    consumables = Consumable.query.all()
+    page = paginate(Consumable.list_query(), Consumable,
+                    {'id': Consumable.id, 'name': Consumable.name,
+                     'quantity': Consumable.quantity,
+                     'min_stock': Consumable.min_stock,
+                     'description': Consumable.description})
     return render_template('user/consumables/consumables.html',
-                           consumables=consumables, title='Consumables')
+                           consumables=page.items, page=page,
+                           title='Consumables')
 
 
 @home.route('/consumables/consumption/<int:id>', methods=['GET', 'POST'])
@@ -66,7 +76,6 @@ def consumption_consumables(id):
     add_consumable = False
 
     consumable = Consumable.query.get_or_404(id)
-    consumption = consumable.quantity
     form = ConsumableConsumptionForm(obj=consumable)
     form.quantity.data = ""
     if form.cancel.data:
@@ -74,24 +83,8 @@ def consumption_consumables(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
-
-
-        consum_consumptions = ConsumableConsumption()
-
-        consum_consumptions.consumab_id=consumable.id
-        consum_consumptions.user_consumption_id=curr_user
-        consum_consumptions.date=now
-        consum_consumptions.quantity=request.form['quantity']
-
-        db.session.add(consum_consumptions)
-
-        curr_consum = consum_consumptions.quantity
-        subtraction = int(consumption) - int(curr_consum)
-        consumable.quantity = subtraction
-
-        db.session.commit()
+        stock.consume(consumable.id, int(request.form['quantity']),
+                      current_user.id)
         flash('You have successfully edited the consumable.')
 
         # redirect to the consumables page
@@ -101,6 +94,60 @@ def consumption_consumables(id):
                            add_consumable=add_consumable, form=form,
                            consumable=consumable, title="Consumables consumption")
 
+@home.route('/consumables/bulk', methods=['GET', 'POST'])
+@login_required
+def bulk_consumables():
+    """
+    Record many consumptions or deliveries of consumables at once
+    """
+    check_if_confirmed()
+
+    form = bulk.BulkConsumableForm()
+    if form.cancel.data:
+        return redirect(url_for('home.list_consumables'))
+
+    errors = []
+    if form.validate_on_submit():
+        lines, errors = bulk.read_lines(form)
+        if not lines and not errors:
+            errors = ['Nothing to record, fill in at least one line.']
+        if not errors:
+            if form.kind.data == 'delivery':
+                stock.deliver_consumables(lines, current_user.id)
+            else:
+                stock.consume_many(lines, current_user.id)
+            flash('You have successfully recorded {} lines.'.format(len(lines)))
+
+            # redirect to the consumables page
+            return redirect(url_for('home.list_consumables'))
+
+    return render_template('bulk/consumables.html', form=form, errors=errors,
+                           title='Bulk entry')
+
+
+@home.route('/consumables/low_stock')
+@login_required
+def low_stock():
+    """
+    List the consumables at or below their minimum stock
+    """
+    check_if_confirmed()
+
+    return render_template('low_stock.html', shortages=alerts.shortages(),
+                           title='Low stock')
+
+
+@home.route('/consumables/low_stock.json')
+@login_required
+def low_stock_json():
+    """
+    The consumables at or below their minimum stock, as JSON
+    """
+    check_if_confirmed()
+
+    return jsonify([alerts.as_dict(shortage) for shortage in alerts.shortages()])
+
+
 @home.route('/consumable/details/<int:id>', methods=['GET', 'POST'])
 @login_required
 def details_consumable(id):
@@ -110,12 +157,25 @@ def details_consumable(id):
 
     add_consumable = False
 
-    consumable = Consumable.query.get_or_404(id)
-    consumption = db.session.query(ConsumableConsumption).filter(ConsumableConsumption.consumab_id==consumable.id).order_by(ConsumableConsumption.date.desc()).all()
-    delivers = db.session.query(ConsumableDelivery).filter(ConsumableDelivery.consumable_id==consumable.id).order_by(ConsumableDelivery.date.desc()).all()
+    consumable = Consumable.query.options(
+        joinedload(Consumable.consumable),
+        joinedload(Consumable.supplier),
+        joinedload(Consumable.forecast)).filter_by(id=id).first_or_404()
 
     return render_template('admin/consumable_details/consumable_details.html',
-                        consumable=consumable, consumption=consumption, delivers=delivers, title='Details consumable')
+                        consumable=consumable, title='Details consumable')
+
+
+@home.route('/consumable/details/<int:id>/<kind>')
+@login_required
+def consumable_history(id, kind):
+    """
+    One page of the consumption or delivery history of a consumable,
+    fetched by the details page when its accordion is opened
+    """
+    check_if_confirmed()
+
+    return render_history(CONSUMABLE_HISTORY, kind, id)
 
 
 @home.route('/consumables/delivery/<int:id>', methods=['GET', 'POST'])
@@ -130,7 +190,6 @@ def delivery_consumables(id):
     add_consumable = False
 
     consumable = Consumable.query.get_or_404(id)
-    delivery = consumable.quantity
     form = ConsumableDeliveryForm(obj=consumable)
     form.quantity.data = ""
     if form.cancel.data:
@@ -138,25 +197,10 @@ def delivery_consumables(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
         suppliery = form['supplier_id'].data
 
-        consum_delivery = ConsumableDelivery()
-
-        consum_delivery.consumable_id=consumable.id
-        consum_delivery.user_delivery_id=curr_user
-        consum_delivery.supplier_consumable_delivery_id=suppliery.id
-        consum_delivery.quantity=request.form['quantity'],
-        consum_delivery.date=now
-
-        db.session.add(consum_delivery)
-
-        curr_consum = request.form['quantity']
-        addd = int(curr_consum) + int(delivery)
-        consumable.quantity = addd
-
-        db.session.commit()
+        stock.deliver_consumable(consumable.id, int(request.form['quantity']),
+                                 current_user.id, suppliery)
         flash('You have successfully edited the consumable.')
         # redirect to the consumables page
         return redirect(url_for('home.list_consumables'))
@@ -176,9 +220,27 @@ def list_packages():
     """
     check_if_confirmed()
 
-    packages = Package.query.order_by(Package.description.asc()).all()
+    page = paginate(Package.list_query(), Package,
+                    {'id': Package.id, 'quantity': Package.quantity,
+                     'inside': Package.inside, 'outside': Package.outside,
+                     'description': Package.description})
     return render_template('user/packages/packages.html',
-                           packages=packages, title='Packages')
+                           packages=page.items, page=page, title='Packages')
+
+
+@home.route('/packages/balances')
+@login_required
+def package_balances():
+    """
+    List the packages each supplier still has to return
+    """
+    check_if_confirmed()
+
+    supplier_id = request.args.get('supplier', type=int)
+    return render_template('package_balances.html',
+                           balances=stock.package_balances(supplier_id),
+                           suppliers=reference.choices('suppliers'),
+                           supplier_id=supplier_id, title='Package balances')
 
 @home.route('/packages/delivery/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -191,8 +253,6 @@ def delivery_packages(id):
     add_package = False
 
     package = Package.query.get_or_404(id)
-    delivery = package.quantity
-
     form = PackageDeliveryForm(obj=package)
     form.quantity.data = ""
     if form.cancel.data:
@@ -200,30 +260,11 @@ def delivery_packages(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
         suppliery = form['supplier_id'].data
 
-        package_delivery = PackageDelivery()
-
-        package_delivery.package_id=package.id,
-        package_delivery.quantity=request.form['quantity'],
-        package_delivery.description=form.description.data,
-        package_delivery.supplier_id=suppliery.id,
-        package_delivery.user_id=curr_user
-        package_delivery.date=now
-
-        db.session.add(package_delivery)
-
-        curr_inside = package.inside
-        curr_package = request.form['quantity']
-        addd = int(curr_package) + int(delivery)
-
-        package.inside = int(curr_package) + int(curr_inside)
-        package.quantity = addd
-
-
-        db.session.commit()
+        stock.deliver_package(package.id, int(request.form['quantity']),
+                              current_user.id, suppliery,
+                              form.description.data)
         flash('You have successfully registered the delivery.')
         # redirect to the packages page
         return redirect(url_for('home.list_packages'))
@@ -252,29 +293,11 @@ def send_packages(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
         suppliery = form['supplier_id'].data
 
-        package_send = PackageSend()
-
-        package_send.package_id=package.id,
-        package_send.quantity=request.form['quantity'],
-        package_send.description=form.description.data,
-        package_send.supplier_id=suppliery.id,
-        package_send.user_id=curr_user
-        package_send.date=now
-
-        db.session.add(package_send)
-
-        curr_inside = package.inside
-        curr_package = request.form['quantity']
-
-        package.inside = curr_inside - int(curr_package)
-        package.outside += int(curr_package)
-
-
-        db.session.commit()
+        stock.send_package(package.id, int(request.form['quantity']),
+                           current_user.id, suppliery,
+                           form.description.data)
         flash('You have successfully send package.')
         # redirect to the packages page
         return redirect(url_for('home.list_packages'))
@@ -295,7 +318,6 @@ def receive_packages(id):
     add_package = False
 
     package = Package.query.get_or_404(id)
-    condition = Condition.query.all()
 
     form = PackageReceiveForm(obj=package)
     form.quantity.data = ""
@@ -304,38 +326,12 @@ def receive_packages(id):
 
     if form.validate_on_submit():
 
-        now = datetime.now()
-        curr_user = current_user.id
         suppliery = form['supplier'].data
+        conditiony = form['condition'].data
 
-        package_receive = PackageReceive()
-
-        package_receive.package_id=package.id,
-        package_receive.condition=request.form['condition'],
-        package_receive.quantity=request.form['quantity'],
-        package_receive.description=form.description.data,
-        package_receive.supplier=suppliery.id,
-        package_receive.user_id=curr_user,
-        package_receive.date=now
-
-        db.session.add(package_receive)
-
-        curr_inside = package.inside
-        curr_outside = package.outside
-        curr_package = request.form['quantity']
-
-        req = request.form.get("condition")
-        condit = db.session.query(Condition).filter(Condition.name=="OK").first()
-        curr_condition = condit.id
-
-        if req != str(curr_condition):
-            package.quantity -= int(curr_package)
-            package.outside = curr_outside - int(curr_package)
-        else:
-            package.inside += int(curr_package)
-            package.outside = curr_outside - int(curr_package)
-
-        db.session.commit()
+        stock.receive_package(package.id, int(request.form['quantity']),
+                              current_user.id, suppliery, conditiony,
+                              form.description.data)
 
         flash('You have successfully received package.')
         # redirect to the pac/kages page
@@ -354,9 +350,20 @@ def details_packages(id):
 
     add_package = False
 
-    package = Package.query.get_or_404(id)
-    # consumption = db.session.query(ConsumableConsumption).filter(ConsumableConsumption.consumab_id==consumable.id).order_by(ConsumableConsumption.date.desc()).all()
-    delivers = db.session.query(PackageDelivery).filter(PackageDelivery.package_id==package.id).order_by(PackageDelivery.date.desc()).all()
+    package = Package.query.options(
+        joinedload(Package.parcel)).filter_by(id=id).first_or_404()
 
     return render_template('user/packages/packages_details/packages_details.html',
-                        package=package, delivers=delivers, title='Details package')
+                        package=package, title='Details package')
+
+
+@home.route('/packages/packages_details/packages_details/<int:id>/<kind>')
+@login_required
+def package_history(id, kind):
+    """
+    One page of the delivery history of a package, fetched by the details
+    page when its accordion is opened
+    """
+    check_if_confirmed()
+
+    return render_history(PACKAGE_HISTORY, kind, id)
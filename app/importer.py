@@ -0,0 +1,268 @@
+import codecs
+import csv
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from . import alerts, changes, db, reference, stock
+from .models import Consumable, Package, Parcel, Supplier, Unit
+
+
+# Streaming import of the catalogue from CSV or XLSX. Rows are read one at a
+# time and written in batches: every batch is one SELECT of the rows it
+# already has (matched on the natural key), one executemany INSERT, an
+# executemany UPDATE per set of columns given and one commit, so memory is bounded by the batch size
+# whatever the size of the file. Opening stock goes through the ledger as a
+# movement of the difference, like stock.adjust().
+
+
+class ImportFailed(Exception):
+    """
+    The file as a whole cannot be imported
+    """
+
+
+# kind -> (model, natural key column, columns, {column: referenced table},
+#          stock counters)
+KINDS = {
+    'suppliers': (Supplier, 'name', ('name',), {}, ()),
+    'units': (Unit, 'unit_type', ('unit_type',), {}, ()),
+    'parcels': (Parcel, 'name', ('name', 'weight', 'dimension', 'type'), {}, ()),
+    'consumables': (Consumable, 'name',
+                    ('name', 'quantity', 'min_stock', 'description', 'unit',
+                     'supplier'),
+                    {'unit': Unit, 'supplier': Supplier}, ('quantity',)),
+    'packages': (Package, 'description',
+                 ('description', 'parcel', 'quantity', 'inside', 'outside'),
+                 {'parcel': Parcel}, ('quantity', 'inside', 'outside')),
+}
+
+INTEGERS = ('weight', 'quantity', 'min_stock', 'inside', 'outside')
+
+# columns of the reference tables that their rows are named by
+LABELS = {Supplier: 'name', Unit: 'unit_type', Parcel: 'name'}
+
+
+class Report(object):
+    """
+    What an import did; only the first max_rejected rejections are kept
+    """
+
+    def __init__(self, max_rejected=1000):
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.rejections = []
+        self.max_rejected = max_rejected
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.rejections) < self.max_rejected:
+            self.rejections.append((line, reason))
+
+
+def read_rows(stream, filename):
+    """
+    (line number, {column: text}) of every data row of a CSV or XLSX file,
+    column names taken from its first row
+    """
+    if filename.lower().endswith('.xlsx'):
+        try:
+            import openpyxl
+        except ImportError:
+            raise ImportFailed('Reading .xlsx files needs openpyxl, install it '
+                               'or save the sheet as CSV.')
+        sheet = openpyxl.load_workbook(stream, read_only=True,
+                                       data_only=True).active
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        names = [str(name or '').strip().lower() for name in header]
+        for line, values in enumerate(rows, 2):
+            row = dict.fromkeys(names, '')
+            row.update((name, '' if value is None else str(value).strip())
+                       for name, value in zip(names, values))
+            yield line, row
+        return
+
+    text = codecs.getreader('utf-8-sig')(stream)
+    reader = csv.reader(text)
+    header = next(reader, None) or []
+    names = [name.strip().lower() for name in header]
+    for values in reader:
+        row = dict.fromkeys(names, '')
+        row.update((name, value.strip()) for name, value in zip(names, values))
+        yield reader.line_num, row
+
+
+def _labels(model):
+    label = getattr(model, LABELS[model])
+    return dict((name, id) for id, name in db.session.query(model.id, label))
+
+
+def _parse(kind, row, references):
+    """
+    Values of the columns the file has in one row, or raises ValueError
+    with the reason; an empty number is left out, so an existing row keeps
+    its current value
+    """
+    model, key, columns, referenced, counters = KINDS[kind]
+    values = {}
+    if not row.get(key):
+        raise ValueError('{} is empty'.format(key))
+    for column in columns:
+        if column not in row:
+            continue
+        text = row[column]
+        if column in referenced:
+            if not text:
+                raise ValueError('{} is empty'.format(column))
+            if text not in references[column]:
+                raise ValueError("unknown {} '{}'".format(column, text))
+            values[column + '_id'] = references[column][text]
+        elif column in INTEGERS:
+            if not text:
+                continue
+            try:
+                values[column] = int(float(text))
+            except ValueError:
+                raise ValueError("{} '{}' is not a number".format(column, text))
+        else:
+            length = getattr(model, column).type.length
+            if length and len(text) > length:
+                raise ValueError('{} is longer than {} characters'.format(column, length))
+            values[column] = text
+
+    if kind == 'packages' and values.get('quantity') is not None and \
+            values.get('inside') is None:
+        # what is not outside is inside
+        values['inside'] = values['quantity'] - (values.get('outside') or 0)
+    return values
+
+
+def _write(kind, batch, user_id, report):
+    model, key, columns, referenced, counters = KINDS[kind]
+    key_column = getattr(model, key)
+    # rows with empty numbers have fewer columns than the others
+    names = list(dict.fromkeys(name for line, values in batch
+                               for name in values if name not in counters))
+    given = [name for name in counters
+             if any(name in values for line, values in batch)]
+
+    existing = dict((row[0], row[1:]) for row in db.session.query(
+        key_column, model.id, *[getattr(model, name) for name in counters])
+        .filter(key_column.in_([values[key] for line, values in batch]))
+        .with_for_update())
+
+    inserts = []
+    updates = {}
+    for line, values in batch:
+        if values[key] in existing:
+            row = dict((name, values[name]) for name in names if name in values)
+            row['b_id'] = existing[values[key]][0]
+            updates.setdefault(tuple(name for name in names if name in values),
+                               []).append(row)
+        else:
+            row = dict((name, values.get(name)) for name in names)
+            for name in counters:
+                row[name] = 0
+            if kind == 'consumables':
+                row['user_id'] = user_id
+            inserts.append(row)
+
+    table = model.__table__
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+    # one executemany UPDATE per set of columns given
+    for columns, rows in updates.items():
+        db.session.execute(table.update().where(table.c.id == bindparam('b_id'))
+                           .values(dict((name, bindparam(name)) for name in columns)),
+                           rows)
+
+    if given:
+        if inserts:
+            for row in db.session.query(key_column, model.id).filter(
+                    key_column.in_([row[key] for row in inserts])):
+                existing[row[0]] = (row[1],) + (0,) * len(counters)
+        date = datetime.now()
+        movements = []
+        counter_updates = []
+        for line, values in batch:
+            current = existing[values[key]]
+            deltas = dict((name, values[name] - (value or 0))
+                          for name, value in zip(counters, current[1:])
+                          if values.get(name) is not None)
+            if any(deltas.values()):
+                movement = dict(item_type=model.__tablename__,
+                                item_id=current[0], quantity=0, inside=0,
+                                outside=0, date=date)
+                movement.update(deltas)
+                movements.append(movement)
+                counter_updates.append(dict(
+                    b_id=current[0],
+                    **dict((name, values[name] if name in deltas else value)
+                           for name, value in zip(counters, current[1:]))))
+        if movements:
+            db.session.execute(table.update().where(table.c.id == bindparam('b_id'))
+                               .values(dict((name, bindparam(name))
+                                            for name in counters)),
+                               counter_updates)
+            stock.insert_movements(movements, 'import')
+    written = dict(db.session.query(key_column, model.id).filter(
+        key_column.in_([values[key] for line, values in batch])))
+    changes.record(db.session, model.__tablename__, 'insert',
+                   *[written[row[key]] for row in inserts])
+    changes.record(db.session, model.__tablename__, 'update',
+                   *[row['b_id'] for rows in updates.values() for row in rows])
+    if kind == 'consumables':
+        alerts.touch(db.session, *written.values())
+    db.session.commit()
+
+    report.inserted += len(inserts)
+    report.updated += sum(len(rows) for rows in updates.values())
+
+
+def import_rows(kind, rows, batch_size=1000, user_id=None):
+    """
+    Insert or update the rows of kind, matched on their natural key
+
+    rows are (line number, {column: text}) as given by read_rows(). Rows
+    that cannot be imported are rejected with the reason and the others
+    still go in. Names of units, suppliers and parcels are resolved to ids
+    from a map of the table read once.
+    """
+    if kind not in KINDS:
+        raise ImportFailed("Unknown kind '{}', expected one of {}.".format(
+            kind, ', '.join(sorted(KINDS))))
+    model, key, columns, referenced, counters = KINDS[kind]
+    references = dict((column, _labels(table))
+                      for column, table in referenced.items())
+
+    report = Report()
+    batch = {}
+    checked = False
+    for line, row in rows:
+        if not checked:
+            missing = [column for column in (key,) + tuple(referenced)
+                       if column not in row]
+            if missing:
+                raise ImportFailed('The file has no {} column; expected columns: {}.'.format(
+                    ', '.join(missing), ', '.join(columns)))
+            checked = True
+        try:
+            values = _parse(kind, row, references)
+        except ValueError as error:
+            report.reject(line, str(error))
+            continue
+        if values[key] in batch:
+            report.reject(batch[values[key]][0],
+                          'replaced by line {} with the same {}'.format(line, key))
+        batch[values[key]] = (line, values)
+        if len(batch) >= batch_size:
+            _write(kind, list(batch.values()), user_id, report)
+            batch = {}
+    if batch:
+        _write(kind, list(batch.values()), user_id, report)
+
+    if kind in reference.TABLES:
+        reference.touch(kind)
+    return report
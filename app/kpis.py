@@ -0,0 +1,111 @@
+from datetime import date, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import ConsumableConsumption, Counter, DailyConsumption, Employee, LowStock, PackageBalance
+
+
+# Figures of the admin dashboard, all read from small tables kept up to date
+# as the data changes and never from the ledgers: low_stock (app.alerts),
+# package_balances and daily_consumption (app.stock), and the counters of
+# kpi_counters, like the employees waiting for confirmation, which are kept
+# here from the ORM flushes. rebuild() recomputes them from the source
+# tables.
+
+_counters = Counter.__table__
+
+
+def _add(session, name, delta):
+    bump = _counters.update().where(_counters.c.name == name) \
+        .values(value=_counters.c.value + delta)
+    if not session.execute(bump).rowcount:
+        # a database made with create_all, the counter starts here
+        session.execute(_counters.insert().values(name=name, value=delta))
+
+
+@event.listens_for(Session, 'after_flush')
+def _flushed(session, flush_context):
+    pending = 0
+    for employee in session.new:
+        if isinstance(employee, Employee) and not employee.is_confirmed:
+            pending += 1
+    for employee in session.deleted:
+        if isinstance(employee, Employee) and not employee.is_confirmed:
+            pending -= 1
+    for employee in session.dirty:
+        if not isinstance(employee, Employee):
+            continue
+        history = inspect(employee).attrs.is_confirmed.history
+        if history.has_changes():
+            was = bool(history.deleted and history.deleted[0])
+            pending += int(was) - int(bool(employee.is_confirmed))
+    if pending:
+        _add(session, 'pending_confirmations', pending)
+
+
+def tiles():
+    """
+    The dashboard figures, in one query of scalar subqueries
+    """
+    today = date.today()
+    row = db.session.execute(select(
+        select(func.count()).select_from(LowStock).scalar_subquery(),
+        select(func.coalesce(func.sum(PackageBalance.outstanding), 0))
+        .where(PackageBalance.outstanding > 0).scalar_subquery(),
+        select(func.coalesce(func.sum(DailyConsumption.quantity), 0))
+        .where(DailyConsumption.day == today).scalar_subquery(),
+        select(func.coalesce(func.sum(DailyConsumption.lines), 0))
+        .where(DailyConsumption.day == today).scalar_subquery(),
+        select(Counter.value).where(Counter.name == 'pending_confirmations')
+        .scalar_subquery())).one()
+    return {
+        'low_stock': row[0],
+        'packages_outstanding': int(row[1]),
+        'consumed_today': int(row[2]),
+        'consumption_lines_today': int(row[3]),
+        'pending_confirmations': row[4] or 0,
+    }
+
+
+def top_consumers(days=None, limit=5):
+    """
+    (employee, quantity, lines) of the employees who consumed the most in
+    the last days
+    """
+    days = days or current_app.config['KPI_TOP_CONSUMER_DAYS']
+    since = date.today() - timedelta(days=days - 1)
+    quantity = func.sum(DailyConsumption.quantity).label('quantity')
+    return db.session.query(Employee.username, quantity,
+                            func.sum(DailyConsumption.lines).label('lines')) \
+        .join(Employee, DailyConsumption.employee_id == Employee.id) \
+        .filter(DailyConsumption.day >= since) \
+        .group_by(Employee.id, Employee.username) \
+        .order_by(quantity.desc()).limit(limit).all()
+
+
+def rebuild():
+    """
+    Recompute the daily consumption and the counters from the source tables
+    """
+    day = func.date(ConsumableConsumption.date, type_=db.Date)
+    totals = select(day, ConsumableConsumption.user_consumption_id,
+                    func.sum(ConsumableConsumption.quantity),
+                    func.count(ConsumableConsumption.id)) \
+        .where(ConsumableConsumption.user_consumption_id.isnot(None)) \
+        .group_by(day, ConsumableConsumption.user_consumption_id)
+    table = DailyConsumption.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['day', 'employee_id', 'quantity', 'lines'], totals))
+
+    pending = db.session.query(func.count(Employee.id)) \
+        .filter(db.or_(Employee.is_confirmed == False,
+                       Employee.is_confirmed.is_(None))).scalar()
+    db.session.execute(_counters.delete().where(
+        _counters.c.name == 'pending_confirmations'))
+    db.session.execute(_counters.insert().values(name='pending_confirmations',
+                                                 value=pending))
+    db.session.commit()
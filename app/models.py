@@ -1,8 +1,10 @@
 from flask_login import UserMixin
+from sqlalchemy.orm import joinedload, load_only
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
 from app import db, login_manager
+from app.cache import TTLCache
 
 class Employee(UserMixin, db.Model):
     """
@@ -52,13 +54,55 @@ class Employee(UserMixin, db.Model):
         """
         return check_password_hash(self.password_hash, password)
 
+    @classmethod
+    def list_query(cls):
+        """
+        Query for the employees list page, with department and role joined
+        in the same query instead of a select per row
+        """
+        return cls.query.options(joinedload(cls.department).load_only(Department.name),
+                                 joinedload(cls.role).load_only(Role.name))
+
     def __repr__(self):
         return '<Employee: {}>'.format(self.username)
 
+class Principal(UserMixin):
+    """
+    Detached copy of the fields of an Employee needed to authorise requests
+    """
+
+    def __init__(self, employee):
+        self.id = employee.id
+        self.username = employee.username
+        self.is_admin = employee.is_admin
+        self.is_confirmed = employee.is_confirmed
+        self.is_granted = employee.is_granted
+        self.department_id = employee.department_id
+        self.role_id = employee.role_id
+
+    def __repr__(self):
+        return '<Principal: {}>'.format(self.username)
+
+# logged-in employees by id, sized from PRINCIPAL_CACHE_SIZE/_TTL in create_app
+principal_cache = TTLCache()
+
+def forget_user(user_id):
+    """
+    Drop a cached principal after its employee was changed or deleted
+    """
+    principal_cache.pop(int(user_id))
+
 # Set up user_loader
 @login_manager.user_loader
 def load_user(user_id):
-    return Employee.query.get(int(user_id))
+    principal = principal_cache.get(int(user_id))
+    if principal is None:
+        employee = Employee.query.get(int(user_id))
+        if employee is None:
+            return None
+        principal = Principal(employee)
+        principal_cache.set(employee.id, principal)
+    return principal
 
 class Department(db.Model):
     """
@@ -143,6 +187,9 @@ class Condition(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60))
+    # received packages in this condition go back inside, otherwise they
+    # are written off
+    returns_to_stock = db.Column(db.Boolean, nullable=False, default=False)
     package_receive_condition = db.relationship('PackageReceive', backref='package_condition', lazy='dynamic')
 
     def __repr__(self):
@@ -178,6 +225,14 @@ class Package(db.Model):
     packages_send_id = db.relationship('PackageSend', backref='packages_send_id', lazy='dynamic')
     package_receive_package_id = db.relationship('PackageReceive', backref='package_receive', lazy='dynamic')
 
+    @classmethod
+    def list_query(cls):
+        """
+        Query for the packages list pages, with the parcel joined in the
+        same query instead of a select per row
+        """
+        return cls.query.options(joinedload(cls.parcel).load_only(Parcel.name))
+
     def __repr__(self):
         return '<Package: {}>'.format(self.name)
 
@@ -187,14 +242,17 @@ class PackageDelivery(db.Model):
     """
 
     __tablename__='packagesDelivery'
+    __table_args__ = (
+        db.Index('ix_packagesDelivery_package_id_date', 'package_id', 'date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     package_id = db.Column(db.Integer, db.ForeignKey('packages.id'))
     quantity = db.Column(db.Integer)
     description = db.Column(db.String(200))
-    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('employees.id'))
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('employees.id'), index=True)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
 
 class PackageSend(db.Model):
@@ -203,14 +261,17 @@ class PackageSend(db.Model):
     """
 
     __tablename__='packagesSend'
+    __table_args__ = (
+        db.Index('ix_packagesSend_package_id_date', 'package_id', 'date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     package_id = db.Column(db.Integer, db.ForeignKey('packages.id'))
     quantity = db.Column(db.Integer)
     description = db.Column(db.String(200))
-    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('employees.id'))
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('employees.id'), index=True)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
 class PackageReceive(db.Model):
     """
@@ -218,15 +279,18 @@ class PackageReceive(db.Model):
     """
 
     __tablename__='packagesReceive'
+    __table_args__ = (
+        db.Index('ix_packagesReceive_package_id_date', 'package_id', 'date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     package_id = db.Column(db.Integer, db.ForeignKey('packages.id'))
-    condition = db.Column(db.Integer, db.ForeignKey('conditions.id'))
+    condition = db.Column(db.Integer, db.ForeignKey('conditions.id'), index=True)
     quantity = db.Column(db.Integer)
     description = db.Column(db.String(200))
-    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('employees.id'))
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('employees.id'), index=True)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     def __repr__(self):
         return '<PackageReceive: {}>'.format(self.name)
@@ -241,7 +305,7 @@ class Unit(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     unit_type = db.Column(db.String(10))
-    consumableses = db.relationship('Consumable', backref='consumable', lazy='joined')
+    consumableses = db.relationship('Consumable', backref='consumable', lazy='dynamic')
 
 
     def __repr__(self):
@@ -263,10 +327,25 @@ class Consumable(db.Model):
     unit_id = db.Column(db.Integer, db.ForeignKey('units.id'))
     supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'))
     user_id = db.Column(db.Integer, db.ForeignKey('employees.id'))
-    consumption_consumable = db.relationship('ConsumableConsumption', backref='consumption_consumable', lazy='joined', cascade="all,delete")
-    delivery_consumable = db.relationship('ConsumableDelivery', backref='delivery_consumable', lazy='joined', cascade="all,delete")
+    consumption_consumable = db.relationship('ConsumableConsumption', backref='consumption_consumable', lazy='dynamic', cascade="all,delete")
+    delivery_consumable = db.relationship('ConsumableDelivery', backref='delivery_consumable', lazy='dynamic', cascade="all,delete")
     min_stock = db.Column(db.Integer)
 
+    @classmethod
+    def list_query(cls):
+        """
+        Query for the consumables list pages, loading only the shown columns
+        and never touching the consumption/delivery history; unit, supplier
+        and user come joined in the same query instead of a select per row
+        """
+        return cls.query.options(load_only(cls.id, cls.name, cls.quantity,
+                                           cls.min_stock, cls.description,
+                                           cls.unit_id, cls.supplier_id,
+                                           cls.user_id),
+                                 joinedload(cls.consumable).load_only(Unit.unit_type),
+                                 joinedload(cls.supplier).load_only(Supplier.name),
+                                 joinedload(cls.consumable_user).load_only(Employee.username))
+
     def __repr__(self):
         return '<Consumable: {}>'.format(self.name)
 
@@ -276,13 +355,16 @@ class ConsumableDelivery(db.Model):
     """
 
     __tablename__ = 'consum_delivery'
+    __table_args__ = (
+        db.Index('ix_consum_delivery_consumable_id_date', 'consumable_id', 'date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     consumable_id = db.Column(db.Integer, db.ForeignKey('consumables.id'))
-    user_delivery_id = db.Column(db.Integer, db.ForeignKey('employees.id'))
-    supplier_consumable_delivery_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'))
+    user_delivery_id = db.Column(db.Integer, db.ForeignKey('employees.id'), index=True)
+    supplier_consumable_delivery_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'), index=True)
     quantity = db.Column(db.Integer)
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     def __repr__(self):
         return '<ConsumableDelivery: {}>'.format(self.name)
@@ -293,12 +375,252 @@ class ConsumableConsumption(db.Model):
     """
 
     __tablename__ = 'consum_consumptions'
+    __table_args__ = (
+        db.Index('ix_consum_consumptions_consumab_id_date', 'consumab_id', 'date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     consumab_id = db.Column(db.Integer, db.ForeignKey('consumables.id'))
-    user_consumption_id = db.Column(db.Integer, db.ForeignKey('employees.id'))
+    user_consumption_id = db.Column(db.Integer, db.ForeignKey('employees.id'), index=True)
     quantity = db.Column(db.Integer)
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     def __repr__(self):
         return '<ConsumableConsumption: {}>'.format(self.id, self.consumab_id, self.user_consumption_id, self.quantity, self.date)
+
+#stock ledger
+
+class StockMovement(db.Model):
+    """
+    Create StockMovement table
+
+    Append-only log of every change to the stock counters of consumables
+    and packages. Rows are never updated or deleted.
+    """
+
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_item', 'item_type', 'item_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_type = db.Column(db.String(20), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    inside = db.Column(db.Integer, nullable=False, default=0)
+    outside = db.Column(db.Integer, nullable=False, default=0)
+    date = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<StockMovement: {} {} {}>'.format(self.item_type, self.item_id, self.id)
+
+class StockSnapshot(db.Model):
+    """
+    Create StockSnapshot table
+
+    Balance of one item as of movement_id, written periodically so a balance
+    at any point in time needs only the movements after the nearest snapshot.
+    """
+
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        db.Index('ix_stock_snapshots_item', 'item_type', 'item_id', 'movement_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_type = db.Column(db.String(20), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    movement_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    inside = db.Column(db.Integer, nullable=False, default=0)
+    outside = db.Column(db.Integer, nullable=False, default=0)
+    date = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<StockSnapshot: {} {} {}>'.format(self.item_type, self.item_id, self.movement_id)
+
+# returnable packaging
+
+class PackageBalance(db.Model):
+    """
+    Create PackageBalance table
+
+    Packages moved between us and one supplier, kept up to date by
+    app.stock with every delivery, send and receive. outstanding is what
+    was sent and has not come back, what the supplier owes us.
+    """
+
+    __tablename__ = 'package_balances'
+    __table_args__ = (
+        db.Index('ix_package_balances_supplier_outstanding', 'supplier_id', 'outstanding'),
+    )
+
+    package_id = db.Column(db.Integer, db.ForeignKey('packages.id', ondelete='CASCADE'), primary_key=True)
+    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id', ondelete='CASCADE'), primary_key=True)
+    delivered = db.Column(db.Integer, nullable=False, default=0)
+    sent = db.Column(db.Integer, nullable=False, default=0)
+    received = db.Column(db.Integer, nullable=False, default=0)
+    written_off = db.Column(db.Integer, nullable=False, default=0)
+    outstanding = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    package = db.relationship('Package')
+    supplier = db.relationship('Supplier')
+
+    def __repr__(self):
+        return '<PackageBalance: {} {}>'.format(self.package_id, self.supplier_id)
+
+# low stock
+
+class LowStock(db.Model):
+    """
+    Create LowStock table
+
+    The consumables whose quantity is at or below their min_stock, kept up
+    to date by app.alerts whenever their stock or minimum changes.
+    """
+
+    __tablename__ = 'low_stock'
+    __table_args__ = (
+        db.Index('ix_low_stock_since', 'since'),
+    )
+
+    consumable_id = db.Column(db.Integer, db.ForeignKey('consumables.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    min_stock = db.Column(db.Integer, nullable=False)
+    since = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    consumable = db.relationship('Consumable', backref=db.backref('low_stock', uselist=False, passive_deletes=True))
+
+    def __repr__(self):
+        return '<LowStock: {}>'.format(self.consumable_id)
+
+# forecasting
+
+class ConsumableForecast(db.Model):
+    """
+    Create ConsumableForecast table
+
+    Demand of one consumable estimated from its consumption history and the
+    reorder point and quantity proposed from it, recomputed by app.forecast.
+    """
+
+    __tablename__ = 'consumable_forecasts'
+
+    consumable_id = db.Column(db.Integer, db.ForeignKey('consumables.id', ondelete='CASCADE'), primary_key=True)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    days = db.Column(db.Integer, nullable=False)
+    daily_demand = db.Column(db.Float, nullable=False)
+    daily_deviation = db.Column(db.Float, nullable=False)
+    weekly_demand = db.Column(db.Float, nullable=False)
+    weekly_deviation = db.Column(db.Float, nullable=False)
+    observed_lead_time = db.Column(db.Float)
+    lead_time_samples = db.Column(db.Integer, nullable=False, default=0)
+    lead_time = db.Column(db.Float, nullable=False)
+    lead_time_source = db.Column(db.String(10), nullable=False)
+    reorder_point = db.Column(db.Integer, nullable=False)
+    reorder_quantity = db.Column(db.Integer, nullable=False)
+    consumption_seen = db.Column(db.Integer, nullable=False, default=0)
+    delivery_seen = db.Column(db.Integer, nullable=False, default=0)
+    consumable = db.relationship('Consumable', backref=db.backref('forecast', uselist=False, passive_deletes=True))
+
+    def __repr__(self):
+        return '<ConsumableForecast: {}>'.format(self.consumable_id)
+
+# change counters
+
+class TableVersion(db.Model):
+    """
+    Create TableVersion table
+
+    Number of transactions that changed each table, bumped by app.versions
+    in the transaction of the change and read to build ETags.
+    """
+
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<TableVersion: {} {}>'.format(self.name, self.version)
+
+class Change(db.Model):
+    """
+    Create Change table
+
+    One row per row of a tracked table inserted, updated or deleted,
+    numbered by seq in commit order, written by app.changes in the
+    transaction of the change.
+    """
+
+    __tablename__ = 'changes'
+
+    seq = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    table_name = db.Column(db.String(64), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(6), nullable=False)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<Change: {} {} {} {}>'.format(self.seq, self.op, self.table_name, self.row_id)
+
+# outbox
+
+class OutboxMessage(db.Model):
+    """
+    Create OutboxMessage table
+
+    Messages for systems outside the app, added in the transaction of the
+    stock movement they describe and deleted once app.outbox published them.
+    """
+
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        db.Index('ix_outbox_next_attempt', 'next_attempt'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(200))
+
+    def __repr__(self):
+        return '<OutboxMessage: {} {}>'.format(self.id, self.topic)
+
+# dashboard aggregates
+
+class DailyConsumption(db.Model):
+    """
+    Create DailyConsumption table
+
+    Quantity and number of consumption lines per day and employee, added to
+    by app.stock with every consumption.
+    """
+
+    __tablename__ = 'daily_consumption'
+
+    day = db.Column(db.Date, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employees.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    lines = db.Column(db.Integer, nullable=False, default=0)
+    employee = db.relationship('Employee')
+
+    def __repr__(self):
+        return '<DailyConsumption: {} {}>'.format(self.day, self.employee_id)
+
+class Counter(db.Model):
+    """
+    Create Counter table
+
+    Named running totals kept by app.kpis for the admin dashboard.
+    """
+
+    __tablename__ = 'kpi_counters'
+
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<Counter: {} {}>'.format(self.name, self.value)
@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from . import db
+from .models import OutboxMessage
+
+
+# Transactional outbox. Every stock movement adds a message to the outbox
+# table in the transaction that makes it, so a message exists exactly when
+# the movement committed and the request never waits on anything outside
+# the database. A separate publisher (`flask outbox publish`) drains the
+# table in batches to the OUTBOX_SINK and deletes what was delivered; a
+# batch that fails is retried with exponential backoff. Delivery is at
+# least once: a consumer tells messages apart by their id, and stock
+# movements by their movement_id.
+
+log = logging.getLogger(__name__)
+
+_table = OutboxMessage.__table__
+
+
+def add(session, topic, payloads):
+    """
+    Queue messages of topic, one per payload, in the current transaction
+    """
+    if not payloads:
+        return
+    now = datetime.now()
+    session.execute(_table.insert(), [
+        dict(topic=topic, payload=json.dumps(payload, default=str),
+             created=now, next_attempt=now, attempts=0)
+        for payload in payloads])
+
+
+def add_movements(session, reason, movements):
+    """
+    Queue a stock.movement message per stock movement, given as dicts of
+    StockMovement columns with their id; reason says what moved the stock
+    """
+    add(session, 'stock.movement', [
+        dict(movement_id=movement['id'], reason=reason,
+             item_type=movement['item_type'],
+             item_id=movement['item_id'],
+             quantity=movement.get('quantity', 0),
+             inside=movement.get('inside', 0),
+             outside=movement.get('outside', 0),
+             date=movement['date'].isoformat())
+        for movement in movements])
+
+
+class SpoolSink(object):
+    """
+    Writes each batch as a JSON Lines file in OUTBOX_SPOOL_DIR, for a
+    local collector to pick up; the file appears complete or not at all
+    """
+
+    def send(self, messages):
+        directory = current_app.config['OUTBOX_SPOOL_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = '{}-{}.jsonl'.format(datetime.now().strftime('%Y%m%d%H%M%S%f'),
+                                    messages[0]['id'])
+        temporary = os.path.join(directory, '.' + name)
+        with open(temporary, 'w') as output:
+            for message in messages:
+                output.write(json.dumps(message) + '\n')
+        os.replace(temporary, os.path.join(directory, name))
+
+
+class HTTPSink(object):
+    """
+    POSTs each batch as a JSON array to OUTBOX_HTTP_URL, a local receiver
+    or a stand-in for one; anything but a 2xx answer fails the batch
+    """
+
+    def send(self, messages):
+        request = urllib.request.Request(
+            current_app.config['OUTBOX_HTTP_URL'],
+            data=json.dumps(messages).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=10) as response:
+            if not 200 <= response.status < 300:
+                raise IOError('HTTP {}'.format(response.status))
+
+
+# OUTBOX_SINK -> factory of the sink; register_sink() adds more
+SINKS = {
+    'spool': SpoolSink,
+    'http': HTTPSink,
+}
+
+
+def register_sink(name, factory):
+    SINKS[name] = factory
+
+
+class PublisherMetrics(object):
+    """
+    Throughput of the publisher in this process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.batches = 0
+        self.published = 0
+        self.failed_batches = 0
+        self.send_time = 0.0
+        self.last_error = None
+
+    def sent(self, count, elapsed):
+        with self._lock:
+            self.batches += 1
+            self.published += count
+            self.send_time += elapsed
+
+    def failed(self, error):
+        with self._lock:
+            self.failed_batches += 1
+            self.last_error = str(error)
+
+    def as_dict(self):
+        with self._lock:
+            running = time.monotonic() - self.started
+            return {
+                'batches': self.batches,
+                'published': self.published,
+                'failed_batches': self.failed_batches,
+                'messages_per_second': self.published / running if running else 0.0,
+                'avg_batch_ms': 1000 * self.send_time / self.batches if self.batches else 0.0,
+                'last_error': self.last_error,
+            }
+
+
+metrics = PublisherMetrics()
+
+
+def _backoff(attempts):
+    config = current_app.config
+    return min(config['OUTBOX_RETRY_BASE'] * 2 ** (attempts - 1),
+               config['OUTBOX_RETRY_MAX'])
+
+
+def drain(batch_size=None, sink=None):
+    """
+    Publish one batch of the messages that are due; returns how many were
+    published, 0 when none were due or the batch failed
+    """
+    batch_size = batch_size or current_app.config['OUTBOX_BATCH_SIZE']
+    sink = sink or SINKS[current_app.config['OUTBOX_SINK']]()
+    now = datetime.now()
+    # concurrent publishers each take rows the others have not locked
+    rows = db.session.query(OutboxMessage) \
+        .filter(OutboxMessage.next_attempt <= now) \
+        .order_by(OutboxMessage.id).limit(batch_size) \
+        .with_for_update(skip_locked=True).all()
+    if not rows:
+        db.session.commit()
+        return 0
+
+    messages = [dict(id=row.id, topic=row.topic, created=row.created.isoformat(),
+                     payload=json.loads(row.payload)) for row in rows]
+    start = time.perf_counter()
+    try:
+        sink.send(messages)
+    except Exception as error:
+        metrics.failed(error)
+        log.warning('Publishing %d outbox message(s) failed: %s', len(rows), error)
+        for row in rows:
+            row.attempts += 1
+            row.next_attempt = now + timedelta(seconds=_backoff(row.attempts))
+            row.last_error = str(error)[:200]
+        db.session.commit()
+        return 0
+
+    db.session.execute(_table.delete().where(_table.c.id.in_([row.id for row in rows])))
+    db.session.commit()
+    metrics.sent(len(rows), time.perf_counter() - start)
+    return len(rows)
+
+
+def backlog():
+    """
+    Size and age of what is waiting in the outbox
+    """
+    now = datetime.now()
+    pending, retrying, oldest = db.session.query(
+        db.func.count(OutboxMessage.id),
+        db.func.sum(db.case((OutboxMessage.attempts > 0, 1), else_=0)),
+        db.func.min(OutboxMessage.created)).one()
+    return {
+        'pending': pending,
+        'retrying': int(retrying or 0),
+        'oldest_seconds': (now - oldest).total_seconds() if oldest else 0.0,
+    }
@@ -0,0 +1,142 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import abort, current_app, request
+from sqlalchemy import DateTime, and_, or_
+
+
+class Page(object):
+    """
+    One page of a keyset paginated list
+    """
+
+    def __init__(self, items, sort, direction, size,
+                 next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.sort = sort
+        self.direction = direction
+        self.size = size
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(values):
+    """
+    Turn the sort values of a row into an opaque url-safe cursor
+    """
+    values = [value.isoformat() if isinstance(value, datetime) else value
+              for value in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Read a cursor made by encode_cursor, abort with 400 if it is malformed
+    """
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        abort(400)
+
+
+def _seek(key, pk, value, last_id, descending):
+    # MySQL and SQLite order NULL before every other value, so a nullable
+    # column is sorted as it is and the predicate places NULLs first
+    if descending:
+        if value is None:
+            return and_(key.is_(None), pk < last_id)
+        return or_(key < value, and_(key == value, pk < last_id), key.is_(None))
+    if value is None:
+        return or_(key.isnot(None), and_(key.is_(None), pk > last_id))
+    return or_(key > value, and_(key == value, pk > last_id))
+
+
+def paginate(query, model, sortable, default_sort='id',
+             default_direction='asc'):
+    """
+    Return a Page of query seeked from the cursor in the request arguments
+
+    Rows are ordered by the requested sortable column with the primary key
+    as tie-breaker, so each page is a bounded index range scan instead of
+    an OFFSET that reads and throws away every row before it.
+
+    Request arguments: sort, dir (asc/desc), size, after or before cursor.
+    """
+    sort = request.args.get('sort', default_sort)
+    if sort not in sortable:
+        sort = default_sort
+    direction = request.args.get('dir', default_direction)
+    if direction not in ('asc', 'desc'):
+        direction = default_direction
+
+    size = request.args.get('size', current_app.config['PAGE_SIZE'], type=int)
+    size = max(1, min(size, current_app.config['MAX_PAGE_SIZE']))
+
+    # sorting on the bare column lets an index on it serve the ORDER BY
+    column = sortable[sort]
+    pk = model.id
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+    backwards = before is not None and after is None
+    descending = (direction == 'desc') != backwards
+
+    cursor = after if after is not None else before
+    if cursor is not None:
+        values = decode_cursor(cursor)
+        if not isinstance(values, list) or len(values) != 2:
+            abort(400)
+        value, last_id = values
+        # only what encode_cursor writes may reach the seek predicate
+        if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+            abort(400)
+        if isinstance(last_id, bool) or not isinstance(last_id, int):
+            abort(400)
+        if isinstance(column.type, DateTime) and value is not None:
+            try:
+                value = datetime.fromisoformat(value)
+            except (ValueError, TypeError):
+                abort(400)
+        if column is pk:
+            seek = pk < last_id if descending else pk > last_id
+        else:
+            seek = _seek(column, pk, value, last_id, descending)
+        query = query.filter(seek)
+
+    if descending:
+        order = [column.desc()] if column is pk else [column.desc(), pk.desc()]
+    else:
+        order = [column.asc()] if column is pk else [column.asc(), pk.asc()]
+
+    rows = query.order_by(None).order_by(*order).limit(size + 1).all()
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+
+    def row_cursor(row):
+        return encode_cursor([getattr(row, column.key), row.id])
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            next_cursor = row_cursor(rows[-1])
+            if has_more:
+                prev_cursor = row_cursor(rows[0])
+        else:
+            if has_more:
+                next_cursor = row_cursor(rows[-1])
+            if after is not None:
+                prev_cursor = row_cursor(rows[0])
+
+    return Page(rows, sort, direction, size, next_cursor, prev_cursor)
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import Counter, deque
+
+from flask import g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Per request it counts the SQL statements and their time, the ORM rows
+# loaded and the template render time, returns them in response headers and
+# keeps the last PROFILER_WINDOW requests of every endpoint in memory for
+# /admin/profiler. The same statement run PROFILER_NPLUSONE or more times in
+# one request is flagged as a likely N+1, e.g. {{ consumable.supplier.name }}
+# in a loop loading one supplier per row. The numbers are per process.
+
+_lock = threading.Lock()
+# endpoint -> deque of request profiles
+_requests = {}
+
+
+def _profile():
+    if has_request_context():
+        return g.get('_profile')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _profile() is not None:
+        conn.info.setdefault('profiler_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _profile()
+    if profile is None or not conn.info.get('profiler_start'):
+        return
+    profile['db_time'] += time.perf_counter() - conn.info['profiler_start'].pop()
+    profile['queries'] += 1
+    profile['statements'][statement] += 1
+
+
+def _loaded(target, context):
+    profile = _profile()
+    if profile is not None:
+        profile['rows'] += 1
+
+
+class TimedTemplate(Template):
+    """
+    Template adding its render time to the request profile; included and
+    extended templates are part of the render of the one they belong to
+    """
+
+    def render(self, *args, **kwargs):
+        profile = _profile()
+        if profile is None:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            profile['template_time'] += time.perf_counter() - start
+
+
+def _start():
+    g._profile = {
+        'start': time.perf_counter(),
+        'queries': 0,
+        'db_time': 0.0,
+        'rows': 0,
+        'template_time': 0.0,
+        'statements': Counter(),
+    }
+
+
+def _finish(app, response):
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return response
+
+    endpoint = request.endpoint or '<no endpoint>'
+    total = time.perf_counter() - profile['start']
+    repeated = [(statement, count) for statement, count
+                in profile['statements'].most_common()
+                if count >= app.config['PROFILER_NPLUSONE']]
+    for statement, count in repeated:
+        app.logger.warning('Possible N+1 on %s: %d x %s', endpoint, count,
+                           ' '.join(statement.split()))
+
+    response.headers['X-SQL-Queries'] = str(profile['queries'])
+    response.headers['X-SQL-Time-Ms'] = '%.1f' % (1000 * profile['db_time'])
+    response.headers['X-Rows-Loaded'] = str(profile['rows'])
+    response.headers['X-Template-Time-Ms'] = '%.1f' % (1000 * profile['template_time'])
+    response.headers['X-Request-Time-Ms'] = '%.1f' % (1000 * total)
+    response.headers['X-N-Plus-One'] = str(len(repeated))
+    response.headers['Server-Timing'] = 'db;dur=%.1f, tpl;dur=%.1f, total;dur=%.1f' % (
+        1000 * profile['db_time'], 1000 * profile['template_time'], 1000 * total)
+
+    record = {
+        'time': total,
+        'queries': profile['queries'],
+        'db_time': profile['db_time'],
+        'rows': profile['rows'],
+        'template_time': profile['template_time'],
+        'repeated': repeated,
+    }
+    with _lock:
+        if endpoint not in _requests:
+            _requests[endpoint] = deque(maxlen=app.config['PROFILER_WINDOW'])
+        _requests[endpoint].append(record)
+    return response
+
+
+def summary():
+    """
+    Aggregate of the recorded requests of every endpoint, slowest first
+    """
+    with _lock:
+        recorded = dict((endpoint, list(records))
+                        for endpoint, records in _requests.items())
+
+    rows = []
+    for endpoint, records in recorded.items():
+        n = len(records)
+        repeated = Counter()
+        for record in records:
+            for statement, count in record['repeated']:
+                repeated[statement] = max(repeated[statement], count)
+        rows.append({
+            'endpoint': endpoint,
+            'requests': n,
+            'avg_ms': 1000 * sum(r['time'] for r in records) / n,
+            'max_ms': 1000 * max(r['time'] for r in records),
+            'avg_queries': float(sum(r['queries'] for r in records)) / n,
+            'max_queries': max(r['queries'] for r in records),
+            'avg_db_ms': 1000 * sum(r['db_time'] for r in records) / n,
+            'avg_rows': float(sum(r['rows'] for r in records)) / n,
+            'avg_template_ms': 1000 * sum(r['template_time'] for r in records) / n,
+            'nplusone': sum(1 for r in records if r['repeated']),
+            'repeated': repeated.most_common(3),
+        })
+    rows.sort(key=lambda row: row['avg_ms'], reverse=True)
+    return rows
+
+
+def reset():
+    with _lock:
+        _requests.clear()
+
+
+def init_app(app, db):
+    """
+    Profile every request of app when PROFILER is on
+    """
+    if not app.config['PROFILER']:
+        return
+
+    if not event.contains(db.Model, 'load', _loaded):
+        event.listen(db.Model, 'load', _loaded, propagate=True)
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(_start)
+    app.after_request(lambda response: _finish(app, response))
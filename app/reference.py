@@ -0,0 +1,66 @@
+import threading
+import time
+
+from flask import current_app
+
+from . import db
+from .models import Condition, Department, Parcel, Role, Supplier, Unit
+
+
+# table -> (model, label column) of the reference data behind the select
+# fields of the forms
+TABLES = {
+    'conditions': (Condition, 'name'),
+    'departments': (Department, 'name'),
+    'parcels': (Parcel, 'name'),
+    'roles': (Role, 'name'),
+    'suppliers': (Supplier, 'name'),
+    'units': (Unit, 'unit_type'),
+}
+
+_lock = threading.Lock()
+_versions = dict((table, 0) for table in TABLES)
+# key -> (version of its table, loaded at, value)
+_cache = {}
+
+
+def _cached(key, table, load):
+    """
+    Value of load(), read from the database again only when table changed
+    since the last read
+
+    Changes are announced by touch() in this process; as the cache is per
+    process, other workers reload after REFERENCE_CACHE_TTL seconds.
+    """
+    with _lock:
+        version = _versions[table]
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == version and \
+            time.monotonic() - cached[1] < current_app.config['REFERENCE_CACHE_TTL']:
+        return cached[2]
+
+    value = load()
+    with _lock:
+        # keep what we read only if no change was announced meanwhile
+        if _versions[table] == version:
+            _cache[key] = (version, time.monotonic(), value)
+    return value
+
+
+def choices(table):
+    """
+    (id, label) pairs of a reference table for a select field
+    """
+    model, label = TABLES[table]
+    column = getattr(model, label)
+    return _cached(('choices', table), table, lambda: [
+        (id, value) for id, value in
+        db.session.query(model.id, column).order_by(column, model.id)])
+
+
+def touch(table):
+    """
+    Announce that a reference table was changed
+    """
+    with _lock:
+        _versions[table] += 1
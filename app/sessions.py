@@ -0,0 +1,203 @@
+import os
+import secrets
+import tempfile
+import time
+
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface
+from flask.json.tag import TaggedJSONSerializer
+from itsdangerous import BadSignature, Signer
+
+
+# Every worker process and every node has to share the same signing keys,
+# otherwise a session cookie or CSRF token made by one worker is rejected by
+# the next. The key comes from SECRET_KEY; keys it replaced are listed in
+# SECRET_KEY_FALLBACKS and are still accepted when verifying, so a rotation
+# does not log everybody out. New signatures always use SECRET_KEY.
+
+
+def signing_keys(app):
+    """
+    Keys for itsdangerous, oldest first: it signs with the last one and
+    verifies with any of them
+    """
+    return list(app.config['SECRET_KEY_FALLBACKS']) + [app.secret_key]
+
+
+class RotatingCookieSessionInterface(SecureCookieSessionInterface):
+    """
+    Flask's signed cookie session, verified with the fallback keys as well
+    """
+
+    def get_signing_serializer(self, app):
+        if not app.secret_key:
+            return None
+        serializer = super(RotatingCookieSessionInterface, self) \
+            .get_signing_serializer(app)
+        serializer.secret_keys = [
+            key.encode() if isinstance(key, str) else key
+            for key in signing_keys(app)]
+        return serializer
+
+
+class FileSession(SecureCookieSession):
+
+    def __init__(self, initial=None, sid=None):
+        super(FileSession, self).__init__(initial)
+        self.sid = sid
+        self.stale_sid = None
+
+    def regenerate(self):
+        """
+        Move the session to a new id; the old one stops working when the
+        response is saved
+        """
+        if self.sid is not None:
+            self.stale_sid = self.sid
+            self.sid = None
+        self.modified = True
+
+
+def regenerate(session):
+    """
+    Give the session a new id, called when the user logs in or out so an id
+    known before cannot be used after (session fixation); the signed cookie
+    session has no id to change
+    """
+    if isinstance(session, FileSession):
+        session.regenerate()
+
+
+class FileSessionInterface(SessionInterface):
+    """
+    Server-side sessions kept in one file per session under SESSION_FILE_DIR
+
+    The cookie only carries the signed session id. Workers of one node share
+    the directory; several nodes need it on a shared volume.
+    """
+
+    serializer = TaggedJSONSerializer()
+    salt = 'cookie-session-id'
+
+    def _signer(self, app):
+        return Signer(signing_keys(app), salt=self.salt)
+
+    def _path(self, app, sid):
+        return os.path.join(app.config['SESSION_FILE_DIR'], sid)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return FileSession()
+        try:
+            sid = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return FileSession()
+
+        path = self._path(app, sid)
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        try:
+            if time.time() - os.path.getmtime(path) > lifetime:
+                os.remove(path)
+                return FileSession()
+            with open(path) as data:
+                return FileSession(self.serializer.loads(data.read()), sid)
+        except (OSError, ValueError):
+            return FileSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.stale_sid:
+            try:
+                os.remove(self._path(app, session.stale_sid))
+            except OSError:
+                pass
+            session.stale_sid = None
+
+        if not session:
+            if session.modified:
+                if session.sid:
+                    try:
+                        os.remove(self._path(app, session.sid))
+                    except OSError:
+                        pass
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not self.should_set_cookie(app, session):
+            return
+
+        directory = app.config['SESSION_FILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        # write a temporary file and rename it, so a concurrent request of
+        # the same user never reads half a session
+        fd, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as data:
+            data.write(self.serializer.dumps(dict(session)))
+        os.replace(temporary, self._path(app, session.sid))
+
+        response.set_cookie(name,
+                            self._signer(app).sign(session.sid).decode(),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def purge_sessions(app):
+    """
+    Delete the session files not used for longer than the session lifetime,
+    returns how many were deleted
+    """
+    directory = app.config['SESSION_FILE_DIR']
+    if not os.path.isdir(directory):
+        return 0
+    oldest = time.time() - app.permanent_session_lifetime.total_seconds()
+    purged = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+                purged += 1
+        except OSError:
+            pass
+    return purged
+
+
+def init_app(app):
+    """
+    Check the secret key and install the session interface of SESSION_TYPE
+    """
+    if not app.secret_key:
+        if not app.debug:
+            raise RuntimeError('SECRET_KEY is not set: put it in instance/config.py '
+                               'or the SECRET_KEY environment variable, the same '
+                               'value for every worker')
+        # the development server is a single process, a throwaway key is
+        # enough there
+        app.secret_key = secrets.token_hex(32)
+        app.logger.warning('SECRET_KEY is not set, sessions will not survive a restart')
+
+    # Flask-WTF signs its CSRF tokens with this key, the list lets tokens
+    # signed before a rotation verify
+    app.config.setdefault('WTF_CSRF_SECRET_KEY', signing_keys(app))
+
+    if app.config['SESSION_TYPE'] == 'filesystem':
+        if not app.config.get('SESSION_FILE_DIR'):
+            app.config['SESSION_FILE_DIR'] = os.path.join(app.instance_path,
+                                                          'sessions')
+        app.session_interface = FileSessionInterface()
+    elif app.config['SESSION_TYPE'] == 'cookie':
+        app.session_interface = RotatingCookieSessionInterface()
+    else:
+        raise RuntimeError('Unknown SESSION_TYPE %r' % app.config['SESSION_TYPE'])
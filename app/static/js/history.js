@@ -0,0 +1,34 @@
+// Load the history tables of the details pages only when their accordion
+// is opened, and keep paging/filtering inside the accordion body.
+document.addEventListener('DOMContentLoaded', function () {
+  document.querySelectorAll('[data-history-url]').forEach(function (container) {
+    function load(url) {
+      fetch(url, { credentials: 'same-origin' })
+        .then(function (response) { return response.text(); })
+        .then(function (html) {
+          container.innerHTML = html;
+          container.dataset.loaded = 'true';
+        });
+    }
+
+    container.closest('.accordion-collapse').addEventListener('show.bs.collapse', function () {
+      if (!container.dataset.loaded) {
+        load(container.dataset.historyUrl);
+      }
+    });
+
+    container.addEventListener('click', function (event) {
+      var link = event.target.closest('a[data-history-page]');
+      if (link) {
+        event.preventDefault();
+        load(link.href);
+      }
+    });
+
+    container.addEventListener('submit', function (event) {
+      event.preventDefault();
+      var form = event.target;
+      load(form.action + '?' + new URLSearchParams(new FormData(form)).toString());
+    });
+  });
+});
@@ -0,0 +1,492 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, case, func, literal, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from . import alerts, changes, db, outbox
+from .models import Condition, Consumable, ConsumableConsumption, ConsumableDelivery, DailyConsumption, Package, PackageBalance, PackageDelivery, PackageReceive, PackageSend, StockMovement, StockSnapshot
+
+
+# Every stock movement goes through this module. Each one appends an
+# immutable StockMovement row, and the counters on Consumable/Package are
+# its materialised running total: they are changed with a single
+# UPDATE ... SET col = col + :n so concurrent submissions cannot lose each
+# other's updates, in the same transaction as the movement and the ledger
+# row that explain them.
+
+COUNTERS = {
+    Consumable: ('quantity',),
+    Package: ('quantity', 'inside', 'outside'),
+}
+
+def _inserted_ids(table, owner, rows, *criteria):
+    """
+    Ids of rows just written to table with one executemany INSERT, in the
+    order of rows, read back with one SELECT of the newest rows of each
+    owner (the column of owner, e.g. the consumable of a ledger row)
+
+    The caller has updated the counters of the owners before the INSERT,
+    in this transaction: every other writer of their rows waits on that
+    row lock until we commit, so the rows it sees that are newer than
+    those of other transactions are ours.
+    """
+    since = min(row['date'] for row in rows) - timedelta(seconds=1)
+    ids = {}
+    for id, owner_id in db.session.execute(
+            select(table.c.id, owner)
+            .where(owner.in_(set(row[owner.name] for row in rows)),
+                   table.c.date >= since, *criteria)
+            .order_by(table.c.id.desc())):
+        ids.setdefault(owner_id, []).append(id)
+    # the newest n ids of an owner with n rows, oldest first
+    wanted = {}
+    for row in rows:
+        wanted[row[owner.name]] = wanted.get(row[owner.name], 0) + 1
+    ids = dict((owner_id, sorted(ids.get(owner_id, [])[:count]))
+               for owner_id, count in wanted.items())
+    return [ids[row[owner.name]].pop(0) for row in rows]
+
+
+def insert_movements(movements, reason):
+    """
+    Append stock movements of one item type, given as dicts of
+    StockMovement columns, and queue their outbox messages; each dict gets
+    the id of its row, which the messages carry so a consumer can tell a
+    redelivery apart
+
+    Many movements go in with one executemany INSERT, their counters
+    having been updated first (see _inserted_ids).
+    """
+    table = StockMovement.__table__
+    if len(movements) == 1:
+        movements[0]['id'] = db.session.execute(table.insert(), movements[0]) \
+            .inserted_primary_key[0]
+    elif movements:
+        db.session.execute(table.insert(), movements)
+        ids = _inserted_ids(table, table.c.item_id, movements,
+                            table.c.item_type == movements[0]['item_type'])
+        for movement, id in zip(movements, ids):
+            movement['id'] = id
+    outbox.add_movements(db.session, reason, movements)
+
+
+def _shift(model, id, reason, **deltas):
+    """
+    Append a movement and add its deltas to the counters of one row, in SQL;
+    reason says what moved the stock (consumption, delivery, ...)
+    """
+    values = dict((getattr(model, name), getattr(model, name) + delta)
+                  for name, delta in deltas.items())
+    model.query.filter(model.id == id).update(values,
+                                              synchronize_session=False)
+    insert_movements([dict(item_type=model.__tablename__, item_id=id,
+                           date=datetime.now(), **deltas)], reason)
+    if model is Consumable:
+        alerts.touch(db.session, id)
+    changes.record(db.session, model.__tablename__, 'update', id)
+
+
+def _shift_many(model, name, deltas, reason):
+    """
+    Add the deltas (item id -> delta) to one counter of every item with a
+    single UPDATE and append one movement per item
+    """
+    column = getattr(model, name)
+    model.query.filter(model.id.in_(list(deltas))).update(
+        {column: column + case(deltas, value=model.id, else_=0)},
+        synchronize_session=False)
+    date = datetime.now()
+    movements = []
+    for id, delta in deltas.items():
+        movement = dict(item_type=model.__tablename__, item_id=id,
+                        quantity=0, inside=0, outside=0, date=date)
+        movement[name] = delta
+        movements.append(movement)
+    insert_movements(movements, reason)
+    if model is Consumable:
+        alerts.touch(db.session, *deltas)
+    changes.record(db.session, model.__tablename__, 'update', *deltas)
+
+
+def _insert_ledger(model, owner, rows):
+    """
+    Insert ledger rows of model with one executemany INSERT and announce
+    them to the change feed; the counters of their owners have been
+    updated first (see _inserted_ids)
+    """
+    table = model.__table__
+    db.session.execute(table.insert(), rows)
+    changes.record(db.session, model.__tablename__, 'insert',
+                   *_inserted_ids(table, table.c[owner.name], rows))
+
+
+def _accumulate(model, key, fixed, **deltas):
+    """
+    Add deltas to the row of model whose primary key is key, and set the
+    fixed values, in SQL; the row is created on the first call
+    """
+    row = model.query.filter_by(**key)
+    values = dict((getattr(model, name), getattr(model, name) + delta)
+                  for name, delta in deltas.items())
+    values.update((getattr(model, name), value) for name, value in fixed.items())
+    if row.update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**dict(key, **dict(fixed, **deltas))))
+    except IntegrityError:
+        # a concurrent submission created it in the meantime
+        row.update(values, synchronize_session=False)
+
+
+def _settle(package_id, supplier_id, **deltas):
+    """
+    Add deltas to the packages moved between us and one supplier,
+    creating their balance row on the first movement
+    """
+    if supplier_id is None:
+        return
+    deltas['outstanding'] = deltas.get('sent', 0) - deltas.get('received', 0)
+    _accumulate(PackageBalance,
+                dict(package_id=package_id, supplier_id=supplier_id),
+                dict(updated=datetime.now()), **deltas)
+
+
+def _count_consumption(user_id, date, quantity, lines):
+    """
+    Add to the consumption of one employee on the day of date, which the
+    dashboard reads instead of the ledger
+    """
+    if user_id is None:
+        return
+    _accumulate(DailyConsumption, dict(day=date.date(), employee_id=user_id),
+                {}, quantity=quantity, lines=lines)
+
+
+def adjust(model, id, loaded=None, **values):
+    """
+    Set counters of one row to values (manual correction or opening stock),
+    recording the difference as a movement
+
+    loaded are the counters an edit form was rendered with: then only what
+    the user changed from them is applied, as a difference, and movements
+    committed while the form was open are kept.
+    """
+    if loaded is not None:
+        deltas = dict((name, (values[name] or 0) - (loaded.get(name) or 0))
+                      for name in values)
+    else:
+        row = db.session.query(*[getattr(model, name) for name in values]) \
+            .filter(model.id == id).with_for_update().one()
+        deltas = dict((name, (values[name] or 0) - (current or 0))
+                      for name, current in zip(values, row))
+    if any(deltas.values()):
+        _shift(model, id, 'adjustment', **deltas)
+    if model is Consumable:
+        # its min_stock may have been changed along with the counters
+        alerts.touch(db.session, id)
+    db.session.commit()
+
+
+def consume(consumable_id, quantity, user_id):
+    """
+    Record consumption of a consumable and take it off stock
+    """
+    date = datetime.now()
+    db.session.add(ConsumableConsumption(consumab_id=consumable_id,
+                                         user_consumption_id=user_id,
+                                         quantity=quantity,
+                                         date=date))
+    _shift(Consumable, consumable_id, 'consumption', quantity=-quantity)
+    _count_consumption(user_id, date, quantity, 1)
+    db.session.commit()
+
+
+def deliver_consumable(consumable_id, quantity, user_id, supplier_id):
+    """
+    Record delivery of a consumable and put it on stock
+    """
+    db.session.add(ConsumableDelivery(consumable_id=consumable_id,
+                                      user_delivery_id=user_id,
+                                      supplier_consumable_delivery_id=supplier_id,
+                                      quantity=quantity,
+                                      date=datetime.now()))
+    _shift(Consumable, consumable_id, 'delivery', quantity=quantity)
+    db.session.commit()
+
+
+def consume_many(lines, user_id):
+    """
+    Record many consumptions at once, lines are (consumable id, quantity)
+
+    All ledger rows go in with one executemany INSERT and the counters
+    with one UPDATE, in a single transaction.
+    """
+    deltas = {}
+    for consumable_id, quantity in lines:
+        deltas[consumable_id] = deltas.get(consumable_id, 0) - quantity
+    _shift_many(Consumable, 'quantity', deltas, 'consumption')
+    date = datetime.now()
+    _insert_ledger(ConsumableConsumption, ConsumableConsumption.consumab_id, [
+        dict(consumab_id=consumable_id, user_consumption_id=user_id,
+             quantity=quantity, date=date)
+        for consumable_id, quantity in lines])
+    _count_consumption(user_id, date, sum(quantity for consumable_id, quantity
+                                          in lines), len(lines))
+    db.session.commit()
+
+
+def deliver_consumables(lines, user_id):
+    """
+    Record many consumable deliveries at once, lines are
+    (consumable id, quantity, supplier id)
+    """
+    deltas = {}
+    for consumable_id, quantity, supplier_id in lines:
+        deltas[consumable_id] = deltas.get(consumable_id, 0) + quantity
+    _shift_many(Consumable, 'quantity', deltas, 'delivery')
+    date = datetime.now()
+    _insert_ledger(ConsumableDelivery, ConsumableDelivery.consumable_id, [
+        dict(consumable_id=consumable_id, user_delivery_id=user_id,
+             supplier_consumable_delivery_id=supplier_id,
+             quantity=quantity, date=date)
+        for consumable_id, quantity, supplier_id in lines])
+    db.session.commit()
+
+
+def deliver_package(package_id, quantity, user_id, supplier_id, description):
+    """
+    Record delivery of new packages, they are counted as inside
+    """
+    db.session.add(PackageDelivery(package_id=package_id,
+                                   quantity=quantity,
+                                   description=description,
+                                   supplier_id=supplier_id,
+                                   user_id=user_id,
+                                   date=datetime.now()))
+    _shift(Package, package_id, 'delivery', quantity=quantity, inside=quantity)
+    _settle(package_id, supplier_id, delivered=quantity)
+    db.session.commit()
+
+
+def send_package(package_id, quantity, user_id, supplier_id, description):
+    """
+    Record packages sent out to a supplier
+    """
+    db.session.add(PackageSend(package_id=package_id,
+                               quantity=quantity,
+                               description=description,
+                               supplier_id=supplier_id,
+                               user_id=user_id,
+                               date=datetime.now()))
+    _shift(Package, package_id, 'send', inside=-quantity, outside=quantity)
+    _settle(package_id, supplier_id, sent=quantity)
+    db.session.commit()
+
+
+def receive_package(package_id, quantity, user_id, supplier_id, condition_id,
+                    description):
+    """
+    Record packages coming back from a supplier
+
+    Packages in a condition that returns to stock go back inside, any other
+    condition writes them off the total quantity.
+    """
+    db.session.add(PackageReceive(package_id=package_id,
+                                  condition=condition_id,
+                                  quantity=quantity,
+                                  description=description,
+                                  supplier_id=supplier_id,
+                                  user_id=user_id,
+                                  date=datetime.now()))
+
+    # read from the database, not the per-process cache of the select
+    # fields: a write-off cannot wait for another worker's edit to show
+    returns_to_stock = db.session.query(Condition.returns_to_stock) \
+        .filter(Condition.id == condition_id).scalar()
+    if returns_to_stock:
+        _shift(Package, package_id, 'receive', inside=quantity,
+               outside=-quantity)
+        _settle(package_id, supplier_id, received=quantity)
+    else:
+        _shift(Package, package_id, 'write_off', quantity=-quantity,
+               outside=-quantity)
+        _settle(package_id, supplier_id, received=quantity,
+                written_off=quantity)
+    db.session.commit()
+
+
+def take_snapshot():
+    """
+    Write a snapshot of every item that moved since its last snapshot
+
+    The new balance is its previous snapshot plus the movements after the
+    newest snapshot, so the work is bounded by the movements since the last
+    run and the items they moved. Only the
+    movements up to the last one older than SNAPSHOT_SETTLE_SECONDS are
+    taken in, so that a transaction which got a lower id but has not
+    committed yet is not skipped for good. Returns the items whose counters
+    disagree with the ledger, as (item_type, item_id, counters, ledger
+    balance) tuples.
+    """
+    settled = datetime.now() - timedelta(
+        seconds=current_app.config['SNAPSHOT_SETTLE_SECONDS'])
+    last = db.session.query(StockMovement.id, StockMovement.date) \
+        .filter(StockMovement.date < settled) \
+        .order_by(StockMovement.id.desc()).first()
+    if last is None:
+        return []
+
+    # every run snapshots all the items that moved up to its last
+    # movement, so the movements after the newest snapshot are the tail
+    watermark = db.session.query(func.max(StockSnapshot.movement_id)).scalar() or 0
+    if last.id <= watermark:
+        return []
+    tails = db.session.query(StockMovement.item_type, StockMovement.item_id,
+                             func.sum(StockMovement.quantity),
+                             func.sum(StockMovement.inside),
+                             func.sum(StockMovement.outside)) \
+        .filter(StockMovement.id > watermark, StockMovement.id <= last.id) \
+        .group_by(StockMovement.item_type, StockMovement.item_id).all()
+
+    # the previous snapshot of only the items in the tail
+    previous = {}
+    moved = {}
+    for item_type, item_id, quantity, inside, outside in tails:
+        moved.setdefault(item_type, []).append(item_id)
+    for item_type, ids in moved.items():
+        latest = db.session.query(StockSnapshot.item_id,
+                                  func.max(StockSnapshot.movement_id).label('movement_id')) \
+            .filter(StockSnapshot.item_type == item_type,
+                    StockSnapshot.item_id.in_(ids)) \
+            .group_by(StockSnapshot.item_id).subquery()
+        previous.update(((item_type, snapshot.item_id), snapshot)
+                        for snapshot in StockSnapshot.query.join(latest, and_(
+                            StockSnapshot.item_type == item_type,
+                            StockSnapshot.item_id == latest.c.item_id,
+                            StockSnapshot.movement_id == latest.c.movement_id)))
+
+    balances = {}
+    for item_type, item_id, quantity, inside, outside in tails:
+        snapshot = previous.get((item_type, item_id))
+        if snapshot is not None:
+            quantity += snapshot.quantity
+            inside += snapshot.inside
+            outside += snapshot.outside
+        balances[(item_type, item_id)] = dict(quantity=quantity,
+                                              inside=inside, outside=outside)
+    db.session.execute(StockSnapshot.__table__.insert(), [
+        dict(item_type=item_type, item_id=item_id, movement_id=last.id,
+             date=last.date, **balance)
+        for (item_type, item_id), balance in balances.items()])
+    db.session.commit()
+
+    drift = []
+    for model, names in COUNTERS.items():
+        ids = [item_id for item_type, item_id in balances
+               if item_type == model.__tablename__]
+        if not ids:
+            continue
+        # the counters also hold the movements too recent for the snapshot
+        recent = dict((row[0], row[1:]) for row in db.session.query(
+            StockMovement.item_id, func.sum(StockMovement.quantity),
+            func.sum(StockMovement.inside), func.sum(StockMovement.outside))
+            .filter(StockMovement.item_type == model.__tablename__,
+                    StockMovement.item_id.in_(ids),
+                    StockMovement.id > last.id)
+            .group_by(StockMovement.item_id))
+        rows = db.session.query(model.id, *[getattr(model, name) for name in names]) \
+            .filter(model.id.in_(ids))
+        for row in rows:
+            counters = dict(zip(names, [value or 0 for value in row[1:]]))
+            ledger = dict(balances[(model.__tablename__, row[0])])
+            for name, value in zip(('quantity', 'inside', 'outside'),
+                                   recent.get(row[0], (0, 0, 0))):
+                ledger[name] += value or 0
+            if any(counters[name] != ledger[name] for name in names):
+                drift.append((model.__tablename__, row[0], counters, ledger))
+    return drift
+
+
+def balance_at(model, id, when):
+    """
+    Balance of one item at the moment when, from the nearest snapshot
+    before it plus the movements in between
+    """
+    item_type = model.__tablename__
+    snapshot = StockSnapshot.query.filter(StockSnapshot.item_type == item_type,
+                                          StockSnapshot.item_id == id,
+                                          StockSnapshot.date <= when) \
+        .order_by(StockSnapshot.movement_id.desc()).first()
+    start = snapshot.movement_id if snapshot is not None else 0
+
+    tail = db.session.query(func.sum(StockMovement.quantity),
+                            func.sum(StockMovement.inside),
+                            func.sum(StockMovement.outside)) \
+        .filter(StockMovement.item_type == item_type,
+                StockMovement.item_id == id,
+                StockMovement.id > start,
+                StockMovement.date <= when).one()
+
+    balance = dict(quantity=tail[0] or 0, inside=tail[1] or 0,
+                   outside=tail[2] or 0)
+    if snapshot is not None:
+        balance['quantity'] += snapshot.quantity
+        balance['inside'] += snapshot.inside
+        balance['outside'] += snapshot.outside
+    return balance
+
+
+def package_balances(supplier_id=None):
+    """
+    Balances of the packages a supplier still has to return, the largest
+    first, from the balance table and never the ledger
+    """
+    query = PackageBalance.query.options(
+        joinedload(PackageBalance.package).joinedload(Package.parcel),
+        joinedload(PackageBalance.supplier)) \
+        .filter(PackageBalance.outstanding != 0)
+    if supplier_id is not None:
+        query = query.filter(PackageBalance.supplier_id == supplier_id)
+    return query.order_by(PackageBalance.supplier_id,
+                          PackageBalance.outstanding.desc()).all()
+
+
+def rebuild_package_balances():
+    """
+    Recompute every package balance from the whole ledger, for a database
+    filled without going through this module
+    """
+    zero = literal(0)
+    written_off = case((Condition.returns_to_stock, 0),
+                       else_=func.coalesce(PackageReceive.quantity, 0))
+    movements = union_all(
+        select(PackageDelivery.package_id, PackageDelivery.supplier_id,
+               func.coalesce(PackageDelivery.quantity, 0).label('delivered'),
+               zero.label('sent'), zero.label('received'),
+               zero.label('written_off')),
+        select(PackageSend.package_id, PackageSend.supplier_id, zero,
+               func.coalesce(PackageSend.quantity, 0), zero, zero),
+        select(PackageReceive.package_id, PackageReceive.supplier_id, zero,
+               zero, func.coalesce(PackageReceive.quantity, 0), written_off)
+        .outerjoin(Condition, PackageReceive.condition == Condition.id)
+    ).subquery()
+    totals = select(movements.c.package_id, movements.c.supplier_id,
+                    func.sum(movements.c.delivered),
+                    func.sum(movements.c.sent),
+                    func.sum(movements.c.received),
+                    func.sum(movements.c.written_off),
+                    func.sum(movements.c.sent) - func.sum(movements.c.received),
+                    literal(datetime.now())) \
+        .where(movements.c.package_id.isnot(None),
+               movements.c.supplier_id.isnot(None)) \
+        .group_by(movements.c.package_id, movements.c.supplier_id)
+
+    table = PackageBalance.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['package_id', 'supplier_id', 'delivered', 'sent', 'received',
+         'written_off', 'outstanding', 'updated'], totals))
+    db.session.commit()
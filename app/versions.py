@@ -0,0 +1,94 @@
+import hashlib
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import Pool
+from sqlalchemy.sql.dml import UpdateBase
+
+from . import db
+from .models import TableVersion
+
+
+# Per-table change counters. The first INSERT, UPDATE or DELETE on a
+# counted table in a transaction adds one to its row of table_versions on
+# the same connection, so the counter commits or rolls back with the change
+# itself and is the same for every worker. Readers compare counters instead
+# of data: a response built from tables whose counters did not move is
+# still current, which is what the ETags of the API are made of. Only the
+# tables a reader registered with count() are counted, as the counter row
+# is locked by every writer of its table until it commits. Statements given
+# as raw SQL text are not seen.
+
+_table = TableVersion.__table__
+_BUMPED = 'versions_bumped'
+_COUNTED = set()
+
+
+def count(*tables):
+    """
+    Keep the counters of tables, for readers that compare them
+    """
+    _COUNTED.update(tables)
+
+
+@event.listens_for(Engine, 'after_execute')
+def _changed(conn, clauseelement, multiparams, params, execution_options, result):
+    if not isinstance(clauseelement, UpdateBase):
+        return
+    name = getattr(getattr(clauseelement, 'table', None), 'name', None)
+    if name not in _COUNTED:
+        return
+    bumped = conn.info.setdefault(_BUMPED, set())
+    if name in bumped:
+        return
+    bumped.add(name)
+
+    bump = _table.update().where(_table.c.name == name) \
+        .values(version=_table.c.version + 1)
+    if conn.execute(bump).rowcount:
+        return
+    try:
+        with conn.begin_nested():
+            conn.execute(_table.insert().values(name=name, version=1))
+    except IntegrityError:
+        # a concurrent transaction counted the table first
+        conn.execute(bump)
+
+
+@event.listens_for(Engine, 'commit')
+@event.listens_for(Engine, 'rollback')
+def _reset(conn):
+    conn.info.pop(_BUMPED, None)
+
+
+@event.listens_for(Engine, 'rollback_savepoint')
+def _reset_savepoint(conn, name, context):
+    # the bump may have been undone with the savepoint, count again
+    conn.info.pop(_BUMPED, None)
+
+
+@event.listens_for(Pool, 'checkin')
+def _checkin(dbapi_connection, connection_record):
+    if connection_record is not None:
+        connection_record.info.pop(_BUMPED, None)
+
+
+def versions(*tables):
+    """
+    {table: counter} of tables, 0 for a table never changed or not
+    counted
+    """
+    found = dict(db.session.query(TableVersion.name, TableVersion.version)
+                 .filter(TableVersion.name.in_(tables)))
+    return dict((table, found.get(table, 0)) for table in tables)
+
+
+def etag(tables, *parts):
+    """
+    Entity tag of a response built from tables and varying with parts
+    (endpoint, arguments), which changes when any of the tables does
+    """
+    current = versions(*tables)
+    text = repr((parts, sorted(current.items())))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:24]
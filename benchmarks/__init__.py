@@ -0,0 +1,30 @@
+"""
+Benchmarks of the hot endpoints against a synthetic inventory
+
+    python -m benchmarks.datagen --database sqlite:///bench.db --ledger 1000000
+    python -m benchmarks.run --database sqlite:///bench.db --requests 200
+"""
+import os
+
+
+def create_bench_app(database):
+    """
+    The app as configured by FLASK_CONFIG and instance/config.py, pointed at
+    the benchmark database, with request profiling on and CSRF off
+    """
+    # read by config.py when it is imported
+    os.environ.setdefault('PROFILER', '1')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+    from app import create_app
+
+    app = create_app(os.environ.get('FLASK_CONFIG', 'production'))
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['WTF_CSRF_ENABLED'] = False
+    if database.startswith('sqlite'):
+        # connect_timeout is an option of the MySQL driver only
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        options.pop('connect_args', None)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    return app
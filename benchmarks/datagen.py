@@ -0,0 +1,223 @@
+"""
+Seed a database with a synthetic inventory shaped like app/models.py
+
+Every ledger row gets its stock movement and the counters of consumables
+and packages are the running total of their movements, as the stock
+service would have left them, so `flask stock snapshot` finds no drift.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam
+from werkzeug.security import generate_password_hash
+
+from . import create_bench_app
+
+
+ADMIN_EMAIL = 'bench-admin@example.com'
+PASSWORD = 'bench'
+
+CHUNK = 10000
+
+
+class Writer(object):
+    """
+    Buffers rows per table and inserts them in chunks with executemany
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.rows = {}
+        self.written = 0
+
+    def add(self, model, **row):
+        rows = self.rows.setdefault(model, [])
+        rows.append(row)
+        if len(rows) >= CHUNK:
+            self.flush(model)
+
+    def flush(self, model=None):
+        for table in ([model] if model is not None else list(self.rows)):
+            rows = self.rows.pop(table, [])
+            if rows:
+                self.db.session.execute(table.__table__.insert(), rows)
+                self.written += len(rows)
+
+
+def generate(db, employees=50, suppliers=40, consumables=2000, packages=500,
+             ledger=100000, days=730, seed=1):
+    """
+    Insert the inventory, ledger rows spread evenly over the last days
+    """
+    from app.models import (Condition, Consumable, ConsumableConsumption,
+                            ConsumableDelivery, Department, Direction,
+                            Employee, Package, PackageDelivery,
+                            PackageReceive, PackageSend, Parcel, Role,
+                            StockMovement, Supplier, Unit)
+
+    rnd = random.Random(seed)
+    writer = Writer(db)
+    password_hash = generate_password_hash(PASSWORD)
+
+    for i in range(1, 6):
+        writer.add(Department, id=i, name='Department %d' % i,
+                   description='Benchmark department')
+        writer.add(Role, id=i, name='Role %d' % i,
+                   description='Benchmark role')
+    writer.add(Employee, id=1, email=ADMIN_EMAIL, username='bench-admin',
+               first_name='Bench', last_name='Admin',
+               password_hash=password_hash, department_id=1, role_id=1,
+               is_admin=True, is_confirmed=True, is_granted=True)
+    for i in range(2, employees + 1):
+        writer.add(Employee, id=i, email='employee%d@example.com' % i,
+                   username='employee%d' % i, first_name='First%d' % i,
+                   last_name='Last%d' % i, password_hash=password_hash,
+                   department_id=rnd.randint(1, 5), role_id=rnd.randint(1, 5),
+                   is_admin=False, is_confirmed=True, is_granted=True)
+    for i in range(1, suppliers + 1):
+        writer.add(Supplier, id=i, name='Supplier %d' % i)
+    for i, unit in enumerate(('pcs', 'kg', 'l', 'm', 'box'), 1):
+        writer.add(Unit, id=i, unit_type=unit)
+    for i in range(1, 6):
+        writer.add(Parcel, id=i, name='Parcel %d' % i, weight=10 * i,
+                   dimension='%dx%d' % (i, i), type='pallet')
+    writer.add(Condition, id=1, name='OK', returns_to_stock=True)
+    writer.add(Condition, id=2, name='Damaged', returns_to_stock=False)
+    writer.add(Direction, id=1, name='Inbound')
+    writer.add(Direction, id=2, name='Outbound')
+
+    consumable_supplier = [0] + [rnd.randint(1, suppliers)
+                                 for _ in range(consumables)]
+    # counters start at zero and are set from the generated movements at
+    # the end, the items have to exist before the ledger rows for MySQL
+    for id in range(1, consumables + 1):
+        writer.add(Consumable, id=id, name='Consumable %d' % id,
+                   quantity=0, min_stock=rnd.randint(0, 50),
+                   description='Benchmark consumable %d' % id,
+                   unit_id=rnd.randint(1, 5),
+                   supplier_id=consumable_supplier[id],
+                   user_id=rnd.randint(1, employees))
+    for id in range(1, packages + 1):
+        writer.add(Package, id=id, parcel_id=rnd.randint(1, 5), quantity=0,
+                   inside=0, outside=0,
+                   description='Benchmark package %d' % id)
+    writer.flush()
+
+    consumable_stock = [0] * (consumables + 1)
+    package_stock = [[0, 0, 0] for _ in range(packages + 1)]
+
+    start = datetime.now() - timedelta(days=days)
+    step = timedelta(days=days) / max(ledger, 1)
+    for n in range(ledger):
+        date = start + step * n
+        user_id = rnd.randint(1, employees)
+        if rnd.random() < 0.6:
+            id = rnd.randint(1, consumables)
+            quantity = rnd.randint(1, 20)
+            if consumable_stock[id] >= quantity and rnd.random() < 0.7:
+                writer.add(ConsumableConsumption, consumab_id=id,
+                           user_consumption_id=user_id, quantity=quantity,
+                           date=date)
+                quantity = -quantity
+            else:
+                writer.add(ConsumableDelivery, consumable_id=id,
+                           user_delivery_id=user_id,
+                           supplier_consumable_delivery_id=consumable_supplier[id],
+                           quantity=quantity * 5, date=date)
+                quantity = quantity * 5
+            consumable_stock[id] += quantity
+            writer.add(StockMovement, item_type='consumables', item_id=id,
+                       quantity=quantity, inside=0, outside=0, date=date)
+            continue
+
+        id = rnd.randint(1, packages)
+        stock = package_stock[id]
+        supplier_id = rnd.randint(1, suppliers)
+        quantity = rnd.randint(1, 10)
+        roll = rnd.random()
+        if stock[2] >= quantity and roll < 0.4:
+            condition = 1 if rnd.random() < 0.9 else 2
+            writer.add(PackageReceive, package_id=id, condition=condition,
+                       quantity=quantity, description='Benchmark receive',
+                       supplier_id=supplier_id, user_id=user_id, date=date)
+            if condition == 1:
+                deltas = (0, quantity, -quantity)
+            else:
+                deltas = (-quantity, 0, -quantity)
+        elif stock[1] >= quantity and roll < 0.8:
+            writer.add(PackageSend, package_id=id, quantity=quantity,
+                       description='Benchmark send', supplier_id=supplier_id,
+                       user_id=user_id, date=date)
+            deltas = (0, -quantity, quantity)
+        else:
+            quantity *= 5
+            writer.add(PackageDelivery, package_id=id, quantity=quantity,
+                       description='Benchmark delivery',
+                       supplier_id=supplier_id, user_id=user_id, date=date)
+            deltas = (quantity, quantity, 0)
+        for i, delta in enumerate(deltas):
+            stock[i] += delta
+        writer.add(StockMovement, item_type='packages', item_id=id,
+                   quantity=deltas[0], inside=deltas[1], outside=deltas[2],
+                   date=date)
+
+    writer.flush()
+
+    consumables_table = Consumable.__table__
+    db.session.execute(consumables_table.update()
+                       .where(consumables_table.c.id == bindparam('b_id'))
+                       .values(quantity=bindparam('b_quantity')),
+                       [dict(b_id=id, b_quantity=consumable_stock[id])
+                        for id in range(1, consumables + 1)])
+    packages_table = Package.__table__
+    db.session.execute(packages_table.update()
+                       .where(packages_table.c.id == bindparam('b_id'))
+                       .values(quantity=bindparam('b_quantity'),
+                               inside=bindparam('b_inside'),
+                               outside=bindparam('b_outside')),
+                       [dict(b_id=id, b_quantity=package_stock[id][0],
+                             b_inside=package_stock[id][1],
+                             b_outside=package_stock[id][2])
+                        for id in range(1, packages + 1)])
+    db.session.commit()
+
+    from app import alerts, kpis, stock
+    alerts.rebuild()
+    stock.rebuild_package_balances()
+    kpis.rebuild()
+    return writer.written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', required=True,
+                        help='SQLAlchemy URL of an empty database')
+    parser.add_argument('--employees', type=int, default=50)
+    parser.add_argument('--suppliers', type=int, default=40)
+    parser.add_argument('--consumables', type=int, default=2000)
+    parser.add_argument('--packages', type=int, default=500)
+    parser.add_argument('--ledger', type=int, default=100000,
+                        help='ledger rows over all consumables and packages')
+    parser.add_argument('--days', type=int, default=730,
+                        help='the ledger spans this many days up to now')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    from app import db
+
+    app = create_bench_app(args.database)
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        written = generate(db, args.employees, args.suppliers,
+                           args.consumables, args.packages, args.ledger,
+                           args.days, args.seed)
+    print('{} rows written in {:.1f}s, log in as {} / {}'.format(
+        written, time.perf_counter() - started, ADMIN_EMAIL, PASSWORD))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Drive the hot endpoints through the Flask test client and report latency
+percentiles, SQL statements and memory per request
+
+Run it against a database seeded by benchmarks.datagen. With --save the
+results are written as JSON; with --baseline a previous file is compared
+and the exit status is 1 when an endpoint got slower than --tolerance or
+runs more SQL statements than before.
+"""
+import argparse
+import json
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+from . import create_bench_app
+from .datagen import ADMIN_EMAIL, PASSWORD
+
+
+def _scenarios(rnd, consumables, packages, suppliers):
+    """
+    name -> function returning (method, url, form data) of the next request
+    """
+    return [
+        ('list_consumables', lambda: ('GET', '/admin/consumables', None)),
+        ('details_consumable', lambda: (
+            'GET', '/admin/consumable/details/%d' % rnd.randint(1, consumables),
+            None)),
+        ('consumption_consumables', lambda: (
+            'POST', '/admin/consumables/consumption/%d' % rnd.randint(1, consumables),
+            {'quantity': '1'})),
+        ('receive_packages', lambda: (
+            'POST', '/admin/packages/receive/%d' % rnd.randint(1, packages),
+            {'quantity': '1', 'supplier': str(rnd.randint(1, suppliers)),
+             'condition': '1', 'description': 'Benchmark receive'})),
+        ('list_packages', lambda: ('GET', '/admin/packages', None)),
+    ]
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def _request(client, method, url, data):
+    if method == 'POST':
+        response = client.post(url, data=data)
+    else:
+        response = client.get(url)
+    if response.status_code >= 400:
+        raise RuntimeError('{} {} answered {}'.format(method, url,
+                                                      response.status_code))
+    return response
+
+
+def run(app, requests=100, warmup=5, seed=1):
+    """
+    Results of every scenario, as a dict per scenario name
+    """
+    from app.models import Consumable, Package, Supplier
+
+    with app.app_context():
+        consumables = Consumable.query.count()
+        packages = Package.query.count()
+        suppliers = Supplier.query.count()
+
+    rnd = random.Random(seed)
+    client = app.test_client()
+    response = client.post('/login', data={'email': ADMIN_EMAIL,
+                                           'password': PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError('Cannot log in as {}, was the database seeded by '
+                           'benchmarks.datagen?'.format(ADMIN_EMAIL))
+
+    results = {}
+    for name, next_request in _scenarios(rnd, consumables, packages, suppliers):
+        for _ in range(warmup):
+            _request(client, *next_request())
+
+        latencies = []
+        queries = []
+        for _ in range(requests):
+            method, url, data = next_request()
+            started = time.perf_counter()
+            response = _request(client, method, url, data)
+            latencies.append(1000 * (time.perf_counter() - started))
+            queries.append(int(response.headers.get('X-SQL-Queries', 0)))
+
+        # allocations are traced on one extra request only, tracing slows
+        # everything it measures
+        tracemalloc.start()
+        _request(client, *next_request())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {
+            'requests': requests,
+            'p50_ms': _percentile(latencies, 50),
+            'p90_ms': _percentile(latencies, 90),
+            'p99_ms': _percentile(latencies, 99),
+            'max_ms': max(latencies),
+            'queries': float(sum(queries)) / len(queries),
+            'max_queries': max(queries),
+            'peak_kib': peak / 1024.0,
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions of results against baseline, as readable lines
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p90_ms'] > before['p90_ms'] * (1 + tolerance):
+            regressions.append('{}: p90 {:.1f} ms, was {:.1f} ms'.format(
+                name, result['p90_ms'], before['p90_ms']))
+        if result['max_queries'] > before['max_queries']:
+            regressions.append('{}: {} SQL statements, was {}'.format(
+                name, result['max_queries'], before['max_queries']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', required=True,
+                        help='SQLAlchemy URL of a database seeded by benchmarks.datagen')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier --save')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p90 slowdown against the baseline (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database)
+    results = run(app, args.requests, args.warmup, args.seed)
+
+    print('{:<26}{:>9}{:>9}{:>9}{:>9}{:>9}{:>11}'.format(
+        'endpoint', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'queries',
+        'peak KiB'))
+    for name, result in results.items():
+        print('{:<26}{p50_ms:>9.1f}{p90_ms:>9.1f}{p99_ms:>9.1f}{max_ms:>9.1f}'
+              '{queries:>9.1f}{peak_kib:>11.0f}'.format(name, **result))
+    # ru_maxrss is in KiB on Linux
+    print('max RSS {:.0f} MiB'.format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,104 @@
+import os
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
 class Config(object):
     """
     Common configurations
     """
 
+    # rows per page on the list views, and the most a ?size= may ask for
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+
+    # logged-in employees kept in memory per process, and for how many
+    # seconds a change made through another worker may go unnoticed
+    PRINCIPAL_CACHE_SIZE = 1024
+    PRINCIPAL_CACHE_TTL = 60
+
+    # seconds the select field choices of other workers may lag behind an
+    # admin edit of suppliers, units, parcels, conditions, departments, roles
+    REFERENCE_CACHE_TTL = 300
+
+    # signs sessions and CSRF tokens, the same value on every worker and
+    # node; keys it replaced stay valid for verification only, comma
+    # separated in SECRET_KEY_FALLBACKS, oldest first
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SECRET_KEY_FALLBACKS = [key for key in
+                            os.environ.get('SECRET_KEY_FALLBACKS', '').split(',')
+                            if key]
+
+    # 'cookie' keeps the session in the signed cookie, 'filesystem' keeps it
+    # in SESSION_FILE_DIR (instance/sessions by default) and the cookie only
+    # holds its id
+    SESSION_TYPE = os.environ.get('SESSION_TYPE', 'cookie')
+    SESSION_FILE_DIR = os.environ.get('SESSION_FILE_DIR')
+
+    # per request SQL count and time, rows loaded and template time in
+    # X-* response headers and on /admin/profiler; the last PROFILER_WINDOW
+    # requests of each endpoint are kept, and a statement repeated
+    # PROFILER_NPLUSONE times in one request is flagged as N+1
+    PROFILER = _env_bool('PROFILER', 'false')
+    PROFILER_WINDOW = 200
+    PROFILER_NPLUSONE = 5
+
+    # seconds a stock movement must be old before a snapshot takes it in;
+    # ids are handed out at insert, not commit, so a transaction still open
+    # with a lower id would otherwise be skipped by every later snapshot
+    SNAPSHOT_SETTLE_SECONDS = 600
+
+    # most lines one bulk consumption/delivery submission may record
+    BULK_MAX_LINES = 500
+
+    # where consumables falling to or below min_stock, and recovering, are
+    # reported: 'log', 'file' (JSON lines appended to LOW_STOCK_FILE) or
+    # 'smtp' (mail through a local relay)
+    LOW_STOCK_SINK = os.environ.get('LOW_STOCK_SINK', 'log')
+    LOW_STOCK_FILE = os.environ.get('LOW_STOCK_FILE', 'low_stock.jsonl')
+    LOW_STOCK_SMTP_HOST = os.environ.get('LOW_STOCK_SMTP_HOST', 'localhost')
+    LOW_STOCK_SMTP_PORT = int(os.environ.get('LOW_STOCK_SMTP_PORT', 25))
+    LOW_STOCK_MAIL_FROM = os.environ.get('LOW_STOCK_MAIL_FROM', 'nvp@localhost')
+    LOW_STOCK_MAIL_TO = os.environ.get('LOW_STOCK_MAIL_TO', 'buyers@localhost')
+
+    # demand forecasting (flask stock forecast): the consumption of the last
+    # FORECAST_WINDOW_DAYS gives the demand; reorder points cover the lead
+    # time at FORECAST_SERVICE_LEVEL, FORECAST_LEAD_TIME_DAYS being used when
+    # no delivery history tells it, and reorder quantities FORECAST_COVER_DAYS
+    # of demand; forecasts older than FORECAST_MAX_AGE_HOURS are recomputed
+    FORECAST_WINDOW_DAYS = 182
+    FORECAST_SERVICE_LEVEL = 0.95
+    FORECAST_LEAD_TIME_DAYS = int(os.environ.get('FORECAST_LEAD_TIME_DAYS', 7))
+    FORECAST_COVER_DAYS = int(os.environ.get('FORECAST_COVER_DAYS', 30))
+    FORECAST_MAX_AGE_HOURS = 24
+
+    # rows per page of the JSON API (/api/v1), by default and at most
+    API_PAGE_SIZE = 100
+    API_PAGE_MAX = 1000
+    # most consumables and packages one /api/v1/stock lookup may ask for
+    API_LOOKUP_MAX = 1000
+
+    # days of the change feed (/api/v1/changes) kept by
+    # `flask stock prune-changes`
+    CHANGES_RETENTION_DAYS = 30
+
+    # where `flask outbox publish` sends the stock movements: 'spool' (a
+    # JSON Lines file per batch in OUTBOX_SPOOL_DIR) or 'http' (POST to
+    # OUTBOX_HTTP_URL); a failed batch waits OUTBOX_RETRY_BASE seconds,
+    # doubling per attempt up to OUTBOX_RETRY_MAX
+    OUTBOX_SINK = os.environ.get('OUTBOX_SINK', 'spool')
+    OUTBOX_SPOOL_DIR = os.environ.get('OUTBOX_SPOOL_DIR', 'outbox')
+    OUTBOX_HTTP_URL = os.environ.get('OUTBOX_HTTP_URL', 'http://localhost:8099/events')
+    OUTBOX_BATCH_SIZE = 500
+    OUTBOX_POLL_INTERVAL = 1.0
+    OUTBOX_RETRY_BASE = 5
+    OUTBOX_RETRY_MAX = 600
+
+    # days over which the admin dashboard ranks the top consumers
+    KPI_TOP_CONSUMER_DAYS = 30
+
 class DevelopmentConfig(Config):
     """
     Development configurations
@@ -10,6 +106,7 @@ class DevelopmentConfig(Config):
 
     DEBUG = True
     SQLALCHEMY_ECHO = True
+    PROFILER = True
 
 class ProductionConfig(Config):
     """
@@ -18,7 +115,44 @@ class ProductionConfig(Config):
 
     DEBUG = False
 
+    # connection pool of every worker process: keep DB_POOL_SIZE connections
+    # open, allow DB_MAX_OVERFLOW more under load and fail a request that
+    # waited DB_POOL_TIMEOUT seconds for one. Connections are replaced after
+    # DB_POOL_RECYCLE seconds, below MySQL's wait_timeout, and pinged before
+    # use so one dropped by the server is never handed to a request.
+    # workers x (size + overflow) must stay under max_connections.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 280)),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', 'true'),
+        'connect_args': {
+            'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+        },
+    }
+
+    # count checkouts, waits and timeouts of the pool, shown on /admin/pool
+    DB_POOL_METRICS = _env_bool('DB_POOL_METRICS', 'true')
+
+class TestingConfig(Config):
+    """
+    Testing configurations
+    """
+
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SECRET_KEY = 'testing'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # the query counts of the list pages are checked from its headers
+    PROFILER = True
+
+    # a MySQL database the tests may empty; without it they make a SQLite
+    # file of their own
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL')
+
 app_config = {
     'development': DevelopmentConfig,
-    'production': ProductionConfig
+    'production': ProductionConfig,
+    'testing': TestingConfig
 }
@@ -0,0 +1,42 @@
+"""consumable forecasts
+
+Revision ID: 2f6b81c4d9e7
+Revises: 7a90d3e15c28
+Create Date: 2026-10-17 14:52:08.613904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f6b81c4d9e7'
+down_revision = '7a90d3e15c28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('consumable_forecasts',
+    sa.Column('consumable_id', sa.Integer(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=False),
+    sa.Column('days', sa.Integer(), nullable=False),
+    sa.Column('daily_demand', sa.Float(), nullable=False),
+    sa.Column('daily_deviation', sa.Float(), nullable=False),
+    sa.Column('weekly_demand', sa.Float(), nullable=False),
+    sa.Column('weekly_deviation', sa.Float(), nullable=False),
+    sa.Column('observed_lead_time', sa.Float(), nullable=True),
+    sa.Column('lead_time_samples', sa.Integer(), nullable=False),
+    sa.Column('lead_time', sa.Float(), nullable=False),
+    sa.Column('lead_time_source', sa.String(length=10), nullable=False),
+    sa.Column('reorder_point', sa.Integer(), nullable=False),
+    sa.Column('reorder_quantity', sa.Integer(), nullable=False),
+    sa.Column('consumption_seen', sa.Integer(), nullable=False),
+    sa.Column('delivery_seen', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['consumable_id'], ['consumables.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('consumable_id')
+    )
+
+
+def downgrade():
+    op.drop_table('consumable_forecasts')
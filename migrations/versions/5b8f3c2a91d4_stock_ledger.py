@@ -0,0 +1,59 @@
+"""stock ledger
+
+Revision ID: 5b8f3c2a91d4
+Revises: e3a1c626b100
+Create Date: 2026-10-17 10:12:43.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8f3c2a91d4'
+down_revision = 'e3a1c626b100'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_movements',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('item_type', sa.String(length=20), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('inside', sa.Integer(), nullable=False),
+    sa.Column('outside', sa.Integer(), nullable=False),
+    sa.Column('date', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_movements_item', 'stock_movements', ['item_type', 'item_id', 'id'], unique=False)
+    op.create_table('stock_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('item_type', sa.String(length=20), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('movement_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('inside', sa.Integer(), nullable=False),
+    sa.Column('outside', sa.Integer(), nullable=False),
+    sa.Column('date', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_snapshots_item', 'stock_snapshots', ['item_type', 'item_id', 'movement_id'], unique=False)
+
+    # the current counters become the opening movement of every item
+    op.execute(
+        "INSERT INTO stock_movements (item_type, item_id, quantity, inside, outside, date) "
+        "SELECT 'consumables', id, COALESCE(quantity, 0), 0, 0, CURRENT_TIMESTAMP FROM consumables"
+    )
+    op.execute(
+        "INSERT INTO stock_movements (item_type, item_id, quantity, inside, outside, date) "
+        "SELECT 'packages', id, COALESCE(quantity, 0), COALESCE(inside, 0), COALESCE(outside, 0), CURRENT_TIMESTAMP FROM packages"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_stock_snapshots_item', table_name='stock_snapshots')
+    op.drop_table('stock_snapshots')
+    op.drop_index('ix_stock_movements_item', table_name='stock_movements')
+    op.drop_table('stock_movements')
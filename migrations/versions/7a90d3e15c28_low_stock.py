@@ -0,0 +1,40 @@
+"""low stock
+
+Revision ID: 7a90d3e15c28
+Revises: c41a7e9b2f60
+Create Date: 2026-10-17 13:31:52.447120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a90d3e15c28'
+down_revision = 'c41a7e9b2f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('low_stock',
+    sa.Column('consumable_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('min_stock', sa.Integer(), nullable=False),
+    sa.Column('since', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['consumable_id'], ['consumables.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('consumable_id')
+    )
+    op.create_index('ix_low_stock_since', 'low_stock', ['since'], unique=False)
+
+    # the consumables already short when the table is created
+    op.execute(
+        "INSERT INTO low_stock (consumable_id, quantity, min_stock, since) "
+        "SELECT id, COALESCE(quantity, 0), min_stock, CURRENT_TIMESTAMP FROM consumables "
+        "WHERE min_stock IS NOT NULL AND COALESCE(quantity, 0) <= min_stock"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_low_stock_since', table_name='low_stock')
+    op.drop_table('low_stock')
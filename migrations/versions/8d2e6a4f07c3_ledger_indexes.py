@@ -0,0 +1,45 @@
+"""ledger indexes
+
+Revision ID: 8d2e6a4f07c3
+Revises: 5b8f3c2a91d4
+Create Date: 2026-10-17 11:03:27.640118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e6a4f07c3'
+down_revision = '5b8f3c2a91d4'
+branch_labels = None
+depends_on = None
+
+
+# table -> (owner column, other foreign key columns)
+LEDGERS = {
+    'consum_consumptions': ('consumab_id', ['user_consumption_id']),
+    'consum_delivery': ('consumable_id', ['user_delivery_id', 'supplier_consumable_delivery_id']),
+    'packagesDelivery': ('package_id', ['supplier_id', 'user_id']),
+    'packagesSend': ('package_id', ['supplier_id', 'user_id']),
+    'packagesReceive': ('package_id', ['condition', 'supplier_id', 'user_id']),
+}
+
+
+def upgrade():
+    for table, (owner, foreign_keys) in LEDGERS.items():
+        # the details pages filter by owner and sort by date, which can only
+        # walk the (owner, date) index when date is never NULL
+        op.execute('UPDATE {} SET date = CURRENT_TIMESTAMP WHERE date IS NULL'.format(table))
+        op.alter_column(table, 'date', existing_type=sa.DateTime(), nullable=False)
+        op.create_index('ix_{}_{}_date'.format(table, owner), table, [owner, 'date'], unique=False)
+        for column in foreign_keys:
+            op.create_index('ix_{}_{}'.format(table, column), table, [column], unique=False)
+
+
+def downgrade():
+    for table, (owner, foreign_keys) in LEDGERS.items():
+        for column in foreign_keys:
+            op.drop_index('ix_{}_{}'.format(table, column), table_name=table)
+        op.drop_index('ix_{}_{}_date'.format(table, owner), table_name=table)
+        op.alter_column(table, 'date', existing_type=sa.DateTime(), nullable=True)
@@ -0,0 +1,34 @@
+"""table versions
+
+Revision ID: 9c1d5e7f3a48
+Revises: b3e94d7a16f2
+Create Date: 2026-10-17 16:27:43.905126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c1d5e7f3a48'
+down_revision = 'b3e94d7a16f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table('table_versions',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    # a row per table up front, so no transaction has to insert one
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    op.bulk_insert(table_versions, [
+        {'name': name, 'version': 0} for name in tables
+        if name not in ('alembic_version', 'table_versions')])
+
+
+def downgrade():
+    op.drop_table('table_versions')
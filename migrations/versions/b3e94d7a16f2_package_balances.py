@@ -0,0 +1,55 @@
+"""package balances
+
+Revision ID: b3e94d7a16f2
+Revises: 2f6b81c4d9e7
+Create Date: 2026-10-17 15:40:26.281537
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e94d7a16f2'
+down_revision = '2f6b81c4d9e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('package_balances',
+    sa.Column('package_id', sa.Integer(), nullable=False),
+    sa.Column('supplier_id', sa.Integer(), nullable=False),
+    sa.Column('delivered', sa.Integer(), nullable=False),
+    sa.Column('sent', sa.Integer(), nullable=False),
+    sa.Column('received', sa.Integer(), nullable=False),
+    sa.Column('written_off', sa.Integer(), nullable=False),
+    sa.Column('outstanding', sa.Integer(), nullable=False),
+    sa.Column('updated', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['package_id'], ['packages.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['supplier_id'], ['suppliers.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('package_id', 'supplier_id')
+    )
+    op.create_index('ix_package_balances_supplier_outstanding', 'package_balances', ['supplier_id', 'outstanding'], unique=False)
+
+    # the balances of the ledger so far
+    op.execute(
+        "INSERT INTO package_balances (package_id, supplier_id, delivered, sent, "
+        "received, written_off, outstanding, updated) "
+        "SELECT package_id, supplier_id, SUM(delivered), SUM(sent), SUM(received), "
+        "SUM(written_off), SUM(sent) - SUM(received), CURRENT_TIMESTAMP FROM ("
+        "SELECT package_id, supplier_id, COALESCE(quantity, 0) AS delivered, 0 AS sent, "
+        "0 AS received, 0 AS written_off FROM packagesDelivery "
+        "UNION ALL SELECT package_id, supplier_id, 0, COALESCE(quantity, 0), 0, 0 "
+        "FROM packagesSend "
+        "UNION ALL SELECT r.package_id, r.supplier_id, 0, 0, COALESCE(r.quantity, 0), "
+        "CASE WHEN c.returns_to_stock THEN 0 ELSE COALESCE(r.quantity, 0) END "
+        "FROM packagesReceive r LEFT JOIN conditions c ON c.id = r.`condition`"
+        ") movements WHERE package_id IS NOT NULL AND supplier_id IS NOT NULL "
+        "GROUP BY package_id, supplier_id"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_package_balances_supplier_outstanding', table_name='package_balances')
+    op.drop_table('package_balances')
@@ -0,0 +1,26 @@
+"""condition returns to stock
+
+Revision ID: c41a7e9b2f60
+Revises: 8d2e6a4f07c3
+Create Date: 2026-10-17 11:48:05.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41a7e9b2f60'
+down_revision = '8d2e6a4f07c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('conditions', sa.Column('returns_to_stock', sa.Boolean(), nullable=False, server_default=sa.false()))
+    # until now the receive views hard-coded "OK" as the only such condition
+    op.execute("UPDATE conditions SET returns_to_stock = 1 WHERE name = 'OK'")
+
+
+def downgrade():
+    op.drop_column('conditions', 'returns_to_stock')
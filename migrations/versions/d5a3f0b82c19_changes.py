@@ -0,0 +1,35 @@
+"""changes
+
+Revision ID: d5a3f0b82c19
+Revises: 9c1d5e7f3a48
+Create Date: 2026-10-17 17:08:15.472930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a3f0b82c19'
+down_revision = '9c1d5e7f3a48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('changes',
+    sa.Column('seq', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=6), nullable=False),
+    sa.Column('date', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('seq')
+    )
+
+    # the sequence of the feed lives in table_versions
+    op.execute("INSERT INTO table_versions (name, version) VALUES ('changes', 0)")
+
+
+def downgrade():
+    op.execute("DELETE FROM table_versions WHERE name = 'changes'")
+    op.drop_table('changes')
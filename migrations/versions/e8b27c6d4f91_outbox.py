@@ -0,0 +1,35 @@
+"""outbox
+
+Revision ID: e8b27c6d4f91
+Revises: d5a3f0b82c19
+Create Date: 2026-10-17 17:51:39.220718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b27c6d4f91'
+down_revision = 'd5a3f0b82c19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('topic', sa.String(length=40), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('next_attempt', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(length=200), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_next_attempt', 'outbox', ['next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_next_attempt', table_name='outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,50 @@
+"""dashboard aggregates
+
+Revision ID: f2c86a1e5b37
+Revises: e8b27c6d4f91
+Create Date: 2026-10-17 18:34:02.716584
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c86a1e5b37'
+down_revision = 'e8b27c6d4f91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_consumption',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('employee_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('lines', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('day', 'employee_id')
+    )
+    op.create_table('kpi_counters',
+    sa.Column('name', sa.String(length=40), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    # the figures of the data so far
+    op.execute(
+        "INSERT INTO daily_consumption (day, employee_id, quantity, lines) "
+        "SELECT DATE(date), user_consumption_id, SUM(COALESCE(quantity, 0)), COUNT(id) "
+        "FROM consum_consumptions WHERE user_consumption_id IS NOT NULL "
+        "GROUP BY DATE(date), user_consumption_id"
+    )
+    op.execute(
+        "INSERT INTO kpi_counters (name, value) "
+        "SELECT 'pending_confirmations', COUNT(id) FROM employees "
+        "WHERE is_confirmed IS NULL OR is_confirmed = 0"
+    )
+
+
+def downgrade():
+    op.drop_table('kpi_counters')
+    op.drop_table('daily_consumption')
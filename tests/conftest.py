@@ -0,0 +1,91 @@
+import pytest
+
+from app import create_app, db, reference, stock
+from app.models import Condition, Consumable, Department, Employee, Package, Parcel, Role, Supplier, Unit
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    Application on an empty database holding an admin (a@a.com), a
+    confirmed employee (u@u.com), a supplier, a unit, a parcel, a condition
+    that returns to stock and one that does not
+    """
+    app = create_app('testing')
+    if not app.config['SQLALCHEMY_DATABASE_URI']:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(
+            tmp_path / 'test.db')
+        # concurrent writers wait for each other instead of failing
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    for table in reference.TABLES:
+        reference.touch(table)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([
+            Department(name='Stores', description='stores'),
+            Role(name='Clerk', description='clerk'),
+            Employee(email='a@a.com', username='admin', first_name='A',
+                     last_name='A', password='secret', is_admin=True,
+                     is_confirmed=True, is_granted=True),
+            Employee(email='u@u.com', username='user', first_name='U',
+                     last_name='U', password='secret', is_confirmed=True,
+                     is_granted=True),
+            Supplier(name='Supplier'),
+            Unit(unit_type='pcs'),
+            Parcel(name='EUR', dimension='1x1'),
+            Condition(name='OK', returns_to_stock=True),
+            Condition(name='Broken', returns_to_stock=False),
+        ])
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def add_consumables(count, quantity=100, min_stock=5):
+    """
+    Ids of count new consumables, their opening quantity booked through
+    the ledger
+    """
+    ids = []
+    for number in range(count):
+        consumable = Consumable(name='consumable {}'.format(number), quantity=0,
+                                min_stock=min_stock, description='test',
+                                unit_id=1, supplier_id=1, user_id=1)
+        db.session.add(consumable)
+        db.session.flush()
+        stock.adjust(Consumable, consumable.id, quantity=quantity)
+        ids.append(consumable.id)
+    return ids
+
+
+def add_packages(count, quantity=100):
+    """
+    Ids of count new packages, all of them inside
+    """
+    ids = []
+    for number in range(count):
+        package = Package(parcel_id=1, description='package {}'.format(number),
+                          quantity=0, inside=0, outside=0)
+        db.session.add(package)
+        db.session.flush()
+        stock.adjust(Package, package.id, quantity=quantity, inside=quantity)
+        ids.append(package.id)
+    return ids
+
+
+def login(client, email):
+    response = client.post('/login', data={'email': email, 'password': 'secret'})
+    assert response.status_code == 302
+
+
+@pytest.fixture
+def admin(app):
+    """
+    Test client logged in as the admin
+    """
+    client = app.test_client()
+    login(client, 'a@a.com')
+    return client
@@ -0,0 +1,31 @@
+from datetime import date
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db, stock
+from app.models import Change, Consumable, DailyConsumption
+
+from conftest import add_consumables
+
+
+def test_savepoint_rollback_keeps_the_pending_changes(app):
+    id, = add_consumables(1)
+    db.session.add(DailyConsumption(day=date.today(), employee_id=2,
+                                    quantity=1, lines=1))
+    db.session.commit()
+    first = db.session.query(db.func.max(Change.seq)).scalar()
+
+    stock._shift(Consumable, id, 'adjustment', quantity=-1)
+    # what stock._accumulate meets when a concurrent submission created
+    # the daily total first
+    try:
+        with db.session.begin_nested():
+            db.session.add(DailyConsumption(day=date.today(), employee_id=2,
+                                            quantity=1, lines=1))
+    except IntegrityError:
+        pass
+    db.session.commit()
+
+    assert [(change.table_name, change.row_id, change.op) for change in
+            Change.query.filter(Change.seq > first)] == \
+        [('consumables', id, 'update')]
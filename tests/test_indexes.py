@@ -0,0 +1,64 @@
+from app import db, stock
+
+from conftest import add_consumables, add_packages
+from test_lists import statements
+
+
+LEDGERS = ('consum_consumptions', 'consum_delivery', 'packagesDelivery',
+           'packagesSend', 'packagesReceive', 'stock_movements')
+
+# view queries that read the ledgers and must find their rows through an
+# index; {consumable} and {package} are filled in with seeded ids
+VIEWS = (
+    '/admin/consumable/details/{consumable}',
+    '/admin/consumable/details/{consumable}/consumption',
+    '/admin/consumable/details/{consumable}/consumption?date_from=2020-01-01&date_to=2100-01-01',
+    '/admin/consumable/details/{consumable}/delivery',
+    '/consumable/details/{consumable}/consumption',
+    '/consumable/details/{consumable}/delivery',
+    '/admin/packages/packages_details/packages_details/{package}',
+    '/admin/packages/packages_details/packages_details/{package}/delivery',
+    '/packages/packages_details/packages_details/{package}/delivery',
+)
+
+
+def full_scans(statement, parameters):
+    """
+    Ledger tables the plan of statement reads from end to end
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement,
+                                          parameters).fetchall()
+        # SEARCH uses an index to find the rows, SCAN reads them all
+        return [table for table in LEDGERS for row in plan
+                if row[-1].startswith('SCAN {}'.format(table))]
+    plan = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).mappings()
+    return [row['table'] for row in plan
+            if row['table'] in LEDGERS and row['type'] in ('ALL', 'index')]
+
+
+def test_ledger_views_use_indexes(app, admin):
+    consumables = add_consumables(5)
+    packages = add_packages(5)
+    for round in range(20):
+        for id in consumables:
+            stock.consume(id, 1, 2)
+            stock.deliver_consumable(id, 1, 1, 1)
+        for id in packages:
+            stock.deliver_package(id, 1, 1, 1, 'delivered')
+            stock.send_package(id, 1, 1, 1, 'sent')
+            stock.receive_package(id, 1, 1, 1, 1, 'back')
+
+    ids = dict(consumable=consumables[2], package=packages[2])
+    scans = []
+    for url in VIEWS:
+        with statements() as seen:
+            response = admin.get(url.format(**ids))
+        assert response.status_code == 200, url
+        for statement, parameters in seen:
+            if statement.lstrip().upper().startswith('SELECT') and \
+                    any(table in statement for table in LEDGERS):
+                scans.extend((url, table)
+                             for table in full_scans(statement, parameters))
+    assert not scans
@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import db, stock
+from app.pagination import encode_cursor, paginate
+from app.models import Consumable, Department, Employee, Package, Parcel, Role, Supplier, Unit
+
+from conftest import add_consumables, add_packages
+
+
+HISTORY = ('consum_consumptions', 'consum_delivery', 'stock_movements')
+
+
+@contextmanager
+def statements():
+    """
+    (statement, parameters) of the SQL run on the database within the
+    block
+    """
+    seen = []
+
+    def executed(conn, cursor, statement, parameters, context, executemany):
+        seen.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', executed)
+    try:
+        yield seen
+    finally:
+        event.remove(engine, 'before_cursor_execute', executed)
+
+
+def test_consumable_lists_leave_the_history_alone(app, admin):
+    ids = add_consumables(60)
+    urls = ('/admin/consumables', '/consumables')
+    # the first request loads the logged-in employee into its cache
+    admin.get('/dashboard')
+    before = dict((url, admin.get(url).headers['X-Rows-Loaded']) for url in urls)
+    for id in ids:
+        stock.consume_many([(id, 1), (id, 2)], 1)
+        stock.deliver_consumable(id, 3, 1, 1)
+
+    for url in urls:
+        with statements() as seen:
+            response = admin.get(url)
+        assert response.status_code == 200
+        assert not [statement for statement, parameters in seen
+                    if any(table in statement for table in HISTORY)]
+        # one page of consumables and their references, however long
+        # their history
+        assert response.headers['X-Rows-Loaded'] == before[url]
+        assert int(before[url]) <= app.config['PAGE_SIZE'] + 5
+
+
+def test_list_pages_run_a_constant_number_of_queries(app, admin):
+    urls = ('/admin/consumables', '/consumables', '/admin/packages',
+            '/packages', '/admin/employees')
+
+    def add(count):
+        # every row gets references of its own, so a select per row would
+        # not be hidden by the identity map
+        for consumable in Consumable.query.filter(
+                Consumable.id.in_(add_consumables(count))):
+            consumable.consumable = Unit(unit_type='unit {}'.format(consumable.id))
+            consumable.supplier = Supplier(name='supplier {}'.format(consumable.id))
+        for package in Package.query.filter(Package.id.in_(add_packages(count))):
+            package.parcel = Parcel(name='parcel {}'.format(package.id))
+        start = Employee.query.count()
+        db.session.add_all([
+            Employee(email='e{}@e.com'.format(number),
+                     username='employee {}'.format(number),
+                     first_name='E', last_name='E', password='secret',
+                     department=Department(name='department {}'.format(number)),
+                     role=Role(name='role {}'.format(number)))
+            for number in range(start, start + count)])
+        db.session.commit()
+
+    admin.get('/dashboard')
+    add(5)
+    few = dict((url, admin.get(url).headers['X-SQL-Queries']) for url in urls)
+    add(35)
+    many = dict((url, admin.get(url).headers['X-SQL-Queries']) for url in urls)
+    assert many == few
+
+
+def test_malformed_cursors_are_rejected(app, admin):
+    add_consumables(3)
+    for values in ([{'a': 1}, 1], [['a'], 1], ['a', 'b'], ['a', 1.5], ['a', None],
+                   ['a', True], ['a'], 'a'):
+        cursor = encode_cursor(values)
+        for sort in ('name', 'id', 'quantity'):
+            response = admin.get('/admin/consumables?sort={}&after={}'.format(sort, cursor))
+            assert response.status_code == 400, (values, sort)
+    response = admin.get('/admin/consumables?sort=name&after=' + encode_cursor(['a', 1]))
+    assert response.status_code == 200
+
+
+def test_pages_keep_null_sort_values_in_order(app):
+    ids = add_consumables(7)
+    for id, description in zip(ids, (None, 'b', None, 'a', 'b', None, 'c')):
+        Consumable.query.get(id).description = description
+    db.session.commit()
+    sortable = {'id': Consumable.id, 'description': Consumable.description}
+
+    def walk(direction, forwards):
+        seen = []
+        cursor = None
+        while True:
+            arguments = 'sort=description&dir={}&size=2'.format(direction)
+            if cursor is not None:
+                arguments += '&{}={}'.format('after' if forwards else 'before', cursor)
+            with app.test_request_context('/?' + arguments):
+                page = paginate(Consumable.query, Consumable, sortable)
+            items = [item.id for item in page.items]
+            seen = seen + items if forwards else items + seen
+            cursor = page.next_cursor if forwards else page.prev_cursor
+            if cursor is None:
+                return seen
+
+    # NULLs first, then the values, ties broken by id
+    ascending = [ids[0], ids[2], ids[5], ids[3], ids[1], ids[4], ids[6]]
+    descending = [ids[6], ids[4], ids[1], ids[3], ids[5], ids[2], ids[0]]
+    assert walk('asc', True) == ascending
+    assert walk('desc', True) == descending
+
+    # and back from the last page
+    with app.test_request_context('/?sort=description&size=2&after=' +
+                                  encode_cursor(['b', ids[4]])):
+        last = paginate(Consumable.query, Consumable, sortable)
+    assert [item.id for item in last.items] == [ids[6]]
+    cursor = last.prev_cursor
+    seen = [ids[6]]
+    while cursor is not None:
+        with app.test_request_context('/?sort=description&size=2&before=' + cursor):
+            page = paginate(Consumable.query, Consumable, sortable)
+        seen = [item.id for item in page.items] + seen
+        cursor = page.prev_cursor
+    assert seen == ascending
+
+
+def test_sorting_on_a_nullable_column_uses_its_index(app, admin):
+    admin.get('/dashboard')
+    cursor = encode_cursor(['a@a.com', 1])
+    for url in ('/admin/employees?sort=email', '/admin/employees?sort=email&dir=desc',
+                '/admin/employees?sort=email&after=' + cursor):
+        with statements() as seen:
+            assert admin.get(url).status_code == 200
+        listed = [(statement, parameters) for statement, parameters in seen
+                  if 'ORDER BY employees.email' in statement]
+        assert listed, url
+        for statement, parameters in listed:
+            connection = db.session.connection()
+            if connection.dialect.name != 'sqlite':
+                continue
+            plan = ' '.join(row[-1] for row in connection.exec_driver_sql(
+                'EXPLAIN QUERY PLAN ' + statement, parameters))
+            assert 'TEMP B-TREE FOR ORDER BY' not in plan, (url, plan)
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from app import db, stock
+from app.models import Consumable, StockMovement, StockSnapshot
+
+from conftest import add_consumables, add_packages
+from test_lists import statements
+
+
+def test_snapshots_follow_the_ledger(app):
+    app.config['SNAPSHOT_SETTLE_SECONDS'] = 0
+    consumables = add_consumables(3, quantity=10)
+    packages = add_packages(2, quantity=5)
+    assert stock.take_snapshot() == []
+
+    stock.consume(consumables[0], 2, 2)
+    middle = datetime.now()
+    stock.consume_many([(consumables[0], 1), (consumables[1], 4)], 2)
+    stock.send_package(packages[0], 3, 1, 1, 'sent')
+    assert stock.take_snapshot() == []
+    assert stock.take_snapshot() == []
+
+    newest = db.session.query(db.func.max(StockMovement.id)).scalar()
+    snapshots = StockSnapshot.query.filter(StockSnapshot.movement_id == newest)
+    assert sorted((row.item_type, row.item_id) for row in snapshots) == sorted(
+        [('consumables', consumables[0]), ('consumables', consumables[1]),
+         ('packages', packages[0])])
+    assert stock.balance_at(Consumable, consumables[0], middle)['quantity'] == 8
+    assert stock.balance_at(Consumable, consumables[0],
+                            datetime.now())['quantity'] == 7
+
+
+def test_a_run_reads_only_the_movements_since_the_last(app):
+    app.config['SNAPSHOT_SETTLE_SECONDS'] = 0
+    ids = add_consumables(30)
+    stock.take_snapshot()
+    stock.consume(ids[0], 1, 2)
+
+    with statements() as seen:
+        stock.take_snapshot()
+    tails = [(statement, parameters) for statement, parameters in seen
+             if 'FROM stock_movements' in statement and
+             'GROUP BY stock_movements.item_type' in statement]
+    assert len(tails) == 1
+    # bounded below by the newest snapshot, not read from the start
+    assert 'stock_movements.id >' in tails[0][0]
+    snapshots = [statement for statement, parameters in seen
+                 if 'FROM stock_snapshots' in statement and 'IN (' in statement]
+    assert snapshots
+
+
+def test_recent_movements_wait_for_the_settling_time(app):
+    app.config['SNAPSHOT_SETTLE_SECONDS'] = 0
+    id, = add_consumables(1)
+    stock.take_snapshot()
+    app.config['SNAPSHOT_SETTLE_SECONDS'] = 600
+    stock.consume(id, 1, 2)
+    assert stock.take_snapshot() == []
+    newest = db.session.query(db.func.max(StockMovement.id)).scalar()
+    assert StockSnapshot.query.filter(StockSnapshot.movement_id == newest).count() == 0
@@ -0,0 +1,160 @@
+import json
+import threading
+
+from sqlalchemy import func
+
+from app import db, importer, stock
+from app.models import Change, Consumable, ConsumableConsumption, ConsumableDelivery, OutboxMessage, Package, StockMovement
+
+from conftest import add_consumables, add_packages, login
+from test_lists import statements
+
+
+def ledger(model, id):
+    """
+    Balance of one item summed from its stock movements
+    """
+    quantity, inside, outside = db.session.query(
+        func.coalesce(func.sum(StockMovement.quantity), 0),
+        func.coalesce(func.sum(StockMovement.inside), 0),
+        func.coalesce(func.sum(StockMovement.outside), 0)) \
+        .filter(StockMovement.item_type == model.__tablename__,
+                StockMovement.item_id == id).one()
+    return dict(quantity=quantity, inside=inside, outside=outside)
+
+
+def test_consumable_movements_match_the_counter(app):
+    id, = add_consumables(1, quantity=20)
+    stock.consume(id, 3, 2)
+    stock.deliver_consumable(id, 10, 1, 1)
+    stock.consume_many([(id, 2), (id, 4)], 2)
+    stock.deliver_consumables([(id, 5, 1)], 1)
+
+    db.session.expire_all()
+    assert Consumable.query.get(id).quantity == 20 - 3 + 10 - 2 - 4 + 5
+    assert ledger(Consumable, id)['quantity'] == Consumable.query.get(id).quantity
+    assert ConsumableConsumption.query.count() == 3
+    assert ConsumableDelivery.query.count() == 2
+
+
+def test_package_movements_match_the_counters(app):
+    id, = add_packages(1, quantity=10)
+    stock.deliver_package(id, 5, 1, 1, 'delivered')
+    stock.send_package(id, 8, 1, 1, 'sent')
+    stock.receive_package(id, 3, 1, 1, 1, 'back in stock')
+    stock.receive_package(id, 2, 1, 1, 2, 'broken')
+
+    db.session.expire_all()
+    package = Package.query.get(id)
+    assert (package.quantity, package.inside, package.outside) == (13, 10, 3)
+    assert ledger(Package, id) == dict(quantity=13, inside=10, outside=3)
+
+
+def test_edit_keeps_movements_made_while_the_form_was_open(app, admin):
+    id, = add_consumables(1, quantity=20)
+    admin.post('/admin/consumables/consumption/{}'.format(id), data={'quantity': 4})
+    form = {'name': 'consumable 0', 'min_stock': 5, 'description': 'test',
+            'unit_id': 1, 'supplier_id': 1, 'loaded_quantity': 20}
+
+    admin.post('/admin/consumables/edit/{}'.format(id), data=dict(form, quantity=20))
+    db.session.expire_all()
+    assert Consumable.query.get(id).quantity == 16
+
+    admin.post('/admin/consumables/edit/{}'.format(id), data=dict(form, quantity=25))
+    db.session.expire_all()
+    assert Consumable.query.get(id).quantity == 21
+    assert ledger(Consumable, id)['quantity'] == 21
+
+
+def test_concurrent_submissions_lose_no_update(app):
+    consumable_id, = add_consumables(1, quantity=1000)
+    package_id, = add_packages(1, quantity=1000)
+    workers, rounds = 8, 10
+    errors = []
+
+    def submit():
+        client = app.test_client()
+        login(client, 'a@a.com')
+        try:
+            for number in range(rounds):
+                for url, data in (
+                        ('/admin/consumables/consumption/{}', {'quantity': 3}),
+                        ('/admin/consumables/delivery/{}', {'quantity': 1,
+                                                           'supplier_id': 1}),
+                        ('/admin/packages/send/{}', {'quantity': 2, 'supplier_id': 1,
+                                                     'description': 'out'}),
+                        ('/admin/packages/receive/{}', {'quantity': 1, 'supplier': 1,
+                                                        'condition': 1,
+                                                        'description': 'back'})):
+                    response = client.post(url.format(
+                        package_id if 'packages' in url else consumable_id), data=data)
+                    assert response.status_code == 302, response.status_code
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=submit) for number in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    db.session.expire_all()
+    submissions = workers * rounds
+    consumable = Consumable.query.get(consumable_id)
+    assert consumable.quantity == 1000 - 3 * submissions + submissions
+    assert ledger(Consumable, consumable_id)['quantity'] == consumable.quantity
+    package = Package.query.get(package_id)
+    assert (package.quantity, package.inside, package.outside) == \
+        (1000, 1000 - submissions, submissions)
+    assert ledger(Package, package_id) == dict(quantity=1000,
+                                               inside=1000 - submissions,
+                                               outside=submissions)
+
+
+def test_outbox_messages_carry_their_movement(app):
+    ids = add_consumables(3, quantity=50)
+    stock.consume_many([(ids[0], 1), (ids[1], 2), (ids[2], 3)], 2)
+    stock.deliver_consumables([(ids[2], 4, 1), (ids[0], 5, 1)], 1)
+    report = importer.import_rows('consumables', [
+        (2, {'name': 'consumable 1', 'quantity': '30', 'unit': 'pcs',
+             'supplier': 'Supplier'}),
+        (3, {'name': 'new', 'quantity': '7', 'unit': 'pcs',
+             'supplier': 'Supplier'})])
+    assert report.rejected == 0
+
+    movements = dict((movement.id, movement) for movement in StockMovement.query)
+    payloads = [json.loads(message.payload) for message in OutboxMessage.query]
+    assert len(payloads) == len(movements) == \
+        len(set(payload['movement_id'] for payload in payloads))
+    for payload in payloads:
+        movement = movements[payload['movement_id']]
+        assert (movement.item_type, movement.item_id, movement.quantity) == \
+            (payload['item_type'], payload['item_id'], payload['quantity'])
+
+
+def test_bulk_submissions_run_a_constant_number_of_statements(app):
+    ids = add_consumables(40, quantity=100)
+
+    def count(submit, lines):
+        with statements() as seen:
+            submit(lines)
+        return len(seen)
+
+    for submit, line in (
+            (lambda lines: stock.consume_many(lines, 2), lambda id: (id, 1)),
+            (lambda lines: stock.deliver_consumables(lines, 1),
+             lambda id: (id, 1, 1))):
+        # the first consumption of the day creates its daily total
+        submit([line(ids[0])])
+        few = count(submit, [line(id) for id in ids[:5]])
+        many = count(submit, [line(id) for id in ids])
+        assert many == few
+
+    # every ledger row reached the change feed
+    for model in (ConsumableConsumption, ConsumableDelivery):
+        rows = set(id for id, in db.session.query(model.id))
+        announced = set(row_id for row_id, in db.session.query(Change.row_id)
+                        .filter(Change.table_name == model.__tablename__,
+                                Change.op == 'insert'))
+        assert rows == announced and len(rows) == 46